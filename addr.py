@@ -1,6 +1,8 @@
 # -*- encoding: utf-8 -*-
 
+import bisect
 import enum
+import typing
 import iface_class
 
 class AddrType(enum.Enum):
@@ -25,3 +27,63 @@ class AddrRange(iface_class.JsonEnabled):
         self.space: int = space
         # 采集时前置sleep毫秒数
         self.ts_presleep: int = ts_presleep
+
+# modbus 单次请求最大寄存器数
+MODBUS_MAX_REGS = 125
+# modbus 单次请求最大位数
+MODBUS_MAX_BITS = 2000
+
+def is_bit_type(addr_type: AddrType) -> bool:
+    """ 是否为位地址类型 """
+    return addr_type in (AddrType.MODBUS_INPUT_BITS, AddrType.MODBUS_BITS)
+
+def plan_addr_range(ranges: typing.List[AddrRange], gap: int = 0,
+                    max_regs: int = MODBUS_MAX_REGS, max_bits: int = MODBUS_MAX_BITS
+                    ) -> typing.Tuple[typing.List[AddrRange], typing.List[typing.List[int]]]:
+    """ 合并采集地址区间, 减少请求次数
+
+    按 (地址类型, 地址空间号) 分组, 间隔不超过 gap 的区间合并为一次请求, 单次请求不超过协议上限;
+    超过上限的单个区间被拆分. 合并后区间的 ts_presleep 取其包含的原区间的最大值.
+    返回 (合并后的区间列表, 每个原区间对应的合并后区间下标列表).
+    """
+    groups: typing.Dict[typing.Tuple[int, int], typing.List[int]] = {}
+    for i, r in enumerate(ranges):
+        if r.addr_end > r.addr_begin:
+            groups.setdefault((r.addr_type.value, r.space), []).append(i)
+
+    plan: typing.List[AddrRange] = []
+    mapping: typing.List[typing.List[int]] = [[] for _ in ranges]
+    for (addr_type, space), members in sorted(groups.items()):
+        limit = max_bits if is_bit_type(AddrType(addr_type)) else max_regs
+        members.sort(key=lambda i: (ranges[i].addr_begin, ranges[i].addr_end))
+        first = len(plan)
+        chunk: AddrRange = None
+        for i in members:
+            r = ranges[i]
+            begin = r.addr_begin
+            if chunk is not None:
+                if r.addr_end <= chunk.addr_end:
+                    # 完全被已有请求覆盖
+                    continue
+                if begin <= chunk.addr_end + gap and r.addr_end - chunk.addr_begin <= limit:
+                    chunk.addr_end = r.addr_end
+                    continue
+                if begin < chunk.addr_end:
+                    # 与已有请求重叠的部分已被采集
+                    begin = chunk.addr_end
+            while begin < r.addr_end:
+                end = min(r.addr_end, begin + limit)
+                chunk = AddrRange(AddrType(addr_type), begin, end, space)
+                plan.append(chunk)
+                begin = end
+
+        # 组内请求按地址有序且不重叠: 原区间对应与其相交的全部请求
+        chunks = plan[first:]
+        begins = [c.addr_begin for c in chunks]
+        ends = [c.addr_end for c in chunks]
+        for i in members:
+            r = ranges[i]
+            for j in range(bisect.bisect_right(ends, r.addr_begin), bisect.bisect_left(begins, r.addr_end)):
+                chunks[j].ts_presleep = max(chunks[j].ts_presleep, r.ts_presleep)
+                mapping[i].append(first + j)
+    return plan, mapping
@@ -3,6 +3,7 @@
 import abc
 import typing
 import segment
+from segment import ByteOrder
 
 class AddressSpace(abc.ABC):
     @abc.abstractmethod
@@ -14,30 +15,56 @@ class AddressSpace(abc.ABC):
         return 0
 
     @abc.abstractmethod
-    def u16(self, addr: int, space: int = 0) -> int:
+    def u16(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
         return 0
 
     @abc.abstractmethod
-    def i16(self, addr: int, space: int = 0) -> int:
+    def i16(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
         return 0
 
     @abc.abstractmethod
-    def u32(self, addr: int, space: int = 0) -> int:
+    def u32(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
         return 0
 
     @abc.abstractmethod
-    def i32(self, addr: int, space: int = 0) -> int:
+    def i32(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
         return 0
 
     @abc.abstractmethod
-    def f32(self, addr: int, space: int = 0) -> float:
+    def u64(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return 0
+
+    @abc.abstractmethod
+    def i64(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return 0
+
+    @abc.abstractmethod
+    def f32(self, addr: int, space: int = 0, order: ByteOrder = None) -> float:
+        return 0.0
+
+    @abc.abstractmethod
+    def f64(self, addr: int, space: int = 0, order: ByteOrder = None) -> float:
         return 0.0
 
+    @abc.abstractmethod
+    def string(self, addr: int, count: int, space: int = 0, order: ByteOrder = None) -> str:
+        return ""
+
+    @abc.abstractmethod
+    def array(self, addr: int, count: int, dtype: str = "u16", order: ByteOrder = None, stride: int = 0,
+              space: int = 0, scale: float = None, offset: float = None):
+        """ 批量读取连续寄存器块, 可选线性变换 value * scale + offset """
+        return []
+
 class ModbusAddressSpace(AddressSpace):
-    def __init__(self, segset: segment.SegmentSet, defspace: int = 1) -> None:
+    def __init__(self, segset: segment.SegmentSet, defspace: int = 1, order: ByteOrder = ByteOrder.ABCD) -> None:
         super().__init__()
         self.segset = segset
         self.defspace = defspace
+        # 默认字节序, 单次读取可通过 order 参数覆盖
+        self.order = order
+        # 客户端提供的设备ID, 用于驱动区分设备
+        self.device_id: str = ""
 
     def default_space(self, space: int) -> typing.NoReturn:
         self.defspace = space
@@ -45,21 +72,50 @@ class ModbusAddressSpace(AddressSpace):
     def bit(self, addr: int, space: int = 0) -> int:
         return self.ref(addr, space).bit(addr)
         
-    def u16(self, addr: int, space: int = 0) -> int:
-        return self.ref(addr, space).u16le(addr)
+    def u16(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "u16", order or self.order)
     
-    def i16(self, addr: int, space: int = 0) -> int:
-        return self.ref(addr, space).i16le(addr)
+    def i16(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "i16", order or self.order)
 
-    def u32(self, addr: int, space: int = 0) -> int:
-        return self.ref(addr, space).u32be(addr)
+    def u32(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "u32", order or self.order)
     
-    def i32(self, addr: int, space: int = 0) -> int:
-        return self.ref(addr, space).i32be(addr)
+    def i32(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "i32", order or self.order)
+
+    def u64(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "u64", order or self.order)
+
+    def i64(self, addr: int, space: int = 0, order: ByteOrder = None) -> int:
+        return self.ref(addr, space).value(addr, "i64", order or self.order)
+
+    def f32(self, addr: int, space: int = 0, order: ByteOrder = None) -> float:
+        return self.ref(addr, space).value(addr, "f32", order or self.order)
+
+    def f64(self, addr: int, space: int = 0, order: ByteOrder = None) -> float:
+        return self.ref(addr, space).value(addr, "f64", order or self.order)
+
+    def string(self, addr: int, count: int, space: int = 0, order: ByteOrder = None) -> str:
+        return self.ref(addr, space).string(addr, count, order or self.order)
 
-    def f32(self, addr: int, space: int = 0) -> float:
-        return self.ref(addr, space).f32(addr)
+    def array(self, addr: int, count: int, dtype: str = "u16", order: ByteOrder = None, stride: int = 0,
+              space: int = 0, scale: float = None, offset: float = None):
+        order = order or self.order
+        size = segment.DECODERS[(dtype, order)][0]
+        step = stride if stride > 0 else size * 8 // 16
+        seg = self.ref(addr, space)
+        if seg.width >= 8 and seg.contains(addr, (count - 1) * step + size * 8 // seg.width):
+            values = seg.array(addr, count, dtype, order, stride)
+        else:
+            # 跨段读取: 逐个元素定位所在段
+            values = segment.zeros(dtype, count)
+            for i in range(count):
+                values[i] = self.ref(addr + i * step, space).value(addr + i * step, dtype, order)
+        if scale is None and offset is None:
+            return values
+        return segment.scale_block(values, 1.0 if scale is None else scale, 0.0 if offset is None else offset)
 
     def ref(self, addr: int, space: int) -> segment.Segment:
         s: int = space if space != 0 else self.defspace
-        return self.segset.ref(addr, s)
\ No newline at end of file
+        return self.segset.ref(addr, s)
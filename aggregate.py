@@ -0,0 +1,205 @@
+# -*- encoding: utf-8 -*-
+
+""" 电池系统聚合: 电芯 -> 簇 -> 堆的 AggIndicator 计算
+
+电芯数据按列 (指标名 -> 数值序列) 传入, 可直接使用 AddressSpace.array 的结果.
+min/max/avg 为电芯值的统计, min_id/max_id 为最值所在元素的ID (簇级为电芯ID, 堆级为簇ID),
+mass 为系统值, 按指标的聚合规则计算:
+
+    指标            簇 (电芯串联)    堆 (簇并联)
+    voltage         sum             mean
+    current         mean            sum
+    temperature     mean            wmean (按电芯数加权)
+    soc / soh       mean            wmean
+    r               sum             parallel (1 / sum(1 / r))
+    positive_ir     min             min
+    negative_ir     min             min
+
+NaN 值 (无效电芯) 不参与统计. 安装 NumPy 时使用向量化计算.
+"""
+
+import typing
+
+from devdata import DDOfCluster, DDOfStack
+from devfield import AggIndicator, BatteryRuntime, BatterySystemRuntime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 聚合指标, 与 BatterySystemRuntime/BatteryRuntime 的字段一致
+METRICS: typing.Tuple[str, ...] = BatterySystemRuntime.__slots__
+
+# 电芯 -> 簇 的 mass 聚合规则
+CELL_RULES: typing.Dict[str, str] = {
+    "voltage": "sum",
+    "current": "mean",
+    "temperature": "mean",
+    "soc": "mean",
+    "soh": "mean",
+    "r": "sum",
+    "positive_ir": "min",
+    "negative_ir": "min",
+}
+
+# 簇 -> 堆 的 mass 聚合规则
+CLUSTER_RULES: typing.Dict[str, str] = {
+    "voltage": "mean",
+    "current": "sum",
+    "temperature": "wmean",
+    "soc": "wmean",
+    "soh": "wmean",
+    "r": "parallel",
+    "positive_ir": "min",
+    "negative_ir": "min",
+}
+
+class ColumnStats:
+    """ 单列统计, 最值下标为列内位置 """
+    __slots__ = ("count", "total", "min", "max", "min_index", "max_index")
+
+    def __init__(self, count: int = 0, total: float = 0.0, min: float = 0.0, max: float = 0.0,
+                 min_index: int = 0, max_index: int = 0) -> None:
+        self.count = count
+        self.total = total
+        self.min = min
+        self.max = max
+        self.min_index = min_index
+        self.max_index = max_index
+
+def column_stats(values: typing.Sequence[float]) -> ColumnStats:
+    """ 纯 Python 统计, 跳过 NaN """
+    if len(values) == 0:
+        return ColumnStats()
+    if any(v != v for v in values):
+        valid = [(v, i) for i, v in enumerate(values) if v == v]
+        if not valid:
+            return ColumnStats()
+        lo = min(valid)
+        hi = max(valid, key=lambda vi: (vi[0], -vi[1]))
+        return ColumnStats(len(valid), sum(v for v, _ in valid), lo[0], hi[0], lo[1], hi[1])
+    if not isinstance(values, list):
+        values = list(values)
+    lo = min(values)
+    hi = max(values)
+    return ColumnStats(len(values), sum(values), lo, hi, values.index(lo), values.index(hi))
+
+def numpy_stats(columns: typing.List[typing.Sequence[float]]) -> typing.List[ColumnStats]:
+    """ NumPy 统计: 等长的列合并为二维数组, 每种统计一次完成 """
+    data = numpy.vstack([numpy.asarray(c, dtype=numpy.float64) for c in columns])
+    if data.shape[1] == 0:
+        return [ColumnStats() for _ in columns]
+    nan = numpy.isnan(data)
+    if nan.any():
+        counts = (~nan).sum(axis=1)
+        low = numpy.where(nan, numpy.inf, data)
+        high = numpy.where(nan, -numpy.inf, data)
+        totals = numpy.where(nan, 0.0, data).sum(axis=1)
+    else:
+        counts = numpy.full(len(columns), data.shape[1])
+        low = high = data
+        totals = data.sum(axis=1)
+    min_index = low.argmin(axis=1)
+    max_index = high.argmax(axis=1)
+    rows = numpy.arange(len(columns))
+    mins = low[rows, min_index]
+    maxs = high[rows, max_index]
+    result = []
+    for i in range(len(columns)):
+        if counts[i] == 0:
+            result.append(ColumnStats())
+        else:
+            result.append(ColumnStats(int(counts[i]), float(totals[i]), float(mins[i]), float(maxs[i]),
+                                      int(min_index[i]), int(max_index[i])))
+    return result
+
+def stats_of(columns: typing.Dict[str, typing.Sequence[float]]) -> typing.Dict[str, ColumnStats]:
+    names = [m for m in METRICS if m in columns]
+    if numpy is not None and names and len(set(len(columns[m]) for m in names)) == 1:
+        return dict(zip(names, numpy_stats([columns[m] for m in names])))
+    return {m: column_stats(columns[m]) for m in names}
+
+def columns_of(cells: typing.List[BatteryRuntime]) -> typing.Dict[str, typing.List[float]]:
+    """ 电芯对象列表转换为列 """
+    return {m: [getattr(c, m) for c in cells] for m in METRICS}
+
+def element_id(ids: typing.Optional[typing.Sequence[int]], index: int, id_base: int) -> int:
+    return int(ids[index]) if ids is not None else index + id_base
+
+def aggregate_cells(runtime: BatterySystemRuntime, columns: typing.Dict[str, typing.Sequence[float]],
+                    ids: typing.Sequence[int] = None, id_base: int = 1,
+                    rules: typing.Dict[str, str] = CELL_RULES) -> typing.Dict[str, ColumnStats]:
+    """ 由电芯列数据计算簇的聚合指标, 只填写 columns 中存在的指标
+
+    ids 为各电芯的ID, 缺省为位置 + id_base. 返回各指标的统计.
+    """
+    stats = stats_of(columns)
+    for m, s in stats.items():
+        ind: AggIndicator = getattr(runtime, m)
+        if s.count == 0:
+            ind.reset()
+            continue
+        avg = s.total / s.count
+        rule = rules[m]
+        ind.mass = s.total if rule == "sum" else (s.min if rule == "min" else avg)
+        ind.avg = avg
+        ind.min = s.min
+        ind.max = s.max
+        ind.min_id = element_id(ids, s.min_index, id_base)
+        ind.max_id = element_id(ids, s.max_index, id_base)
+    return stats
+
+def aggregate_cluster(cluster: DDOfCluster, columns: typing.Dict[str, typing.Sequence[float]] = None,
+                      ids: typing.Sequence[int] = None, id_base: int = 1) -> typing.Dict[str, ColumnStats]:
+    """ 计算簇的 runtime, columns 缺省时取自 cluster.battery """
+    if columns is None:
+        columns = columns_of(cluster.battery)
+    return aggregate_cells(cluster.runtime, columns, ids, id_base)
+
+def rollup(runtime: BatterySystemRuntime, parts: typing.List[BatterySystemRuntime], weights: typing.List[float],
+           ids: typing.Sequence[int] = None, id_base: int = 1, rules: typing.Dict[str, str] = CLUSTER_RULES) -> None:
+    """ 由下级系统的聚合指标计算上级系统的聚合指标, weights 为各下级的电芯数 """
+    valid = [i for i, w in enumerate(weights) if w > 0]
+    for m in METRICS:
+        ind: AggIndicator = getattr(runtime, m)
+        if not valid:
+            ind.reset()
+            continue
+        items = [getattr(parts[i], m) for i in valid]
+        w = [weights[i] for i in valid]
+        total_weight = float(sum(w))
+        lo = min(range(len(items)), key=lambda k: items[k].min)
+        hi = max(range(len(items)), key=lambda k: (items[k].max, -k))
+        ind.avg = sum(it.avg * wk for it, wk in zip(items, w)) / total_weight
+        ind.min = items[lo].min
+        ind.max = items[hi].max
+        ind.min_id = element_id(ids, valid[lo], id_base)
+        ind.max_id = element_id(ids, valid[hi], id_base)
+        rule = rules[m]
+        if rule == "sum":
+            ind.mass = sum(it.mass for it in items)
+        elif rule == "mean":
+            ind.mass = sum(it.mass for it in items) / len(items)
+        elif rule == "wmean":
+            ind.mass = sum(it.mass * wk for it, wk in zip(items, w)) / total_weight
+        elif rule == "parallel":
+            ind.mass = 0.0 if any(it.mass == 0 for it in items) else 1.0 / sum(1.0 / it.mass for it in items)
+        else:
+            ind.mass = min(it.mass for it in items)
+
+def aggregate_stack(stack: DDOfStack, counts: typing.List[int] = None, ids: typing.Sequence[int] = None,
+                    id_base: int = 1) -> None:
+    """ 由各簇的 runtime 计算堆的 runtime. counts 为各簇的有效电芯数, 缺省为 len(cluster.battery) """
+    if counts is None:
+        counts = [len(c.battery) for c in stack.cluster]
+    rollup(stack.runtime, [c.runtime for c in stack.cluster], counts, ids, id_base)
+
+def aggregate_stack_cells(stack: DDOfStack, columns: typing.List[typing.Dict[str, typing.Sequence[float]]] = None,
+                          id_base: int = 1) -> None:
+    """ 一次完成电芯 -> 簇 -> 堆的聚合. columns 为各簇的电芯列数据, 缺省取自各簇的 battery """
+    counts = []
+    for i, cluster in enumerate(stack.cluster):
+        stats = aggregate_cluster(cluster, None if columns is None else columns[i], None, id_base)
+        counts.append(max((s.count for s in stats.values()), default=0))
+    aggregate_stack(stack, counts, None, id_base)
@@ -0,0 +1,242 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import concurrent.futures
+import functools
+import http
+import logging
+import time
+import traceback
+import typing
+
+import profiling
+from service import DriverService, Response, is_exec_request, route_label
+
+logger = logging.getLogger("driver")
+
+# 请求行/头部的最大长度
+MAX_LINE = 8192
+# 请求头的最大个数
+MAX_HEADERS = 100
+# 请求体的最大长度
+MAX_BODY = 64 * 1024 * 1024
+
+class BadRequest(Exception):
+    """ 请求格式错误, 响应后关闭连接 """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+class AioDriverServer:
+    """ 基于 asyncio 的驱动服务端
+
+    支持 HTTP/1.1 持久连接和流水线请求 (同一连接上的请求按序处理和响应),
+    通过 max_concurrency 限制同时处理的请求数, 路由与 http_server 一致.
+    """
+
+    def __init__(self, service: DriverService, host: str = "", port: int = 10099, backlog: int = 128,
+                 max_concurrency: int = 64, keepalive_timeout: float = 60.0,
+                 executor: concurrent.futures.Executor = None) -> None:
+        self.service = service
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        # 连接空闲超时秒数
+        self.keepalive_timeout = keepalive_timeout
+        # 请求处理执行器, 缺省为 max_concurrency 个线程的线程池; 处理不在事件循环线程内进行,
+        # 慢请求不会阻塞其他连接, 同时处理的请求数由 semaphore 限制
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_concurrency, "aio") if executor is None else executor
+        self.max_concurrency = max_concurrency
+        self.semaphore: asyncio.Semaphore = None
+        self.exec_semaphore: asyncio.Semaphore = None
+        self.server: asyncio.AbstractServer = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.exec_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host or None, self.port, backlog=self.backlog, limit=MAX_LINE)
+        return self.server
+
+    async def serve_forever(self) -> None:
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.keepalive_timeout)
+                except BadRequest as e:
+                    await self.write_response(writer, e.status, b"", False)
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                keep_alive = self.want_keep_alive(version, headers)
+
+                if method == "GET":
+                    # GET 处理可能等待 (如 /v1/job 长轮询), 不在事件循环线程内执行
+                    res = await asyncio.get_running_loop().run_in_executor(None, self.service.handle_get, path)
+                elif method == "POST":
+                    res = await self.process(path, body, headers)
+                else:
+                    await self.write_response(writer, http.HTTPStatus.NOT_IMPLEMENTED, b"", keep_alive)
+                    continue
+
+                t0 = time.perf_counter()
+                if res.chunks is not None:
+                    # HTTP/1.0 客户端不支持分块传输, 以关闭连接结束响应体
+                    keep_alive = keep_alive and version == "HTTP/1.1"
+                    await self.write_stream(writer, res, version == "HTTP/1.1", keep_alive, path)
+                else:
+                    await self.write_response(writer, res.status, res.body, keep_alive, res.content_type, res.headers)
+                self.service.metrics.observe("qingems_phase_seconds", (route_label(path), "write"), time.perf_counter() - t0)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_line(self, reader: asyncio.StreamReader, status: int) -> bytes:
+        """ 读取请求行/头部行, 超过 MAX_LINE 时以 status 响应 """
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise BadRequest(status, "line too long")
+
+    async def read_request(self, reader: asyncio.StreamReader) -> typing.Optional[tuple]:
+        """ 读取一个请求, 连接正常关闭时返回 None """
+        line = await self.read_line(reader, http.HTTPStatus.REQUEST_URI_TOO_LONG)
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise BadRequest(http.HTTPStatus.BAD_REQUEST, "bad request line")
+        method, path, version = parts
+
+        headers: typing.Dict[str, str] = {}
+        while True:
+            line = await self.read_line(reader, http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise BadRequest(http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "too many headers")
+            name, colon, value = line.decode("latin-1").partition(":")
+            if not colon or not name.strip():
+                raise BadRequest(http.HTTPStatus.BAD_REQUEST, "bad header line")
+            headers[name.strip().lower()] = value.strip()
+
+        if "transfer-encoding" in headers:
+            raise BadRequest(http.HTTPStatus.LENGTH_REQUIRED, "chunked request body is not supported")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise BadRequest(http.HTTPStatus.BAD_REQUEST, "bad content-length")
+        if length < 0 or length > MAX_BODY:
+            raise BadRequest(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request body too large")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, path, version, headers, body
+
+    def want_keep_alive(self, version: str, headers: typing.Dict[str, str]) -> bool:
+        conn = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            return conn != "close"
+        return conn == "keep-alive"
+
+    async def process(self, path: str, body: bytes, headers: typing.Dict[str, str]) -> Response:
+        """ 解码请求后按内容调度: 含设备指令的请求 (可能等待指令队列) 使用独立的并发限制和默认线程池, 不占用解析请求的资源 """
+        args = (path, body, headers.get("content-type", ""), headers.get("accept", ""), headers.get("if-none-match", ""),
+                headers.get(profiling.PROFILE_HEADER.lower(), ""))
+
+        def handle_unless_exec() -> typing.Tuple[typing.Any, typing.Optional[Response]]:
+            """ 返回 (已解码的请求, 响应), 含设备指令的请求不处理, 响应为 None """
+            try:
+                request = self.service.decode(path, body, args[2])
+            except Exception:
+                # 格式错误的请求由 handle 重新解码, 记录错误指标后抛出
+                return None, self.service.handle(*args)
+            if is_exec_request(path, request):
+                return request, None
+            return request, self.service.handle(*args, request)
+
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.semaphore:
+                request, res = await loop.run_in_executor(self.executor, handle_unless_exec)
+            if res is not None:
+                return res
+            async with self.exec_semaphore:
+                return await loop.run_in_executor(None, functools.partial(self.service.handle, *args, request=request))
+        except Exception as e:
+            logger.error("[DRIVER] [POST] [%s] FAIL [%s]: \n%s", path, str(e), traceback.format_exc())
+            return Response(b"", None, http.HTTPStatus.BAD_REQUEST)
+
+    async def write_response(self, writer: asyncio.StreamWriter, status: int, body: bytes, keep_alive: bool,
+                             content_type: str = None, headers: typing.Dict[str, str] = None) -> None:
+        status = http.HTTPStatus(status)
+        head = "HTTP/1.1 %d %s\r\n" % (status.value, status.phrase)
+        if content_type:
+            head += "Content-type: %s\r\n" % content_type
+        for name, value in (headers or {}).items():
+            head += "%s: %s\r\n" % (name, value)
+        head += "Content-Length: %d\r\n" % len(body)
+        head += "Connection: %s\r\n\r\n" % ("keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+    async def write_stream(self, writer: asyncio.StreamWriter, res: Response, chunked: bool, keep_alive: bool,
+                           path: str) -> None:
+        """ 流式响应: 每块写入后等待发送缓冲区排空, 缓冲的数据量不超过一块.
+        编码失败时不发送结束块并关闭连接, 客户端可据此识别不完整的响应.
+        """
+        status = http.HTTPStatus(res.status)
+        head = "HTTP/1.1 %d %s\r\n" % (status.value, status.phrase)
+        if res.content_type:
+            head += "Content-type: %s\r\n" % res.content_type
+        for name, value in res.headers.items():
+            head += "%s: %s\r\n" % (name, value)
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n"
+        head += "Connection: %s\r\n\r\n" % ("keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1"))
+        loop = asyncio.get_running_loop()
+        size = 0
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, res.chunks, None)
+                if chunk is None:
+                    break
+                size += len(chunk)
+                if chunked:
+                    writer.write(b"%x\r\n" % len(chunk))
+                    writer.write(chunk)
+                    writer.write(b"\r\n")
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+        except Exception as e:
+            logger.error("[DRIVER] [POST] [%s] STREAM FAIL [%s]: \n%s", path, str(e), traceback.format_exc())
+            raise ConnectionError("stream aborted")
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        self.service.metrics.observe("qingems_response_bytes", (route_label(path),), size)
+
+
+def run_aio_server(host: str = "", port: int = 10099, backlog: int = 128, max_concurrency: int = 64,
+                   batch_workers: int = 0, workers: int = 0, profiler: profiling.Profiler = None, stream: bool = False,
+                   history: "history.HistoryStore" = None, exec_queue: "execqueue.ExecQueue" = None):
+    batch_executor = None if batch_workers <= 0 else concurrent.futures.ThreadPoolExecutor(batch_workers)
+    parse_pool = None
+    if workers > 0:
+        import worker_pool
+        parse_pool = worker_pool.ParsePool(workers)
+    service = DriverService(batch_executor, parse_pool, profiler, stream, history, exec_queue)
+    server = AioDriverServer(service, host, port, backlog, max_concurrency)
+    asyncio.run(server.serve_forever())
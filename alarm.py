@@ -0,0 +1,230 @@
+# -*- encoding: utf-8 -*-
+
+""" 告警表: 声明式定义告警位, 按字批量检测, 并按设备跟踪告警的产生和消除
+
+每个告警字整字读取, 与表中定义的位掩码相与, 只有非零的字才逐位展开.
+告警信息 (AlarmInfo) 在编译时创建, 各次解析共享同一实例.
+
+提供 device_id 的设备 (见 DriverBase.reuseDD) 记录上次的告警状态:
+    dd.alarm            发生中的告警 (edge=True 时不填写, 只报告变化)
+    dd.alarm_raised     本次新产生的告警 (设备首次解析时为全部发生中的告警)
+    dd.alarm_cleared    本次消除的告警
+alarm_raised/alarm_cleared 只在跟踪状态时添加到 dd 上 (DD 类不定义这两个字段, 其他设备的输出不变).
+未提供 device_id 时不跟踪状态, 只填写 dd.alarm.
+"""
+
+import collections
+import csv
+import json
+import threading
+import typing
+
+from addr import AddrRange, AddrType
+from addrspace import AddressSpace
+from devdata import DD
+from devfield import AlarmInfo
+from segment import ByteOrder
+
+# 位地址类型 (线圈/遥信), 其余为寄存器
+BIT_ADDR_TYPES = (AddrType.MODBUS_INPUT_BITS, AddrType.MODBUS_BITS)
+
+class AlarmPoint:
+    """ 告警位定义 """
+
+    def __init__(self, addr: int, bit: int, alarm_id: int, standard_id: str, content: str, device: str = None,
+                 addr_type: AddrType = AddrType.MODBUS_REGS, space: int = 0) -> None:
+        # 寄存器地址 (位地址类型为线圈/遥信地址)
+        self.addr: int = addr
+        # 寄存器内位序号 0~15, 位地址类型忽略
+        self.bit: int = bit
+        # 设备定义的告警ID
+        self.alarm_id: int = alarm_id
+        # EMS系统标准告警ID
+        self.standard_id: str = standard_id
+        # 告警内容
+        self.content: str = content
+        # 告警设备信息
+        self.device: str = device
+        # 地址类型
+        self.addr_type: AddrType = addr_type
+        # 地址空间号, 0 表示默认空间
+        self.space: int = space
+
+        if addr_type not in BIT_ADDR_TYPES and not 0 <= bit < 16:
+            raise RuntimeError("Alarm Bit Error: %s [%s]" % (bit, alarm_id))
+
+    def info(self) -> AlarmInfo:
+        ainfo = AlarmInfo()
+        ainfo.alarm_id = self.alarm_id
+        ainfo.standard_id = self.standard_id
+        ainfo.content = self.content
+        ainfo.device = self.device
+        return ainfo
+
+    @staticmethod
+    def from_row(row: dict) -> "AlarmPoint":
+        """ 由 JSON/CSV 行构造告警位, 空值使用默认值 """
+        def get(key: str, conv, default):
+            val = row.get(key)
+            return default if val is None or val == "" else conv(val)
+
+        def addr_type(val) -> AddrType:
+            return AddrType[val] if isinstance(val, str) and not val.isdigit() else AddrType(int(val))
+
+        return AlarmPoint(
+            int(row["addr"]),
+            get("bit", int, 0),
+            int(row["alarm_id"]),
+            get("standard_id", str, "AI-NIL-$000"),
+            get("content", str, ""),
+            get("device", str, None),
+            get("addr_type", addr_type, AddrType.MODBUS_REGS),
+            get("space", int, 0))
+
+class WordRun:
+    """ 同一地址空间内连续的告警字, 一次读取 """
+
+    def __init__(self, space: int, begin: int, end: int) -> None:
+        self.space = space
+        self.begin = begin
+        self.end = end
+        # [(字下标, 位掩码, 位序号 -> 告警序号)]
+        self.words: typing.List[typing.Tuple[int, int, typing.List[int]]] = []
+
+class AlarmState:
+    """ 单个设备的告警状态 """
+
+    def __init__(self, active: typing.FrozenSet[int]) -> None:
+        # 发生中的告警序号
+        self.active: typing.FrozenSet[int] = active
+
+class AlarmTable:
+    """ 告警表 """
+
+    def __init__(self, points: typing.List[AlarmPoint], order: ByteOrder = ByteOrder.ABCD, edge: bool = False,
+                 max_devices: int = 10000) -> None:
+        # 告警位列表
+        self.points: typing.List[AlarmPoint] = list(points)
+        # 告警字的字节序 (只区分字内高低字节)
+        self.order: ByteOrder = order
+        # 只报告告警变化, 不填写 dd.alarm
+        self.edge: bool = edge
+        # 告警序号 -> 告警信息
+        self.infos: typing.List[AlarmInfo] = [p.info() for p in self.points]
+        # 寄存器告警: 连续字分组; 位地址告警: [(告警序号, 地址, 空间)]
+        self.runs: typing.List[WordRun] = None
+        self.bits: typing.List[typing.Tuple[int, int, int]] = None
+        # device_id -> 告警状态, 超过 max_devices 时淘汰最久未解析的设备
+        self.max_devices = max_devices
+        self.states: typing.OrderedDict[str, AlarmState] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_rows(rows: typing.Iterable[dict], order: ByteOrder = ByteOrder.ABCD, edge: bool = False) -> "AlarmTable":
+        return AlarmTable([AlarmPoint.from_row(row) for row in rows], order, edge)
+
+    @staticmethod
+    def from_json(path: str) -> "AlarmTable":
+        """ 加载 JSON 告警表: {"order": "ABCD", "edge": false, "alarms": [{...}, ...]} """
+        with open(path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        return AlarmTable.from_rows(conf["alarms"], ByteOrder[conf.get("order", "ABCD")], bool(conf.get("edge", False)))
+
+    @staticmethod
+    def from_csv(path: str, order: ByteOrder = ByteOrder.ABCD, edge: bool = False) -> "AlarmTable":
+        """ 加载 CSV 告警表, 表头: addr,bit,alarm_id,standard_id,content,device,addr_type,space """
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return AlarmTable.from_rows(list(csv.DictReader(f)), order, edge)
+
+    def compile(self) -> typing.List[WordRun]:
+        """ 按地址空间和地址合并告警字 """
+        if self.runs is not None:
+            return self.runs
+        words: typing.Dict[typing.Tuple[int, int], typing.List[int]] = {}
+        bits = []
+        for i, p in enumerate(self.points):
+            if p.addr_type in BIT_ADDR_TYPES:
+                bits.append((i, p.addr, p.space))
+                continue
+            table = words.setdefault((p.space, p.addr), [-1] * 16)
+            if table[p.bit] >= 0:
+                raise RuntimeError("Alarm Bit Duplicated: %s.%s [%s]" % (p.addr, p.bit, p.alarm_id))
+            table[p.bit] = i
+
+        runs: typing.List[WordRun] = []
+        for (space, addr), table in sorted(words.items()):
+            if not runs or runs[-1].space != space or runs[-1].end != addr:
+                runs.append(WordRun(space, addr, addr))
+            run = runs[-1]
+            mask = 0
+            for bit, i in enumerate(table):
+                if i >= 0:
+                    mask |= 1 << bit
+            run.words.append((addr - run.begin, mask, table))
+            run.end = addr + 1
+        self.bits = bits
+        self.runs = runs
+        return runs
+
+    def addr_ranges(self) -> typing.List[AddrRange]:
+        """ 告警字的采集区间 (位地址告警按地址类型和空间合并) """
+        ranges = [AddrRange(AddrType.MODBUS_REGS, r.begin, r.end, r.space) for r in self.compile()]
+        groups: typing.Dict[tuple, typing.List[int]] = {}
+        for i, addr, space in self.bits:
+            groups.setdefault((self.points[i].addr_type.value, space), []).append(addr)
+        for (addr_type, space), addrs in sorted(groups.items()):
+            addrs.sort()
+            begin = end = addrs[0]
+            for addr in addrs:
+                if addr > end:
+                    ranges.append(AddrRange(AddrType(addr_type), begin, end, space))
+                    begin = addr
+                end = addr + 1
+            ranges.append(AddrRange(AddrType(addr_type), begin, end, space))
+        return ranges
+
+    def scan(self, addr_space: AddressSpace) -> typing.List[int]:
+        """ 发生中的告警序号 (按地址和位排序) """
+        active = []
+        # 单寄存器数值: CDAB 等同 ABCD, BADC 等同 DCBA
+        order = ByteOrder.ABCD if self.order in (ByteOrder.ABCD, ByteOrder.CDAB) else ByteOrder.DCBA
+        for run in self.compile():
+            values = addr_space.array(run.begin, run.end - run.begin, "u16", order, space=run.space)
+            for index, mask, table in run.words:
+                m = int(values[index]) & mask
+                while m:
+                    low = m & -m
+                    active.append(table[low.bit_length() - 1])
+                    m ^= low
+        for i, addr, space in self.bits:
+            if addr_space.bit(addr, space):
+                active.append(i)
+        return active
+
+    def evaluate(self, addr_space: AddressSpace, dd: DD) -> None:
+        """ 检测告警并写入 dd, 见模块说明 """
+        active = self.scan(addr_space)
+        infos = self.infos
+        device_id = getattr(addr_space, "device_id", "")
+        if not device_id:
+            dd.alarm.extend(infos[i] for i in active)
+            return
+        current = frozenset(active)
+        with self.lock:
+            state = self.states.get(device_id)
+            if state is None:
+                state = self.states[device_id] = AlarmState(frozenset())
+            self.states.move_to_end(device_id)
+            while len(self.states) > self.max_devices:
+                self.states.popitem(last=False)
+            previous, state.active = state.active, current
+        if not self.edge:
+            dd.alarm.extend(infos[i] for i in active)
+        changed = current != previous
+        dd.alarm_raised = [infos[i] for i in active if i not in previous] if changed else []
+        dd.alarm_cleared = [infos[i] for i in sorted(previous - current)] if changed else []
+
+    def forget(self, device_id: str) -> None:
+        """ 清除设备的告警状态, 下次解析时全部发生中的告警作为新产生的告警报告 """
+        with self.lock:
+            self.states.pop(device_id, None)
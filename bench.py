@@ -0,0 +1,368 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+""" 性能基准测试
+
+使用合成负载 (400 个子设备的 EMS, 16 簇 x 240 电芯的电池堆, 宽告警位域) 测量:
+    数据段解码, SegmentSet.ref 查找, ModbusAddressSpace 读取, DD 序列化, HTTP 回环请求.
+
+结果输出为 JSON, 可用 --compare 与之前版本的结果对比:
+    python bench.py -o bench_output.txt
+    python bench.py --compare bench_output.txt
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import platform
+import random
+import statistics
+import struct
+import sys
+import threading
+import time
+import typing
+
+import aggregate
+import devfield
+import driverset
+import serializer
+from addr import AddrRange, AddrType
+from addrspace import AddressSpace, ModbusAddressSpace
+from devdata import DD, DDOfCluster, DDOfEM2, DDOfInverter, DDofMngDevice, DDOfStack
+from devfield import DevCmd, DeviceType, DevRet
+from driver import DriverBase
+from iface_class import JsonEncoderIfJsonEnable
+from segment import ByteOrder, Segment, SegmentSet
+
+# 结果格式版本
+RESULT_VERSION = 1
+
+# 电池堆: 簇数, 每簇电芯数
+STACK_CLUSTERS = 16
+STACK_CELLS = 240
+# 每簇占用的地址: 电压 + 温度 + SOC
+CLUSTER_REGS = STACK_CELLS * 3
+# 单次采集的最大寄存器数
+READ_REGS = 125
+# 告警位域字数
+ALARM_WORDS = 64
+
+# ---------------------------------------------------------------- 合成负载
+
+def make_registers(count: int, rnd: random.Random) -> bytes:
+    return struct.pack(">%dH" % count, *(rnd.randrange(0, 0x10000) for _ in range(count)))
+
+def make_segments(begin: int, count: int, space: int, rnd: random.Random) -> typing.List[tuple]:
+    """ 按单次采集上限切分的寄存器数据段参数 (addr_begin, addr_end, width, space, data) """
+    segments = []
+    for addr in range(begin, begin + count, READ_REGS):
+        n = min(READ_REGS, begin + count - addr)
+        segments.append((addr, addr + n, 16, space, make_registers(n, rnd)))
+    return segments
+
+def make_stack_segments(rnd: random.Random) -> typing.List[tuple]:
+    segments = []
+    for c in range(STACK_CLUSTERS):
+        segments.extend(make_segments(c * 1000, CLUSTER_REGS, 1, rnd))
+    return segments
+
+def make_alarm_segments(rnd: random.Random) -> typing.List[tuple]:
+    """ 告警位域: 大部分字为0, 少量字有置位 """
+    words = [0] * ALARM_WORDS
+    for i in rnd.sample(range(ALARM_WORDS), ALARM_WORDS // 16):
+        words[i] = 1 << rnd.randrange(16)
+    return [(20000, 20000 + ALARM_WORDS, 16, 1, struct.pack(">%dH" % ALARM_WORDS, *words))]
+
+def make_segset(segments: typing.List[tuple]) -> SegmentSet:
+    segset = SegmentSet()
+    for addr_begin, addr_end, width, space, data in segments:
+        segset.add(Segment(addr_begin, addr_end, width, space, data))
+    return segset
+
+def make_stack(rnd: random.Random) -> DDOfStack:
+    stack = DDOfStack()
+    for c in range(STACK_CLUSTERS):
+        cluster = DDOfCluster()
+        for _ in range(STACK_CELLS):
+            cell = devfield.BatteryRuntime()
+            cell.voltage = 3.2 + rnd.random() * 0.2
+            cell.temperature = 20.0 + rnd.random() * 10
+            cell.soc = rnd.random() * 100
+            cluster.battery.append(cell)
+        stack.cluster.append(cluster)
+    return stack
+
+def make_ems(rnd: random.Random, sub_devices: int = 400) -> DDofMngDevice:
+    """ EMS: 逆变器/电表/电池簇混合的子设备, 每个子设备带少量告警 """
+    ems = DDofMngDevice()
+    for i in range(sub_devices):
+        kind = i % 3
+        if kind == 0:
+            dd = DDOfInverter()
+            dd.temperature = rnd.random() * 60
+            for _ in range(4):
+                branch = devfield.DCBranch()
+                branch.runtime.voltage = rnd.random() * 800
+                dd.branch.append(branch)
+        elif kind == 1:
+            dd = DDOfEM2()
+            dd.forward_energy.total = rnd.random() * 1e6
+        else:
+            dd = DDOfCluster()
+            for _ in range(16):
+                dd.battery.append(devfield.BatteryRuntime())
+        for a in range(2):
+            dd.checkAlarm(rnd.random() < 0.5, i * 10 + a, "A%04d" % a, "alarm %d" % a, str(i))
+        dd.number["power"] = rnd.random() * 100
+        ems.sub_dd.append(dd)
+    return ems
+
+class BenchStackDriver(DriverBase):
+    """ 基准测试用驱动: 解析电池堆电芯数据和告警位域 """
+    DEVICE_TYPE: DeviceType = DeviceType.BAT_STACK
+    PRODUCER: str = "bench"
+    MODEL: str = "stack"
+
+    def defineAddrRange(self) -> typing.List[AddrRange]:
+        r = [AddrRange(AddrType.MODBUS_REGS, c * 1000, c * 1000 + CLUSTER_REGS) for c in range(STACK_CLUSTERS)]
+        r.append(AddrRange(AddrType.MODBUS_REGS, 20000, 20000 + ALARM_WORDS))
+        return r
+
+    def parseDeviceData(self, addr_space: AddressSpace) -> DD:
+        stack = DDOfStack()
+        columns = []
+        for c in range(STACK_CLUSTERS):
+            base = c * 1000
+            voltage = addr_space.array(base, STACK_CELLS, "u16", scale=0.001)
+            temperature = addr_space.array(base + STACK_CELLS, STACK_CELLS, "i16", scale=0.1)
+            soc = addr_space.array(base + STACK_CELLS * 2, STACK_CELLS, "u16", scale=0.01)
+            cluster = DDOfCluster()
+            for i in range(STACK_CELLS):
+                cell = devfield.BatteryRuntime()
+                cell.voltage = voltage[i]
+                cell.temperature = temperature[i]
+                cell.soc = soc[i]
+                cluster.battery.append(cell)
+            stack.cluster.append(cluster)
+            columns.append({"voltage": voltage, "temperature": temperature, "soc": soc})
+        aggregate.aggregate_stack_cells(stack, columns)
+        for w in range(ALARM_WORDS):
+            word = addr_space.u16(20000 + w)
+            for b in range(16):
+                stack.checkAlarm(bool(word >> b & 1), w * 16 + b, "ALM%04d" % (w * 16 + b), "alarm")
+        return stack
+
+    def execCommand(self, cmd: DevCmd) -> DevRet:
+        return DevRet(True, b"")
+
+# ---------------------------------------------------------------- 计时
+
+class Bench:
+    """ 一个基准项: 调用 func number 次为一轮, 共 repeat 轮 """
+
+    def __init__(self, name: str, func: typing.Callable[[], typing.Any], number: int, unit: int = 1) -> None:
+        self.name = name
+        self.func = func
+        self.number = number
+        # 每次调用处理的元素数, 用于计算元素吞吐
+        self.unit = unit
+
+    def run(self, repeat: int, scale: float) -> dict:
+        number = max(1, int(self.number * scale))
+        func = self.func
+        func()
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            for _ in range(number):
+                func()
+            times.append((time.perf_counter() - t) / number)
+        best = min(times)
+        return {
+            "name": self.name,
+            "number": number,
+            "repeat": repeat,
+            "unit": self.unit,
+            "best_ns": best * 1e9,
+            "median_ns": statistics.median(times) * 1e9,
+            "stdev_ns": (statistics.stdev(times) if len(times) > 1 else 0.0) * 1e9,
+            "ops_per_sec": 1.0 / best if best > 0 else 0.0,
+            "items_per_sec": self.unit / best if best > 0 else 0.0,
+        }
+
+def decoder_benches(rnd: random.Random) -> typing.List[Bench]:
+    seg = Segment(0, 4096, 16, 1, make_registers(4096, rnd))
+    benches = []
+    for dtype in ("u16", "i32", "f32", "f64"):
+        for order in (ByteOrder.ABCD, ByteOrder.CDAB):
+            addrs = list(range(0, 4000, 7))
+            value = seg.value
+            benches.append(Bench(
+                "segment.value.%s.%s" % (dtype, order.name),
+                lambda value=value, dtype=dtype, order=order, addrs=addrs: [value(a, dtype, order) for a in addrs],
+                20, len(addrs)))
+    benches.append(Bench("segment.array.u16.3840", lambda: seg.array(0, 3840, "u16"), 200, 3840))
+    benches.append(Bench("segment.array.f32.CDAB.1920", lambda: seg.array(0, 1920, "f32", ByteOrder.CDAB), 200, 1920))
+    benches.append(Bench("segment.bit.1024", lambda: [seg.bit(a) for a in range(1024)], 50, 1024))
+    return benches
+
+def lookup_benches(rnd: random.Random) -> typing.List[Bench]:
+    segset = make_segset(make_stack_segments(rnd) + make_alarm_segments(rnd))
+    seq = [c * 1000 + i for c in range(STACK_CLUSTERS) for i in range(0, CLUSTER_REGS, 3)]
+    scattered = list(seq)
+    rnd.shuffle(scattered)
+    ref = segset.ref
+    return [
+        Bench("segmentset.ref.sequential", lambda: [ref(a, 1) for a in seq], 20, len(seq)),
+        Bench("segmentset.ref.random", lambda: [ref(a, 1) for a in scattered], 20, len(scattered)),
+        Bench("segmentset.ref.miss", lambda: [ref(a + 900, 1) for a in seq], 20, len(seq)),
+    ]
+
+def accessor_benches(rnd: random.Random) -> typing.List[Bench]:
+    space = ModbusAddressSpace(make_segset(make_stack_segments(rnd) + make_alarm_segments(rnd)), 1)
+    addrs = [c * 1000 + i for c in range(STACK_CLUSTERS) for i in range(0, CLUSTER_REGS - 2, 2)]
+    driver = BenchStackDriver()
+    return [
+        Bench("addrspace.u16", lambda: [space.u16(a) for a in addrs], 20, len(addrs)),
+        Bench("addrspace.f32", lambda: [space.f32(a) for a in addrs], 20, len(addrs)),
+        Bench("addrspace.f32.CDAB", lambda: [space.f32(a, 0, ByteOrder.CDAB) for a in addrs], 20, len(addrs)),
+        Bench("addrspace.array.cluster", lambda: space.array(0, STACK_CELLS, "u16", scale=0.001), 500, STACK_CELLS),
+        Bench("addrspace.array.cross_segment", lambda: space.array(100, 50, "u16"), 500, 50),
+        Bench("driver.parse.stack", lambda: driver.parseDeviceData(space), 5, STACK_CLUSTERS * STACK_CELLS),
+    ]
+
+def encode_benches(rnd: random.Random) -> typing.List[Bench]:
+    ems = make_ems(rnd)
+    stack = make_stack(rnd)
+    cells = STACK_CLUSTERS * STACK_CELLS
+    return [
+        Bench("encode.legacy.ems400", lambda: json.dumps(ems, cls=JsonEncoderIfJsonEnable), 5, len(ems.sub_dd)),
+        Bench("encode.serializer.ems400", lambda: serializer.dumps(ems), 5, len(ems.sub_dd)),
+        Bench("encode.legacy.stack", lambda: json.dumps(stack, cls=JsonEncoderIfJsonEnable), 5, cells),
+        Bench("encode.serializer.stack", lambda: serializer.dumps(stack), 5, cells),
+    ]
+
+def http_benches(rnd: random.Random) -> typing.List[Bench]:
+    """ 回环 HTTP 请求, 服务端为 DriverHttpHandler (每个请求一个连接) """
+    import http_server
+    driverset.LoadLocalDriverFor(BenchStackDriver)
+
+    class QuietHandler(http_server.DriverHttpHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = http_server.http.server.ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    def request(path: str, body: bytes) -> typing.Callable[[], bytes]:
+        def call() -> bytes:
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                res = conn.getresponse()
+                data = res.read()
+                if res.status != 200:
+                    raise RuntimeError("HTTP %d on %s" % (res.status, path))
+                return data
+            finally:
+                conn.close()
+        return call
+
+    def rpc(method: str, params: dict) -> bytes:
+        return json.dumps({"version": 1, "jsonrpc": "2.0", "id": 1, "method": method, "params": params}).encode()
+
+    target = {"type": DeviceType.BAT_STACK.value, "producer": "bench", "model": "stack"}
+    segments = [{
+        "addr_begin": b, "addr_end": e, "width": w, "space": s,
+        "data": base64.urlsafe_b64encode(d).decode("ascii"),
+    } for b, e, w, s, d in make_stack_segments(rnd) + make_alarm_segments(rnd)]
+    return [
+        Bench("http.addr", request("/v1/addr", rpc("defineAddrRange", target)), 50),
+        Bench("http.parse.stack", request("/v1/parse", rpc("parseDeviceData", dict(target, segment=segments))), 5,
+              STACK_CLUSTERS * STACK_CELLS),
+    ]
+
+def aggregate_benches(rnd: random.Random) -> typing.List[Bench]:
+    stack = make_stack(rnd)
+    columns = [aggregate.columns_of(c.battery) for c in stack.cluster]
+    cells = STACK_CLUSTERS * STACK_CELLS
+    return [
+        Bench("aggregate.stack.objects", lambda: aggregate.aggregate_stack_cells(stack), 10, cells),
+        Bench("aggregate.stack.columns", lambda: aggregate.aggregate_stack_cells(stack, columns), 10, cells),
+    ]
+
+# 基准组: 名称 -> 生成函数
+GROUPS: typing.Dict[str, typing.Callable[[random.Random], typing.List[Bench]]] = {
+    "decode": decoder_benches,
+    "lookup": lookup_benches,
+    "accessor": accessor_benches,
+    "aggregate": aggregate_benches,
+    "encode": encode_benches,
+    "http": http_benches,
+}
+
+def run(groups: typing.List[str], repeat: int = 5, scale: float = 1.0, seed: int = 1, match: str = "") -> dict:
+    results = []
+    for group in groups:
+        for bench in GROUPS[group](random.Random(seed)):
+            if match and match not in bench.name:
+                continue
+            r = bench.run(repeat, scale)
+            r["group"] = group
+            results.append(r)
+            print("%-40s %12.1f us  %14.0f items/s" % (bench.name, r["best_ns"] / 1e3, r["items_per_sec"]), file=sys.stderr)
+    return {
+        "version": RESULT_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+
+def compare(base: dict, current: dict) -> typing.List[dict]:
+    """ 对比两次结果, ratio > 1 表示变慢 """
+    old = {r["name"]: r for r in base["results"]}
+    rows = []
+    for r in current["results"]:
+        if r["name"] in old:
+            rows.append({
+                "name": r["name"],
+                "base_ns": old[r["name"]]["best_ns"],
+                "best_ns": r["best_ns"],
+                "ratio": r["best_ns"] / old[r["name"]]["best_ns"],
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="QingEMS driver benchmarks")
+    parser.add_argument("-g", "--group", action="append", choices=sorted(GROUPS), help="benchmark group, default all")
+    parser.add_argument("-k", "--match", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="rounds per benchmark")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="multiplier for calls per round")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for synthetic data")
+    parser.add_argument("-o", "--output", help="write JSON result to file instead of stdout")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args()
+
+    result = run(args.group or list(GROUPS), args.repeat, args.scale, args.seed, args.match)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            result["compare"] = compare(json.load(f), result)
+        for row in result["compare"]:
+            print("%-40s %8.3fx" % (row["name"], row["ratio"]), file=sys.stderr)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+""" 二进制传输格式 (application/x-qingems-bin)
+
+帧: MAGIC(3字节 "QEB") + 版本(1字节) + 一个带标签的值. 值的编码 (整数均为大端):
+
+    N               None
+    T / F           True / False
+    i <i32>         32位有符号整数
+    q <i64>         64位有符号整数
+    d <f64>         浮点数
+    s <u32 n> <n>   UTF-8 字符串
+    y <u32 n> <n>   二进制数据
+    l <u32 n> 值*n  列表
+    m <u32 n> (<u16 k> <k> 值)*n        字典, 键为 UTF-8 字符串
+    S <u32 addr_begin> <u32 addr_end> <u8 width> <u16 space> <u32 n> <n>   数据段
+
+请求与 JSON-RPC 结构相同, 只是 params.segment 的元素使用 S 编码, execCommand 的 args 使用 y 编码;
+响应中的 JsonEnabled 对象编码为字典, 枚举编码为其值.
+"""
+
+import enum
+import struct
+import typing
+
+import iface_class
+
+CONTENT_TYPE = "application/x-qingems-bin"
+
+MAGIC = b"QEB"
+VERSION = 1
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_I32 = struct.Struct(">i")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+_SEGMENT = struct.Struct(">IIBHI")
+
+class Segment:
+    """ 数据段, 编码为 S 标签 """
+
+    def __init__(self, addr_begin: int, addr_end: int, width: int, space: int, data: bytes) -> None:
+        self.addr_begin = addr_begin
+        self.addr_end = addr_end
+        self.width = width
+        self.space = space
+        self.data = data
+
+def dumps(value: typing.Any) -> bytes:
+    """ 编码为二进制帧 """
+    buf = bytearray(MAGIC)
+    buf += _U8.pack(VERSION)
+    encode(value, buf)
+    return bytes(buf)
+
+def loads(data: bytes) -> typing.Any:
+    """ 解码二进制帧 (参考实现, 供 EMS 端使用). 数据段解码为字典, data 为 bytes """
+    view = memoryview(data)
+    need(view, 0, 4, "header")
+    if bytes(view[:3]) != MAGIC:
+        raise ValueError("bad magic")
+    if view[3] != VERSION:
+        raise ValueError("unsupported version: %d" % view[3])
+    value, pos = decode(view, 4)
+    if pos != len(view):
+        raise ValueError("trailing data: %d bytes" % (len(view) - pos))
+    return value
+
+def encode(o: typing.Any, buf: bytearray) -> None:
+    if o is None:
+        buf += b"N"
+    elif o is True:
+        buf += b"T"
+    elif o is False:
+        buf += b"F"
+    elif isinstance(o, int):
+        if -0x80000000 <= o <= 0x7FFFFFFF:
+            buf += b"i"
+            buf += _I32.pack(o)
+        else:
+            buf += b"q"
+            buf += _I64.pack(o)
+    elif isinstance(o, float):
+        buf += b"d"
+        buf += _F64.pack(o)
+    elif isinstance(o, str):
+        raw = o.encode("utf-8")
+        buf += b"s"
+        buf += _U32.pack(len(raw))
+        buf += raw
+    elif isinstance(o, (bytes, bytearray, memoryview)):
+        buf += b"y"
+        buf += _U32.pack(len(o))
+        buf += o
+    elif isinstance(o, (list, tuple)):
+        buf += b"l"
+        buf += _U32.pack(len(o))
+        for item in o:
+            encode(item, buf)
+    elif isinstance(o, dict):
+        encode_map(o, buf)
+    elif isinstance(o, Segment):
+        buf += b"S"
+        buf += _SEGMENT.pack(o.addr_begin, o.addr_end, o.width, o.space, len(o.data))
+        buf += o.data
+    elif isinstance(o, enum.Enum):
+        encode(o.value, buf)
+    elif isinstance(o, iface_class.JsonEnabled):
+        encode_map(iface_class.fields(o), buf)
+    else:
+        raise TypeError("Object of type %s is not binwire serializable" % type(o).__name__)
+
+def encode_map(o: dict, buf: bytearray) -> None:
+    buf += b"m"
+    buf += _U32.pack(len(o))
+    for k, v in o.items():
+        raw = str(k).encode("utf-8")
+        buf += _U16.pack(len(raw))
+        buf += raw
+        encode(v, buf)
+
+def need(view: memoryview, pos: int, n: int, what: str) -> None:
+    """ 检查 pos 起还有 n 字节, 否则数据被截断 """
+    if pos + n > len(view):
+        raise ValueError("truncated %s at %d" % (what, pos))
+
+def decode(view: memoryview, pos: int) -> typing.Tuple[typing.Any, int]:
+    need(view, pos, 1, "value")
+    tag = view[pos]
+    pos += 1
+    if tag == 0x4E:     # N
+        return None, pos
+    if tag == 0x54:     # T
+        return True, pos
+    if tag == 0x46:     # F
+        return False, pos
+    if tag == 0x69:     # i
+        need(view, pos, 4, "int")
+        return _I32.unpack_from(view, pos)[0], pos + 4
+    if tag == 0x71:     # q
+        need(view, pos, 8, "int")
+        return _I64.unpack_from(view, pos)[0], pos + 8
+    if tag == 0x64:     # d
+        need(view, pos, 8, "float")
+        return _F64.unpack_from(view, pos)[0], pos + 8
+    if tag == 0x73:     # s
+        need(view, pos, 4, "string")
+        n = _U32.unpack_from(view, pos)[0]
+        need(view, pos + 4, n, "string")
+        return str(view[pos + 4:pos + 4 + n], "utf-8"), pos + 4 + n
+    if tag == 0x79:     # y
+        need(view, pos, 4, "bytes")
+        n = _U32.unpack_from(view, pos)[0]
+        need(view, pos + 4, n, "bytes")
+        return bytes(view[pos + 4:pos + 4 + n]), pos + 4 + n
+    if tag == 0x6C:     # l
+        need(view, pos, 4, "list")
+        n = _U32.unpack_from(view, pos)[0]
+        pos += 4
+        # 每个元素至少1字节
+        need(view, pos, n, "list")
+        items = []
+        for _ in range(n):
+            item, pos = decode(view, pos)
+            items.append(item)
+        return items, pos
+    if tag == 0x6D:     # m
+        need(view, pos, 4, "map")
+        n = _U32.unpack_from(view, pos)[0]
+        pos += 4
+        # 每项至少为键长度2字节和值1字节
+        need(view, pos, n * 3, "map")
+        items = {}
+        for _ in range(n):
+            k = _U16.unpack_from(view, pos)[0]
+            need(view, pos + 2, k, "map key")
+            key = str(view[pos + 2:pos + 2 + k], "utf-8")
+            items[key], pos = decode(view, pos + 2 + k)
+        return items, pos
+    if tag == 0x53:     # S
+        need(view, pos, _SEGMENT.size, "segment")
+        addr_begin, addr_end, width, space, n = _SEGMENT.unpack_from(view, pos)
+        pos += _SEGMENT.size
+        need(view, pos, n, "segment")
+        return {
+            "addr_begin": addr_begin,
+            "addr_end": addr_end,
+            "width": width,
+            "space": space,
+            "data": bytes(view[pos:pos + n]),
+        }, pos + n
+    raise ValueError("unknown tag: 0x%02x at %d" % (tag, pos - 1))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+""" 重复采集的变化检测和增量响应
+
+按设备 (驱动键 + device_id) 记录上次发送的数据段摘要和 DD. 请求参数:
+    delta: true     启用增量模式
+    seq:            客户端已持有的序号, 与服务端不一致时返回全量 (首次请求可省略)
+    resync: true    强制返回全量
+
+响应 result:
+    全量:   {"dd": ..., "seq": n, "full": true}
+    未变化: {"seq": n, "unchanged": true}                       数据段与上次相同, 不解析
+    增量:   {"delta": {"set": [[path, value], ...], "del": [path, ...]}, "seq": n, "base_seq": n - 1}
+path 为字段名/列表下标组成的数组; 列表长度变化时整个列表作为一个值下发.
+"""
+
+import collections
+import hashlib
+import struct
+import threading
+import typing
+
+# 数据段头部 (addr_begin, addr_end, width, space, data 长度)
+_SEGMENT_HEAD = struct.Struct(">qqiiq")
+
+class DeviceState:
+    """ 单个设备的增量状态 """
+
+    def __init__(self, seq: int, digest: bytes, plain: typing.Any) -> None:
+        # 最近一次响应的序号
+        self.seq: int = seq
+        # 最近一次解析的数据段摘要
+        self.digest: bytes = digest
+        # 最近一次发送的 DD (JSON 基本类型树)
+        self.plain: typing.Any = plain
+
+def digest(space: int, order: str, segments: typing.List[tuple]) -> bytes:
+    """ 地址空间参数的摘要 """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(("%d|%s" % (space, order)).encode("ascii"))
+    for addr_begin, addr_end, width, sps, data in segments:
+        h.update(_SEGMENT_HEAD.pack(addr_begin, addr_end, width, sps, len(data)))
+        h.update(data)
+    return h.digest()
+
+def same(a: typing.Any, b: typing.Any) -> bool:
+    if a.__class__ is not b.__class__:
+        return False
+    return a == b or (a != a and b != b)
+
+def diff(old: typing.Any, new: typing.Any, path: list, changes: list, removed: list) -> None:
+    """ 比较两棵 JSON 基本类型树, 收集变化的叶子路径 """
+    if old.__class__ is dict and new.__class__ is dict:
+        for k, v in new.items():
+            if k in old:
+                diff(old[k], v, path + [k], changes, removed)
+            else:
+                changes.append([path + [k], v])
+        for k in old:
+            if k not in new:
+                removed.append(path + [k])
+    elif old.__class__ is list and new.__class__ is list and len(old) == len(new):
+        for i in range(len(new)):
+            diff(old[i], new[i], path + [i], changes, removed)
+    elif not same(old, new):
+        changes.append([path, new])
+
+class DeltaTracker:
+    """ 设备增量状态表, 超过 max_devices 时淘汰最久未访问的设备 """
+
+    def __init__(self, max_devices: int = 10000) -> None:
+        self.max_devices = max_devices
+        self.states: typing.OrderedDict[str, DeviceState] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> typing.Optional[DeviceState]:
+        with self.lock:
+            state = self.states.get(key)
+            if state is not None:
+                self.states.move_to_end(key)
+            return state
+
+    def put(self, key: str, state: DeviceState) -> None:
+        with self.lock:
+            self.states[key] = state
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_devices:
+                self.states.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            self.states.pop(key, None)
@@ -24,6 +24,10 @@ class DD(iface_class.JsonEnabled):
         self.raw: typing.Dict[str, bytes] = {}
 
         
+    def reset(self) -> None:
+        """ 原地恢复为默认值, 用于跨采集周期复用对象 """
+        devfield.reset(self)
+
     def checkAlarm(self, alarm: bool, alarm_id: int, standard_id: str, content: str, device: str = None) -> None:
         """ 检测和记录告警测点状态 """
         if not alarm:
@@ -38,6 +42,7 @@ class DD(iface_class.JsonEnabled):
 class DDOfUserDefined(DD):
     """ 用户自定义设备: 只使用通用字段 """
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.UDD
 
 class DDofMngDevice(DD):
@@ -46,6 +51,7 @@ class DDofMngDevice(DD):
     """
 
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.MNG
         # 次级设备数据
         self.sub_dd: typing.List[DD] = []
@@ -53,6 +59,7 @@ class DDofMngDevice(DD):
 class DDOfInverter(DD):
     """ 逆变器数据 (PCS/光伏逆变器) """
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.PCS
 
         # *** 工作参数 ***
@@ -87,12 +94,13 @@ class DDOfInverter(DD):
 class DDOfCluster(DD):
     """ 电池簇 """
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.BAT_CLUSTER
 
         # 堆运行状态
-        self.cluster_status: devfield.BatterySystemStatus = devfield.BatterySystemStatus()
+        self.cluster_status: devfield.BatterySystemStatus = devfield.BatterySystemStatus.READY
         # 堆充放电状态
-        self.charge_status: devfield.ChargeStatus = devfield.ChargeStatus()
+        self.charge_status: devfield.ChargeStatus = devfield.ChargeStatus.IDLE
         # 堆运行时参数
         self.runtime: devfield.BatterySystemRuntime = devfield.BatterySystemRuntime()
         # 累计充放电量和容量
@@ -103,12 +111,13 @@ class DDOfCluster(DD):
 class DDOfStack(DD):
     """ 电池堆 """
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.BAT_STACK
 
         # 堆运行状态
-        self.stack_status: devfield.BatterySystemStatus = devfield.BatterySystemStatus()
+        self.stack_status: devfield.BatterySystemStatus = devfield.BatterySystemStatus.READY
         # 堆充放电状态
-        self.charge_status: devfield.ChargeStatus = devfield.ChargeStatus()
+        self.charge_status: devfield.ChargeStatus = devfield.ChargeStatus.IDLE
         # 堆运行时参数
         self.runtime: devfield.BatterySystemRuntime = devfield.BatterySystemRuntime()
         # 累计充放电量和容量
@@ -120,6 +129,7 @@ class DDOfEM2(DD):
     """ 双向电表 """
 
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.EM2
 
         # 计费时段
@@ -139,6 +149,7 @@ class DDOfAirConditioner(DD):
     """ 空调 """
 
     def __init__(self) -> None:
+        super().__init__()
         self.devtype: devfield.DeviceType = devfield.DeviceType.AC
 
         # 运行时度量
@@ -1,5 +1,6 @@
 # -*- encoding: utf-8 -tterySystemCapacity()
 import enum
+import inspect
 import typing
 import iface_class
 
@@ -58,17 +59,60 @@ class EMChargingLevel(enum.Enum):
 
 ### 字段结构定义 ###
 
+# 类 -> 默认实例, 用于 reset 恢复字段默认值; 构造函数需要参数的类 (如 DevRet) 为 None
+_DEFAULTS: typing.Dict[type, typing.Optional[iface_class.JsonEnabled]] = {}
+
+def reset(o: iface_class.JsonEnabled) -> None:
+    """ 原地恢复对象字段为默认值: 子对象递归重置, 列表和字典清空, 动态添加的属性删除
+
+    构造函数需要参数的类没有默认值, 其对象保持不变.
+    """
+    cls = o.__class__
+    if cls not in _DEFAULTS:
+        required = [p for p in inspect.signature(cls).parameters.values()
+                    if p.default is p.empty and p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+        _DEFAULTS[cls] = None if required else cls()
+    sample = _DEFAULTS[cls]
+    if sample is None:
+        return
+    defaults = iface_class.fields(sample)
+    for k, default in defaults.items():
+        v = getattr(o, k, None)
+        if isinstance(default, iface_class.JsonEnabled):
+            if v.__class__ is default.__class__:
+                reset(v)
+            else:
+                setattr(o, k, default.__class__())
+        elif isinstance(default, (list, dict)):
+            if v.__class__ is default.__class__:
+                v.clear()
+            else:
+                setattr(o, k, default.__class__())
+        else:
+            setattr(o, k, default)
+    d = getattr(o, "__dict__", None)
+    if d is not None and len(d) != len(defaults):
+        for k in [k for k in d if k not in defaults]:
+            del d[k]
+
 class DeviceFieldBase(iface_class.JsonEnabled):
-    pass
+    __slots__ = ()
+
+    def reset(self) -> None:
+        """ 原地恢复为默认值, 用于跨采集周期复用对象 """
+        reset(self)
 
 class DevCmd(DeviceFieldBase):
     """ 设备指令 """
+    __slots__ = ("cmd", "args")
+
     def __init__(self) -> None:
         self.cmd: str = "noop"
         self.args: typing.List[bytes] = []
 
 class DevRet(DeviceFieldBase):
     """ 设备指令返回结果 """
+    __slots__ = ("succ", "cont")
 
     def __init__(self, succ: bool, content: bytes) -> None:
         self.succ: bool = succ
@@ -76,6 +120,7 @@ class DevRet(DeviceFieldBase):
 
 class AlarmInfo(DeviceFieldBase):
     """ 告警 """
+    __slots__ = ("alarm_id", "standard_id", "content", "device")
     
     def __init__(self) -> None:
         # 设备定义的告警ID
@@ -89,6 +134,7 @@ class AlarmInfo(DeviceFieldBase):
 
 class AccIndicator(DeviceFieldBase):
     """ 累计指标 """
+    __slots__ = ("total", "daily", "round")
     
     def __init__(self) -> None:
         # 总累计量
@@ -100,6 +146,7 @@ class AccIndicator(DeviceFieldBase):
 
 class AggIndicator(DeviceFieldBase):
     """ 聚合指标 """
+    __slots__ = ("mass", "avg", "min", "max", "min_id", "max_id")
 
     def __init__(self) -> None:
         # 聚合值
@@ -117,6 +164,7 @@ class AggIndicator(DeviceFieldBase):
 
 class ACField3(DeviceFieldBase):
     """ 交流三相三线数据 """
+    __slots__ = ("total", "phase_a", "phase_b", "phase_c", "line_ab", "line_bc", "line_ca")
 
     def __init__(self) -> None:
         self.total: float = 0.0
@@ -130,16 +178,18 @@ class ACField3(DeviceFieldBase):
 
 class ACVoltage(ACField3):
     """ 交流电压 (默认单位: 伏特) """
-    pass
+    __slots__ = ()
 
 
 class ACCurrent(ACField3):
     """ 交流电流 (默认单位: 安培) """
-    pass
+    __slots__ = ()
 
 
 class ACPower(ACField3):
     """ 交流功率 (默认单位: 瓦特) """
+    __slots__ = ()
+
     def W2kW(w: float) -> float:
         return w / 1000.0
 
@@ -149,6 +199,8 @@ class ACPower(ACField3):
 
 class ACEnergy(ACField3):
     """ 交流电能 (默认单位: 焦耳) """
+    __slots__ = ()
+
     def J2kWh(J: float) -> float:
         return J / (3600.0 * 1000.0)
 
@@ -158,13 +210,14 @@ class ACEnergy(ACField3):
 
 class ACPowerFactor(ACField3):
     """ 交流功率因数 """
-    pass
+    __slots__ = ()
 
 class ACFrequency(ACField3):
     """ 交流频率 """
-    pass
+    __slots__ = ()
 class ACPowerMeasure(DeviceFieldBase):
     """ 直流功率度量 """
+    __slots__ = ("active", "reactive", "apparent", "factor")
 
     def __init__(self) -> None:
         self.active: ACPower = ACPower()
@@ -174,6 +227,7 @@ class ACPowerMeasure(DeviceFieldBase):
 
 class ACRuntime(DeviceFieldBase):
     """ 交流运行时度量 """
+    __slots__ = ("voltage", "current", "power", "frequency")
     
     def __init__(self) -> None:
         # 电压
@@ -187,6 +241,7 @@ class ACRuntime(DeviceFieldBase):
 
 class DCRuntime(DeviceFieldBase):
     """ 直流运行时度量 """
+    __slots__ = ("voltage", "current", "power")
 
     def __init__(self) -> None:
         # 电压
@@ -199,6 +254,7 @@ class DCRuntime(DeviceFieldBase):
 
 class DeviceCommonStatus(DeviceFieldBase):
     """ 通用设备状态 """
+    __slots__ = ("online", "run", "alarm", "fault")
 
     def __init__(self) -> None:
         # 是否在线/通讯正常
@@ -212,6 +268,7 @@ class DeviceCommonStatus(DeviceFieldBase):
 
 class DCBranch(DeviceFieldBase):
     """ 直流支路 """
+    __slots__ = ("id", "name", "runtime")
 
     def __init__(self) -> None:
         # 支路编号
@@ -223,6 +280,7 @@ class DCBranch(DeviceFieldBase):
         
 class BatteryRuntime(DeviceFieldBase):
     """ 电池运行时度量 """
+    __slots__ = ("voltage", "current", "temperature", "soc", "soh", "r", "positive_ir", "negative_ir")
 
     def __init__(self) -> None:
         # 电压
@@ -245,6 +303,7 @@ class BatteryRuntime(DeviceFieldBase):
        
 class BatterySystemRuntime(DeviceFieldBase):
     """ 电池系统运行时度量 """
+    __slots__ = ("voltage", "current", "temperature", "soc", "soh", "r", "positive_ir", "negative_ir")
     
     def __init__(self) -> None:
         # 电压
@@ -266,6 +325,7 @@ class BatterySystemRuntime(DeviceFieldBase):
 
 class BatterySystemCapacity(DeviceFieldBase):
     """ 电池系统容量度量 """
+    __slots__ = ("charge", "charge_capacity", "discharge", "discharge_capacity")
 
     def __init__(self) -> None:
         # 充电量
@@ -280,6 +340,7 @@ class BatterySystemCapacity(DeviceFieldBase):
 
 class EMChargingTR(DeviceFieldBase):
     """ 电表计费时段 """
+    __slots__ = ("tz", "begin", "end", "level")
 
     def __init__(self) -> None:
         # 时区: 默认 UTC+8 (东8区)
@@ -293,6 +354,7 @@ class EMChargingTR(DeviceFieldBase):
 
 class EnergyMeasure(DeviceFieldBase):
     """ 电量/能量度量 """
+    __slots__ = ("total", "sharp", "peak", "flat", "valley")
 
     def __init__(self) -> None:
         self.total: ACEnergy = ACEnergy()
@@ -303,6 +365,7 @@ class EnergyMeasure(DeviceFieldBase):
 
 class AirConditionerRuntime(DeviceFieldBase):
     """ 空调运行时度量 """
+    __slots__ = ("temperature", "refrigeration_low", "refrigeration_high", "heating_low", "heating_high")
 
     def __init__(self) -> None:
         # 当前温度
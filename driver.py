@@ -1,7 +1,10 @@
 # -*- encoding: utf-8 -*-
 
 import abc
+import collections
+import threading
 import typing
+import weakref
 
 from addr import AddrRange
 from addrspace import AddressSpace
@@ -9,6 +12,44 @@ from devdata import DD
 from devfield import DevCmd, DeviceType
 from devfield import DevRet
 
+class DDCache:
+    """ 设备 DD 实例缓存: 实例在解析时借出, 使用者 (服务端编码响应后) 归还后才能再次借出.
+
+    只缓存已归还的实例, 超过 max_devices 时淘汰最久未归还的设备; 未归还的实例不会被复用.
+    """
+
+    def __init__(self, max_devices: int = 1000) -> None:
+        self.max_devices = max_devices
+        # 已归还的实例
+        self.items: typing.OrderedDict[tuple, DD] = collections.OrderedDict()
+        # 借出的实例 -> 缓存键, 未归还的实例释放后自动删除
+        self.leased: typing.MutableMapping[DD, tuple] = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def take(self, key: tuple, cls: typing.Type[DD]) -> DD:
+        """ 借出已归还的实例并重置, 没有时 (首次解析或上次的实例尚未归还) 借出新实例 """
+        with self.lock:
+            dd = self.items.pop(key, None)
+            reuse = dd is not None
+            if not reuse:
+                dd = cls()
+            self.leased[dd] = key
+        if reuse:
+            # 已从缓存取出, 重置时不会被其他请求使用
+            dd.reset()
+        return dd
+
+    def release(self, dd: DD) -> None:
+        """ 归还借出的实例, 归还后调用者不能再使用该实例; 不是由本缓存借出的实例忽略 """
+        with self.lock:
+            key = self.leased.pop(dd, None)
+            if key is None:
+                return
+            self.items[key] = dd
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_devices:
+                self.items.popitem(last=False)
+
 class DriverBase(abc.ABC):
     """ 设备驱动基类 """
 
@@ -18,6 +59,12 @@ class DriverBase(abc.ABC):
     PRODUCER: str = "生产商"
     # 型号
     MODEL: str = "型号"
+    # 采集计划合并区间时允许跨越的最大空洞地址数
+    ADDR_MERGE_GAP: int = 0
+    # 可合并的幂等指令名: 同一设备排队中的同名指令只执行最后一条 (见 execqueue)
+    COALESCE_COMMANDS: typing.FrozenSet[str] = frozenset()
+    # reuseDD 缓存的最大设备数
+    DD_CACHE_SIZE: int = 1000
 
     @abc.abstractmethod
     def defineAddrRange(self) -> typing.List[AddrRange]:
@@ -29,6 +76,27 @@ class DriverBase(abc.ABC):
         """ 解析设备数据 """
         pass
 
+    def reuseDD(self, addr_space: AddressSpace, cls: typing.Type[DD]) -> DD:
+        """ 取得当前设备上次解析使用的 DD 实例并重置, 以减少对象分配
+
+        设备由请求中的 device_id 区分, 未提供 device_id 时返回新实例.
+        只复用经 releaseDD 归还的实例 (服务端在响应编码完成后归还), 上次的实例未归还时返回新实例;
+        缓存按最近归还保留 DD_CACHE_SIZE 个设备.
+        """
+        device_id = getattr(addr_space, "device_id", "")
+        if not device_id:
+            return cls()
+        cache = self.__dict__.get("dd_cache")
+        if cache is None:
+            cache = self.__dict__.setdefault("dd_cache", DDCache(self.DD_CACHE_SIZE))
+        return cache.take((device_id, cls), cls)
+
+    def releaseDD(self, dd: DD) -> None:
+        """ 归还 reuseDD 借出的实例, 其他实例忽略. 归还后不能再使用该实例 """
+        cache = self.__dict__.get("dd_cache")
+        if cache is not None and dd is not None:
+            cache.release(dd)
+
     @abc.abstractmethod
     def execCommand(self, cmd: DevCmd) -> DevRet:
         """ 执行指令 """
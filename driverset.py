@@ -1,29 +1,258 @@
 # -*- encoding: utf-8 -*-
 
-from math import prod
+import ast
+import glob
+import hashlib
+import importlib.metadata
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
 import typing
+from addr import plan_addr_range
 from driver import DriverBase
 from devfield import DeviceType
-import driver_udd_skiffenergy_emu
+import serializer
+
+logger = logging.getLogger("driver")
+
+# 驱动模块文件名模式
+DRIVER_FILE_PATTERN = "driver_*.py"
+# 驱动入口点分组, 入口点名称为 "类型|生产商|型号", 值为 "模块:类"
+DRIVER_ENTRY_POINT_GROUP = "qingems.drivers"
+# 额外的驱动目录, 多个目录以 os.pathsep 分隔
+DRIVER_PATH_ENV = "QINGEMS_DRIVER_PATH"
+
+class AddrPlanCache:
+    """ 驱动采集计划及其序列化结果的缓存 """
+
+    def __init__(self, driver: DriverBase) -> None:
+        addr_range = driver.defineAddrRange()
+        addr_plan, addr_map = plan_addr_range(addr_range, driver.ADDR_MERGE_GAP)
+        # /v1/addr 响应的 result 部分
+        self.result: dict = {
+            "addr_range": addr_range,
+            "addr_plan": addr_plan,
+            "addr_map": addr_map,
+        }
+        # result 的 JSON 编码
+        self.body: bytes = serializer.dumps(self.result)
+        # 实体标签, 采集计划变化时改变
+        self.etag: str = '"%s"' % hashlib.sha1(self.body).hexdigest()
+
+class DriverEntry:
+    """ 尚未加载的驱动: 只记录元数据和加载位置 """
+
+    def __init__(self, type: DeviceType, producer: str, model: str, module: str, cls: str, path: str = None) -> None:
+        self.type = type
+        self.producer = producer
+        self.model = model
+        # 模块名
+        self.module = module
+        # 驱动类名
+        self.cls = cls
+        # 模块文件路径, 入口点驱动为 None
+        self.path = path
+
+def scan_driver_file(path: str) -> typing.List[DriverEntry]:
+    """ 解析驱动模块源码 (不导入), 找出声明了 DEVICE_TYPE/PRODUCER/MODEL 的类 """
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    module = os.path.splitext(os.path.basename(path))[0]
+    entries = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        meta = {}
+        for stmt in node.body:
+            if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name):
+                meta[stmt.target.id] = stmt.value
+            elif isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                meta[stmt.targets[0].id] = stmt.value
+        type = meta.get("DEVICE_TYPE")
+        producer = meta.get("PRODUCER")
+        model = meta.get("MODEL")
+        if not (isinstance(type, ast.Attribute) and isinstance(producer, ast.Constant) and isinstance(model, ast.Constant)):
+            continue
+        if type.attr not in DeviceType.__members__:
+            continue
+        entries.append(DriverEntry(DeviceType[type.attr], str(producer.value), str(model.value), module, node.name, path))
+    return entries
 
 class DriverSet:
     def __init__(self) -> None:
         self.driver: typing.Dict[str, DriverBase] = {}
+        self.addr_cache: typing.Dict[str, AddrPlanCache] = {}
+        # 已发现但尚未加载的驱动
+        self.lazy: typing.Dict[str, DriverEntry] = {}
+        # 已扫描的驱动模块文件 -> (修改时间, 驱动键列表)
+        self.files: typing.Dict[str, typing.Tuple[float, typing.List[str]]] = {}
+        # 扫描过的驱动目录
+        self.dirs: typing.List[str] = []
+        self.lock = threading.RLock()
     
     def register(self, type: DeviceType, producer: str, model: str, driver: DriverBase):
         key = DriverSet.gen_driver_index_key(type, producer, model)
         self.driver[key] = driver
+        self.addr_cache.pop(key, None)
+        try:
+            self.addr_cache[key] = AddrPlanCache(driver)
+        except Exception as e:
+            # 驱动定义有误时不影响注册, 请求时再报告错误
+            logger.error("[DRIVER] [%s] defineAddrRange FAIL [%s]: \n%s", key, str(e), traceback.format_exc())
+
+    def contains(self, type: DeviceType, producer: str, model: str) -> bool:
+        """ 是否有已注册或已发现的驱动 (不加载驱动) """
+        key = DriverSet.gen_driver_index_key(type, producer, model)
+        return key in self.driver or key in self.lazy
+
+    def unregister(self, type: DeviceType, producer: str, model: str):
+        key = DriverSet.gen_driver_index_key(type, producer, model)
+        self.driver.pop(key, None)
+        self.addr_cache.pop(key, None)
+        self.lazy.pop(key, None)
         
     def ref(self, type: DeviceType, producer: str, model: str) -> DriverBase:
         key = DriverSet.gen_driver_index_key(type, producer, model)
-        return None if key not in self.driver else self.driver[key]
+        d = self.driver.get(key)
+        if d is None and key in self.lazy:
+            d = self.load(key)
+        return d
+
+    def load(self, key: str) -> DriverBase:
+        """ 导入并注册已发现的驱动 """
+        with self.lock:
+            if key in self.driver:
+                return self.driver[key]
+            entry = self.lazy.get(key)
+            if entry is None:
+                return None
+            if entry.path is None:
+                module = importlib.import_module(entry.module)
+            else:
+                module = sys.modules.get(entry.module)
+                if module is None or getattr(module, "__file__", None) != entry.path:
+                    module = load_module_file(entry.module, entry.path)
+            cls = getattr(module, entry.cls)
+            self.register(entry.type, entry.producer, entry.model, cls())
+            del self.lazy[key]
+            return self.driver[key]
+
+    def discover(self, directory: str, pattern: str = DRIVER_FILE_PATTERN):
+        """ 发现目录中的驱动模块, 只读取元数据, 首次使用时才导入 """
+        with self.lock:
+            directory = os.path.abspath(directory)
+            if directory not in self.dirs:
+                self.dirs.append(directory)
+            for path in sorted(glob.glob(os.path.join(directory, pattern))):
+                if path not in self.files:
+                    self.scan_file(path)
+
+    def discover_entry_points(self, group: str = DRIVER_ENTRY_POINT_GROUP):
+        """ 发现已安装包通过入口点声明的驱动 """
+        with self.lock:
+            for ep in importlib.metadata.entry_points(group=group):
+                type, _, rest = ep.name.partition("|")
+                producer, _, model = rest.partition("|")
+                type = DeviceType(int(type)) if type.isdigit() else DeviceType[type]
+                module, _, cls = ep.value.partition(":")
+                key = DriverSet.gen_driver_index_key(type, producer, model)
+                if key not in self.driver:
+                    self.lazy[key] = DriverEntry(type, producer, model, module, cls)
+
+    def scan_file(self, path: str):
+        entries = scan_driver_file(path)
+        keys = []
+        for entry in entries:
+            key = DriverSet.gen_driver_index_key(entry.type, entry.producer, entry.model)
+            if key not in self.driver:
+                self.lazy[key] = entry
+            keys.append(key)
+        self.files[path] = (os.path.getmtime(path), keys)
+
+    def reload_changed(self) -> typing.List[str]:
+        """ 重新扫描驱动目录: 修改过的模块在下次使用时重新导入, 删除的模块注销其驱动
+
+        返回发生变化的文件列表.
+        """
+        with self.lock:
+            changed = []
+            current = set()
+            for directory in self.dirs:
+                current.update(glob.glob(os.path.join(directory, DRIVER_FILE_PATTERN)))
+            for path, (mtime, keys) in list(self.files.items()):
+                if path in current and os.path.getmtime(path) == mtime:
+                    continue
+                for key in keys:
+                    self.driver.pop(key, None)
+                    self.addr_cache.pop(key, None)
+                    self.lazy.pop(key, None)
+                del self.files[path]
+                sys.modules.pop(os.path.splitext(os.path.basename(path))[0], None)
+                changed.append(path)
+            for path in sorted(current):
+                if path not in self.files:
+                    self.scan_file(path)
+                    if path not in changed:
+                        changed.append(path)
+            return changed
+
+    def watch(self, interval: float) -> threading.Thread:
+        """ 启动后台线程, 每 interval 秒检查一次驱动模块是否修改 """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    for path in self.reload_changed():
+                        logger.info("[DRIVER] reload [%s]", path)
+                except Exception as e:
+                    logger.error("[DRIVER] reload FAIL [%s]: \n%s", str(e), traceback.format_exc())
+        t = threading.Thread(target=run, name="driver-reload", daemon=True)
+        t.start()
+        return t
+
+    def ref_addr_plan(self, type: DeviceType, producer: str, model: str) -> AddrPlanCache:
+        """ 驱动的采集计划缓存, 首次使用或失效后重新生成 """
+        key = DriverSet.gen_driver_index_key(type, producer, model)
+        cache = self.addr_cache.get(key)
+        if cache is None:
+            d = self.ref(type, producer, model)
+            if d is None:
+                raise RuntimeError("No driver for [%s(%s):%s:%s]" % (type, type.name, producer, model))
+            cache = self.addr_cache.get(key)
+            if cache is None:
+                cache = self.addr_cache[key] = AddrPlanCache(d)
+        return cache
+
+    def invalidate(self, type: DeviceType, producer: str, model: str):
+        """ 驱动重新加载或采集定义变化后, 清除缓存的采集计划 """
+        self.addr_cache.pop(DriverSet.gen_driver_index_key(type, producer, model), None)
 
     def gen_driver_index_key(type: DeviceType, producer: str, model: str) -> str:
         return "%s|%s|%s" % (type, producer, model)
 
+def load_module_file(name: str, path: str):
+    """ 从文件导入模块, 替换同名的已导入模块 """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        sys.modules.pop(name, None)
+        raise
+    return module
+
 DRIVERS = DriverSet()
 
 def LoadLocalDriverFor(cls):
     DRIVERS.register(cls.DEVICE_TYPE, cls.PRODUCER, cls.MODEL, cls())
-    
-LoadLocalDriverFor(driver_udd_skiffenergy_emu.UDD_Skiffenergy_EMU)
+
+DRIVERS.discover(os.path.dirname(os.path.abspath(__file__)))
+for directory in os.environ.get(DRIVER_PATH_ENV, "").split(os.pathsep):
+    if directory:
+        DRIVERS.discover(directory)
+DRIVERS.discover_entry_points()
@@ -0,0 +1,348 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+""" 寄存器级设备模拟器, 用于压力测试和长时间运行测试
+
+按驱动的采集计划为每个虚拟设备生成寄存器内容, 并随时间演变:
+    walk        随机游走 (寄存器在初值附近波动)
+    counter     32位累加计数 (两个寄存器, 如电量)
+    alarm       告警位随机翻转 (大部分时间为0)
+    const       不变
+位地址区间默认为 alarm, 寄存器区间默认为 walk, 可用规则文件按地址覆盖:
+    [{"addr_type": "MODBUS_REGS", "begin": 100, "end": 164, "kind": "alarm", "rate": 0.001}, ...]
+每次演变只改变 churn 比例的寄存器, 与实际设备多数测点稳定的特征一致.
+
+输出方式:
+    python emulator.py http --type 0 --producer skiffenergy --model emu --devices 1000 --rate 500
+        以固定速率向服务端发送 /v1/parse 请求 (开环: 服务端变慢时请求不会减少), 结束时输出 JSON 统计
+    python emulator.py modbus --type 0 --producer skiffenergy --model emu --devices 1000 --port 5020
+        以 Modbus TCP 提供虚拟设备, 第 i 个设备位于端口 port + i // 247, 单元号 i % 247 + 1
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import struct
+import sys
+import time
+import typing
+import urllib.parse
+
+from addr import AddrRange, AddrType, is_bit_type
+from devfield import DeviceType
+import driverset
+
+# 每个 Modbus 端口的设备数 (单元号 1~247)
+UNITS_PER_PORT = 247
+
+class Rule:
+    """ 寄存器演变规则, 作用于 [begin, end) 地址 """
+
+    def __init__(self, addr_type: AddrType, begin: int, end: int, kind: str, rate: float = 0.01, step: int = 8) -> None:
+        self.addr_type = addr_type
+        self.begin = begin
+        self.end = end
+        # walk/counter/alarm/const
+        self.kind = kind
+        # alarm: 每次演变每位翻转的概率; counter: 每秒增量
+        self.rate = rate
+        # walk: 单次变化的最大幅度
+        self.step = step
+
+    @staticmethod
+    def from_row(row: dict) -> "Rule":
+        addr_type = row.get("addr_type", "MODBUS_REGS")
+        addr_type = AddrType[addr_type] if isinstance(addr_type, str) and not addr_type.isdigit() else AddrType(int(addr_type))
+        return Rule(addr_type, int(row["begin"]), int(row["end"]), str(row["kind"]),
+                    float(row.get("rate", 0.01)), int(row.get("step", 8)))
+
+class Block:
+    """ 虚拟设备的一个采集区间及其寄存器内容 """
+
+    def __init__(self, r: AddrRange, rules: typing.List[Rule], rnd: random.Random) -> None:
+        self.range = r
+        self.width = 1 if is_bit_type(r.addr_type) else 16
+        count = r.addr_end - r.addr_begin
+        self.data = bytearray((count * self.width + 7) // 8)
+        default = "alarm" if self.width == 1 else "walk"
+        # [(规则, 区间内起始下标, 结束下标)]
+        self.parts: typing.List[typing.Tuple[Rule, int, int]] = []
+        covered = 0
+        for rule in sorted(rules, key=lambda x: x.begin):
+            if rule.addr_type != r.addr_type or rule.end <= r.addr_begin or rule.begin >= r.addr_end:
+                continue
+            begin = max(rule.begin, r.addr_begin) - r.addr_begin
+            end = min(rule.end, r.addr_end) - r.addr_begin
+            if begin > covered:
+                self.parts.append((Rule(r.addr_type, 0, 0, default), covered, begin))
+            self.parts.append((rule, max(begin, covered), end))
+            covered = max(covered, end)
+        if covered < count:
+            self.parts.append((Rule(r.addr_type, 0, 0, default), covered, count))
+        if self.width == 16:
+            for rule, begin, end in self.parts:
+                if rule.kind == "walk":
+                    for i in range(begin, end):
+                        struct.pack_into(">H", self.data, i * 2, rnd.randrange(0, 4000))
+
+    def step(self, rnd: random.Random, dt: float, churn: float) -> None:
+        for rule, begin, end in self.parts:
+            n = end - begin
+            if n <= 0 or rule.kind == "const":
+                continue
+            if rule.kind == "alarm":
+                flips = n * rule.rate
+                k = int(flips) + (1 if rnd.random() < flips - int(flips) else 0)
+                for _ in range(k):
+                    self.flip(rnd, begin + rnd.randrange(n))
+            elif rule.kind == "counter" and self.width == 16:
+                for i in range(begin, end - 1, 2):
+                    v = struct.unpack_from(">I", self.data, i * 2)[0]
+                    struct.pack_into(">I", self.data, i * 2, (v + max(1, int(rule.rate * dt))) & 0xFFFFFFFF)
+            elif rule.kind == "walk" and self.width == 16:
+                changes = n * churn
+                k = int(changes) + (1 if rnd.random() < changes - int(changes) else 0)
+                for _ in range(k):
+                    i = begin + rnd.randrange(n)
+                    v = struct.unpack_from(">H", self.data, i * 2)[0] + rnd.randint(-rule.step, rule.step)
+                    struct.pack_into(">H", self.data, i * 2, min(0xFFFF, max(0, v)))
+
+    def flip(self, rnd: random.Random, index: int) -> None:
+        """ 翻转一个告警位: 位地址区间为该位, 寄存器区间为寄存器内的随机位 """
+        if self.width == 1:
+            self.data[index >> 3] ^= 1 << (index & 0x07)
+        else:
+            self.data[index * 2 + rnd.randrange(2)] ^= 1 << rnd.randrange(8)
+
+class VirtualDevice:
+    """ 虚拟设备 """
+
+    def __init__(self, device_id: str, plan: typing.List[AddrRange], rules: typing.List[Rule], seed: int) -> None:
+        self.device_id = device_id
+        self.rnd = random.Random(seed)
+        self.blocks = [Block(r, rules, self.rnd) for r in plan]
+        self.last = time.monotonic()
+        # 增量模式下服务端最近返回的序号, None 表示尚未收到
+        self.seq: int = None
+
+    def step(self, churn: float) -> None:
+        now = time.monotonic()
+        dt, self.last = now - self.last, now
+        for b in self.blocks:
+            b.step(self.rnd, dt, churn)
+
+    def segments(self) -> typing.List[dict]:
+        """ /v1/parse 请求的 segment 参数 """
+        return [{
+            "addr_begin": b.range.addr_begin,
+            "addr_end": b.range.addr_end,
+            "width": b.width,
+            "space": b.range.space,
+            "data": base64.urlsafe_b64encode(b.data).decode("ascii"),
+        } for b in self.blocks]
+
+def make_devices(type: DeviceType, producer: str, model: str, count: int, rules: typing.List[Rule],
+                 seed: int = 1) -> typing.List[VirtualDevice]:
+    plan = driverset.DRIVERS.ref_addr_plan(type, producer, model).result["addr_plan"]
+    return [VirtualDevice("emu-%d" % i, plan, rules, seed + i) for i in range(count)]
+
+def load_rules(path: str) -> typing.List[Rule]:
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [Rule.from_row(row) for row in json.load(f)]
+
+# ---------------------------------------------------------------- HTTP 负载
+
+class HttpClient:
+    """ HTTP/1.1 持久连接客户端, 支持 Content-Length/分块/关闭连接三种响应体, HTTP/1.0 响应后重新连接 """
+
+    def __init__(self, host: str, port: int, timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+
+    async def post(self, path: str, body: bytes) -> typing.Tuple[int, bytes]:
+        """ 返回 (状态码, 响应体) """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            return await asyncio.wait_for(self.exchange(path, body), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def exchange(self, path: str, body: bytes) -> typing.Tuple[int, bytes]:
+        self.writer.write(("POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                           % (path, self.host, len(body))).encode("latin-1") + body)
+        version, status = (await self.reader.readline()).split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            data = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                n = int((await self.reader.readline()).split(b";")[0], 16)
+                chunks.append((await self.reader.readexactly(n + 2))[:n])
+                if n == 0:
+                    break
+            data = b"".join(chunks)
+        else:
+            data = await self.reader.read()
+        connection = headers.get("connection", "").lower()
+        if connection == "close" or version == b"HTTP/1.0" and connection != "keep-alive" \
+                or "content-length" not in headers and "transfer-encoding" not in headers:
+            self.close()
+        return status, data
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+async def run_http(url: str, type: DeviceType, producer: str, model: str, devices: typing.List[VirtualDevice],
+                   rate: float, duration: float, connections: int, churn: float, delta: bool, timeout: float) -> dict:
+    u = urllib.parse.urlsplit(url)
+    target = {"type": type.value, "producer": producer, "model": model}
+    latencies: typing.List[float] = []
+    stats = {"sent": 0, "ok": 0, "errors": 0, "lag_max": 0.0, "bytes_out": 0, "bytes_in": 0,
+             "full": 0, "delta": 0, "unchanged": 0}
+    start = time.monotonic()
+    total = int(rate * duration)
+    counter = iter(range(total))
+
+    def track_delta(device: VirtualDevice, data: bytes) -> None:
+        """ 记录服务端返回的序号, 下次请求携带 (序号不一致时服务端返回全量) """
+        result = json.loads(data).get("result")
+        if not isinstance(result, dict) or "seq" not in result:
+            device.seq = None
+            return
+        device.seq = result["seq"]
+        stats["unchanged" if result.get("unchanged") else "full" if result.get("full") else "delta"] += 1
+
+    async def worker():
+        client = HttpClient(u.hostname, u.port or 80, timeout)
+        for i in counter:
+            due = start + i / rate
+            now = time.monotonic()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                stats["lag_max"] = max(stats["lag_max"], now - due)
+            device = devices[i % len(devices)]
+            device.step(churn)
+            params = dict(target, segment=device.segments(), device_id=device.device_id)
+            if delta:
+                params["delta"] = True
+                if device.seq is not None:
+                    params["seq"] = device.seq
+            body = json.dumps({"version": 1, "jsonrpc": "2.0", "id": i, "method": "parseDeviceData", "params": params}).encode()
+            stats["sent"] += 1
+            stats["bytes_out"] += len(body)
+            t0 = time.monotonic()
+            try:
+                status, data = await client.post(u.path.rstrip("/") + "/v1/parse", body)
+                stats["bytes_in"] += len(data)
+                if status == 200:
+                    stats["ok"] += 1
+                    latencies.append(time.monotonic() - t0)
+                    if delta:
+                        track_delta(device, data)
+                else:
+                    stats["errors"] += 1
+            except Exception:
+                stats["errors"] += 1
+        client.close()
+
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    elapsed = time.monotonic() - start
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+    stats.update({
+        "devices": len(devices),
+        "rate": rate,
+        "elapsed": elapsed,
+        "achieved_rate": stats["sent"] / elapsed if elapsed > 0 else 0.0,
+        "latency_avg": statistics.mean(latencies) if latencies else 0.0,
+        "latency_p50": pct(0.5),
+        "latency_p99": pct(0.99),
+        "latency_max": latencies[-1] if latencies else 0.0,
+    })
+    return stats
+
+# ---------------------------------------------------------------- Modbus TCP
+
+async def run_modbus(host: str, port: int, devices: typing.List[VirtualDevice], interval: float, churn: float) -> None:
+    import modbus_tcp
+    sims: typing.List[modbus_tcp.ModbusSimulator] = []
+    # [(设备, 模拟单元)]
+    bindings = []
+    for i, device in enumerate(devices):
+        if i % UNITS_PER_PORT == 0:
+            sim = modbus_tcp.ModbusSimulator(host, port + i // UNITS_PER_PORT)
+            await sim.start()
+            sims.append(sim)
+        bindings.append((device, sims[-1].unit(i % UNITS_PER_PORT + 1)))
+    print("serving %d devices on %s:%d-%d" % (len(devices), host, port, port + len(sims) - 1), file=sys.stderr)
+    while True:
+        for device, unit in bindings:
+            device.step(churn)
+            for b in device.blocks:
+                if b.width == 16:
+                    unit.set_registers(b.range.addr_type, b.range.addr_begin, b.data)
+                else:
+                    for k in range(b.range.addr_end - b.range.addr_begin):
+                        unit.set_bit(b.range.addr_type, b.range.addr_begin + k, b.data[k >> 3] >> (k & 0x07) & 0x01)
+        await asyncio.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="QingEMS register-level device emulator")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("http", "modbus"):
+        p = sub.add_parser(name)
+        p.add_argument("--type", type=int, required=True, help="device type value")
+        p.add_argument("--producer", required=True)
+        p.add_argument("--model", required=True)
+        p.add_argument("--devices", type=int, default=100, help="number of virtual devices")
+        p.add_argument("--rules", default="", help="JSON register rules file")
+        p.add_argument("--churn", type=float, default=0.05, help="fraction of walk registers changed per step")
+        p.add_argument("--seed", type=int, default=1)
+    p = sub.choices["http"]
+    p.add_argument("--url", default="http://127.0.0.1:10099")
+    p.add_argument("--rate", type=float, default=100.0, help="requests per second")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds")
+    p.add_argument("--connections", type=int, default=8)
+    p.add_argument("--delta", action="store_true", help="use delta mode")
+    p.add_argument("--timeout", type=float, default=10.0)
+    p = sub.choices["modbus"]
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5020)
+    p.add_argument("--interval", type=float, default=1.0, help="seconds between register updates")
+    args = parser.parse_args()
+
+    type = DeviceType(args.type)
+    devices = make_devices(type, args.producer, args.model, args.devices, load_rules(args.rules), args.seed)
+    if args.command == "http":
+        stats = asyncio.run(run_http(args.url, type, args.producer, args.model, devices, args.rate, args.duration,
+                                     args.connections, args.churn, args.delta, args.timeout))
+        print(json.dumps(stats, indent=2))
+    else:
+        asyncio.run(run_modbus(args.host, args.port, devices, args.interval, args.churn))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+""" 设备指令队列: 同一设备的指令按提交顺序逐个执行, 不同设备的指令由工作线程池并发执行
+
+/v1/exec 请求参数:
+    async: true         提交后立即返回任务 {"job": {"id": ..., "state": "queued", ...}}
+    timeout: 秒         任务的截止时间, 截止前未开始执行的任务不再执行 (expired), 缺省为 ExecQueue.timeout
+    coalesce: true/键   可合并的幂等指令 (如重复写设定值): 同一设备尚未开始执行的同键任务被新任务取代 (superseded),
+                        键缺省为指令名. 驱动的 COALESCE_COMMANDS 中的指令总是可合并
+带 device_id 的同步请求同样经过队列 (按设备串行), 等待至截止时间后返回结果; 无 device_id 的同步请求直接执行.
+同步请求会阻塞处理线程: asyncio 服务端解码请求后, 将含指令的请求交给独立的线程池处理.
+
+任务查询:
+    GET /v1/job?id=ID               任务状态
+    GET /v1/job?id=ID&wait=秒       等待任务结束 (长轮询), 超时返回当前状态
+任务状态: queued -> running -> done/failed, 或 expired/superseded. 结束的任务保留最近 max_jobs 个.
+"""
+
+import collections
+import itertools
+import logging
+import random
+import threading
+import time
+import traceback
+import typing
+
+from devfield import DevRet
+
+logger = logging.getLogger("driver")
+
+# 结束状态
+FINISHED = frozenset(["done", "failed", "expired", "superseded"])
+
+class Job:
+    """ 指令任务 """
+
+    def __init__(self, id: str, device: str, cmd: str, func: typing.Callable[[], DevRet], deadline: float,
+                 coalesce: str = None) -> None:
+        self.id = id
+        # 设备键
+        self.device = device
+        # 指令名
+        self.cmd = cmd
+        self.func = func
+        # 截止时间 (time.time())
+        self.deadline = deadline
+        # 合并键, None 表示不可合并
+        self.coalesce = coalesce
+        self.state = "queued"
+        self.created = time.time()
+        self.started: float = None
+        self.finished: float = None
+        self.result: DevRet = None
+        self.error: str = None
+        # 取代本任务的任务ID
+        self.superseded_by: str = None
+        self.event = threading.Event()
+
+    def finish(self, state: str) -> None:
+        self.state = state
+        self.finished = time.time()
+        self.func = None
+        self.event.set()
+
+    def summary(self) -> dict:
+        d = {
+            "id": self.id,
+            "device": self.device,
+            "cmd": self.cmd,
+            "state": self.state,
+            "created": self.created,
+            "deadline": self.deadline,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.result is not None:
+            d["succ"] = self.result.succ
+            d["cont"] = self.result.cont
+        if self.error is not None:
+            d["error"] = self.error
+        if self.superseded_by is not None:
+            d["superseded_by"] = self.superseded_by
+        return d
+
+class ExecQueue:
+    """ 按设备串行的指令队列, 见模块说明 """
+
+    def __init__(self, workers: int = 4, timeout: float = 30.0, max_jobs: int = 10000) -> None:
+        # 工作线程数
+        self.workers = workers
+        # 缺省截止时间 (秒)
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        # 设备键 -> 等待执行的任务
+        self.pending: typing.Dict[str, typing.Deque[Job]] = {}
+        # 有待执行任务且没有任务在执行的设备, 按就绪顺序轮转
+        self.ready: typing.Deque[str] = collections.deque()
+        # 在 ready 中或有任务在执行的设备
+        self.scheduled: typing.Set[str] = set()
+        # 任务ID -> 任务, 按提交顺序
+        self.jobs: typing.OrderedDict[str, Job] = collections.OrderedDict()
+        # 已结束的任务ID, 按结束顺序
+        self.finished: typing.Deque[str] = collections.deque()
+        self.ids = itertools.count(1)
+        # 任务ID前缀, 区分服务重启前后的任务
+        self.prefix = "%08x" % random.getrandbits(32)
+        self.cond = threading.Condition()
+        self.threads: typing.List[threading.Thread] = []
+        self.closed = False
+
+    def start(self) -> None:
+        with self.cond:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self.run, name="exec-%d" % i, daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def submit(self, device: str, cmd: str, func: typing.Callable[[], DevRet], timeout: float = None,
+               coalesce: str = None) -> Job:
+        """ 提交任务, device 为空时不与其他任务串行 """
+        if not self.threads:
+            self.start()
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Exec queue is closed")
+            job = Job("%s-%d" % (self.prefix, next(self.ids)), device, cmd, func, deadline, coalesce)
+            # 无设备键的任务使用独立的队列
+            key = device or job.id
+            queue = self.pending.setdefault(key, collections.deque())
+            if coalesce is not None:
+                for old in [j for j in queue if j.coalesce == coalesce]:
+                    queue.remove(old)
+                    old.superseded_by = job.id
+                    self.finish(old, "superseded")
+            queue.append(job)
+            self.jobs[job.id] = job
+            self.evict()
+            if key not in self.scheduled:
+                self.scheduled.add(key)
+                self.ready.append(key)
+                self.cond.notify()
+        return job
+
+    def evict(self) -> None:
+        """ 超过 max_jobs 时删除最早结束的任务 (在锁内调用) """
+        while len(self.jobs) > self.max_jobs and self.finished:
+            del self.jobs[self.finished.popleft()]
+
+    def finish(self, job: Job, state: str) -> None:
+        """ 结束任务并记录结束顺序 (在锁内调用) """
+        job.finish(state)
+        self.finished.append(job.id)
+
+    def get(self, id: str) -> typing.Optional[Job]:
+        with self.cond:
+            return self.jobs.get(id)
+
+    def wait(self, id: str, timeout: float) -> typing.Optional[Job]:
+        """ 等待任务结束, 任务不存在时返回 None """
+        job = self.get(id)
+        if job is not None and timeout > 0:
+            job.event.wait(timeout)
+        return job
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.ready and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                key = self.ready.popleft()
+                job = self.pending[key].popleft()
+                if time.time() > job.deadline:
+                    self.finish(job, "expired")
+                    self.release(key)
+                    continue
+                job.state = "running"
+                job.started = time.time()
+            try:
+                job.result = job.func()
+                state = "done"
+            except Exception as e:
+                logger.error("[DRIVER] [EXEC] [%s] [%s] FAIL [%s]: \n%s", job.device, job.cmd, str(e), traceback.format_exc())
+                job.error = str(e)
+                state = "failed"
+            with self.cond:
+                self.finish(job, state)
+                self.release(key)
+
+    def release(self, key: str) -> None:
+        """ 设备的一个任务结束: 还有待执行任务时重新排入就绪队列 (在锁内调用) """
+        if self.pending[key]:
+            self.ready.append(key)
+            self.cond.notify()
+        else:
+            del self.pending[key]
+            self.scheduled.discard(key)
+
+    def close(self) -> None:
+        """ 停止工作线程, 等待执行的任务结束为 expired 并唤醒等待者 """
+        with self.cond:
+            self.closed = True
+            for queue in self.pending.values():
+                for job in queue:
+                    self.finish(job, "expired")
+                queue.clear()
+            self.ready.clear()
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+""" 解析结果的内存时间序列
+
+按设备 (驱动键 + device_id) 记录每次解析的 DD 数值叶子 (数值和布尔字段, 告警和分时电价除外),
+字段路径为字段名/列表下标以 "." 连接, 如 cluster.0.runtime.voltage.mass.
+
+每个设备保存:
+    原始环      最近 raw 次采样的原始值
+    降采样环    每个 (window, capacity) 保存最近 capacity 个 window 秒时间窗的 min/max/sum/count
+所有数据为预分配的 array('d') 列, 每设备字段数不超过 max_fields, 内存上限见 HistoryStore.bytes_per_device.
+时间早于该设备最近一次采样的样本被丢弃.
+
+查询接口:
+    GET /v1/history                                                     设备列表和配置
+    GET /v1/history?device=KEY&field=runtime.*&start=T0&end=T1&window=60
+设备也可用 type/producer/model/device_id 参数指定. field 可重复, 支持 fnmatch 通配, 缺省为全部字段.
+window=0 (缺省) 返回原始值, 其他值使用能整除它的最大降采样窗口重新聚合, 返回各时间窗的 min/max/avg.
+"""
+
+import array
+import collections
+import fnmatch
+import math
+import threading
+import time
+import typing
+
+from devfield import AlarmInfo, EMChargingTR
+import iface_class
+
+NAN = float("nan")
+
+# 原始环和降采样环的统计列
+RAW_STATS = ("value",)
+AGG_STATS = ("min", "max", "sum", "count")
+
+# 不记录的字段类型
+SKIP_TYPES = (AlarmInfo, EMChargingTR)
+
+def leaves(o: typing.Any, prefix: str, out: typing.Dict[str, float]) -> None:
+    """ 收集对象树的数值叶子 """
+    for k, v in (iface_class.fields(o).items() if isinstance(o, iface_class.JsonEnabled) else o.items()):
+        cls = v.__class__
+        if cls is float or cls is int or cls is bool:
+            out[prefix + str(k)] = float(v)
+        elif cls is list:
+            for i, item in enumerate(v):
+                if item.__class__ is float or item.__class__ is int:
+                    out["%s%s.%d" % (prefix, k, i)] = float(item)
+                elif isinstance(item, iface_class.JsonEnabled) and not isinstance(item, SKIP_TYPES):
+                    leaves(item, "%s%s.%d." % (prefix, k, i), out)
+        elif cls is dict or isinstance(v, iface_class.JsonEnabled) and not isinstance(v, SKIP_TYPES):
+            leaves(v, "%s%s." % (prefix, k), out)
+
+class Matcher:
+    """ 字段路径过滤, 缓存每个路径的匹配结果 """
+
+    def __init__(self, patterns: typing.Sequence[str]) -> None:
+        self.patterns = list(patterns)
+        self.cache: typing.Dict[str, bool] = {}
+
+    def match(self, path: str) -> bool:
+        if not self.patterns:
+            return True
+        m = self.cache.get(path)
+        if m is None:
+            m = any(fnmatch.fnmatchcase(path, p) for p in self.patterns)
+            if len(self.cache) < 65536:
+                self.cache[path] = m
+        return m
+
+class Ring:
+    """ 定长环形缓冲区: 时间列 + 每字段的统计列, 列号由 DeviceHistory 分配 """
+
+    def __init__(self, window: int, capacity: int, stats: typing.Tuple[str, ...]) -> None:
+        # 时间窗 (秒), 0 表示原始值
+        self.window = window
+        self.capacity = capacity
+        self.stats = stats
+        # 空值: 原始值 NaN, 聚合值 count 为 0
+        self.empty = (NAN,) if stats is RAW_STATS else (NAN, NAN, 0.0, 0.0)
+        self.times = array.array("d", [NAN]) * capacity
+        self.columns: typing.List[typing.Tuple[array.array, ...]] = []
+        # 下一个写入位置和已写入数量
+        self.next = 0
+        self.size = 0
+
+    def add_column(self) -> None:
+        self.columns.append(tuple(array.array("d", [v]) * self.capacity for v in self.empty))
+
+    def write(self, t: float, row: typing.Dict[int, tuple]) -> None:
+        """ 写入一个时间点, row 为列号 -> 统计值, 缺少的列写入空值 """
+        slot = self.next
+        self.times[slot] = t
+        empty = self.empty
+        for i, cols in enumerate(self.columns):
+            vals = row.get(i, empty)
+            for c, v in zip(cols, vals):
+                c[slot] = v
+        self.next = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def slots(self, start: float, end: float) -> typing.List[int]:
+        """ 时间在 [start, end) 内的位置, 按时间顺序 """
+        first = (self.next - self.size) % self.capacity
+        times = self.times
+        result = []
+        for k in range(self.size):
+            slot = (first + k) % self.capacity
+            if start <= times[slot] < end:
+                result.append(slot)
+        return result
+
+class Bucket:
+    """ 降采样环正在累计的时间窗 """
+
+    def __init__(self, ring: Ring) -> None:
+        self.ring = ring
+        self.start = -math.inf
+        # 列号 -> [min, max, sum, count]
+        self.acc: typing.Dict[int, typing.List[float]] = {}
+
+    def add(self, t: float, values: typing.Dict[int, float]) -> None:
+        """ 累计一个样本, values 为列号 -> 数值 """
+        start = t - t % self.ring.window
+        if start != self.start:
+            self.flush()
+            self.start = start
+        acc = self.acc
+        for i, v in values.items():
+            if v != v:
+                continue
+            a = acc.get(i)
+            if a is None:
+                acc[i] = [v, v, v, 1.0]
+            else:
+                if v < a[0]:
+                    a[0] = v
+                if v > a[1]:
+                    a[1] = v
+                a[2] += v
+                a[3] += 1.0
+
+    def flush(self) -> None:
+        if self.acc:
+            self.ring.write(self.start, self.acc)
+            self.acc = {}
+
+class DeviceHistory:
+    """ 单个设备的历史数据 """
+
+    def __init__(self, raw: int, windows: typing.Sequence[typing.Tuple[int, int]], max_fields: int) -> None:
+        self.raw = Ring(0, raw, RAW_STATS) if raw > 0 else None
+        self.buckets = [Bucket(Ring(w, c, AGG_STATS)) for w, c in windows]
+        self.max_fields = max_fields
+        # 字段路径 -> 列号, 各环共用
+        self.fields: typing.Dict[str, int] = {}
+        self.latest = -math.inf
+        self.lock = threading.Lock()
+
+    def columns(self, values: typing.Dict[str, float]) -> typing.Dict[int, float]:
+        """ 字段路径转换为列号, 新字段在字段数未满时分配列, 否则丢弃 """
+        fields = self.fields
+        row = {}
+        for path, v in values.items():
+            i = fields.get(path)
+            if i is None:
+                if len(fields) >= self.max_fields:
+                    continue
+                i = fields[path] = len(fields)
+                for ring in self.rings():
+                    ring.add_column()
+            row[i] = v
+        return row
+
+    def add(self, t: float, values: typing.Dict[str, float]) -> bool:
+        with self.lock:
+            if t < self.latest:
+                return False
+            self.latest = t
+            row = self.columns(values)
+            if self.raw is not None:
+                self.raw.write(t, {i: (v,) for i, v in row.items()})
+            for b in self.buckets:
+                b.add(t, row)
+            return True
+
+    def rings(self) -> typing.List[Ring]:
+        return ([] if self.raw is None else [self.raw]) + [b.ring for b in self.buckets]
+
+    def query_raw(self, matcher: Matcher, start: float, end: float) -> dict:
+        ring = self.raw
+        slots = ring.slots(start, end)
+        fields = {}
+        for path, i in self.fields.items():
+            if matcher.match(path):
+                col = ring.columns[i][0]
+                fields[path] = [plain(col[s]) for s in slots]
+        return {"window": 0, "time": [ring.times[s] for s in slots], "fields": fields}
+
+    def query_window(self, matcher: Matcher, start: float, end: float, window: int) -> dict:
+        """ 按 window 重新聚合能整除它的最大降采样窗口 (或原始值) """
+        source = None
+        for b in self.buckets:
+            if b.ring.window <= window and window % b.ring.window == 0 and (source is None or b.ring.window > source.ring.window):
+                source = b
+        ring = self.raw if source is None else source.ring
+        if ring is None:
+            raise AssertionError("No history window divides [%s]" % window)
+        rows = [(ring.times[s], s, None) for s in ring.slots(start, end)]
+        if source is not None and source.acc and start <= source.start < end:
+            rows.append((source.start, -1, source.acc))
+        times: typing.List[float] = []
+        index: typing.Dict[float, int] = {}
+        for t, _, _ in rows:
+            w = t - t % window
+            if w not in index:
+                index[w] = len(times)
+                times.append(w)
+        fields = {}
+        for path, i in self.fields.items():
+            if not matcher.match(path):
+                continue
+            acc = [[math.inf, -math.inf, 0.0, 0.0] for _ in times]
+            cols = ring.columns[i]
+            for t, s, current in rows:
+                if s >= 0:
+                    vals = (cols[0][s],) if source is None else (cols[0][s], cols[1][s], cols[2][s], cols[3][s])
+                else:
+                    vals = current.get(i, (NAN, NAN, 0.0, 0.0))
+                if source is None:
+                    v = vals[0]
+                    vals = (NAN, NAN, 0.0, 0.0) if v != v else (v, v, v, 1.0)
+                if vals[3] == 0:
+                    continue
+                a = acc[index[t - t % window]]
+                a[0] = min(a[0], vals[0])
+                a[1] = max(a[1], vals[1])
+                a[2] += vals[2]
+                a[3] += vals[3]
+            fields[path] = {
+                "min": [a[0] if a[3] else None for a in acc],
+                "max": [a[1] if a[3] else None for a in acc],
+                "avg": [a[2] / a[3] if a[3] else None for a in acc],
+            }
+        return {"window": window, "source": ring.window, "time": times, "fields": fields}
+
+def plain(v: float) -> typing.Optional[float]:
+    """ NaN 输出为 null """
+    return None if v != v else v
+
+def parse_windows(spec: str) -> typing.List[typing.Tuple[int, int]]:
+    """ 解析降采样配置 "60:1440,900:672" (窗口秒数:个数) """
+    windows = []
+    for item in spec.split(","):
+        if item.strip():
+            w, _, c = item.partition(":")
+            windows.append((int(w), int(c)))
+    return windows
+
+class HistoryStore:
+    """ 设备历史数据表, 超过 max_devices 时淘汰最久未更新的设备 """
+
+    def __init__(self, raw: int = 600, windows: typing.Sequence[typing.Tuple[int, int]] = ((60, 1440), (900, 672)),
+                 max_fields: int = 256, max_devices: int = 1000, patterns: typing.Sequence[str] = ()) -> None:
+        for w, c in windows:
+            if w <= 0 or c <= 0:
+                raise RuntimeError("Invalid history window: %s:%s" % (w, c))
+        # 原始环长度, 0 表示不保存原始值
+        self.raw = raw
+        # 降采样配置 [(窗口秒数, 个数)]
+        self.windows = sorted(windows)
+        self.max_fields = max_fields
+        self.max_devices = max_devices
+        # 记录的字段路径, 缺省为全部
+        self.matcher = Matcher(patterns)
+        self.devices: typing.OrderedDict[str, DeviceHistory] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def bytes_per_device(self) -> int:
+        """ 每个设备的数据列内存上限 (字节) """
+        size = self.raw * 8 * (1 + self.max_fields * len(RAW_STATS))
+        for _, c in self.windows:
+            size += c * 8 * (1 + self.max_fields * len(AGG_STATS))
+        return size
+
+    def record(self, key: str, dd: typing.Any, t: float = None) -> bool:
+        """ 记录一次解析结果, 样本被丢弃时返回 False """
+        values: typing.Dict[str, float] = {}
+        leaves(dd, "", values)
+        if self.matcher.patterns:
+            values = {k: v for k, v in values.items() if self.matcher.match(k)}
+        with self.lock:
+            h = self.devices.get(key)
+            if h is None:
+                h = self.devices[key] = DeviceHistory(self.raw, self.windows, self.max_fields)
+            self.devices.move_to_end(key)
+            while len(self.devices) > self.max_devices:
+                self.devices.popitem(last=False)
+        return h.add(time.time() if t is None else t, values)
+
+    def get(self, key: str) -> typing.Optional[DeviceHistory]:
+        with self.lock:
+            return self.devices.get(key)
+
+    def summary(self) -> dict:
+        with self.lock:
+            devices = list(self.devices.items())
+        return {
+            "raw": self.raw,
+            "windows": [list(w) for w in self.windows],
+            "max_fields": self.max_fields,
+            "max_devices": self.max_devices,
+            "bytes_per_device": self.bytes_per_device(),
+            "devices": [{"device": k, "latest": h.latest} for k, h in devices],
+        }
+
+    def query(self, key: str, patterns: typing.Sequence[str] = (), start: float = -math.inf, end: float = math.inf,
+              window: int = 0) -> typing.Optional[dict]:
+        """ 查询设备历史, 设备不存在时返回 None. 结果: {"window", "time": [...], "fields": {路径: 数值或 min/max/avg}} """
+        h = self.get(key)
+        if h is None:
+            return None
+        matcher = Matcher(patterns)
+        with h.lock:
+            if window <= 0:
+                if h.raw is None:
+                    raise AssertionError("Raw history is disabled")
+                result = h.query_raw(matcher, start, end)
+            else:
+                result = h.query_window(matcher, start, end, window)
+        result["device"] = key
+        return result
@@ -1,19 +1,22 @@
 #!python3
 # -*- coding: utf-8 -*-
 
-from base64 import b64decode, urlsafe_b64decode
+import argparse
+import concurrent.futures
 import http.server
-import json
+import time
 import traceback
-from addrspace import AddressSpace, ModbusAddressSpace
-from devfield import DevCmd, DeviceType
 
-from driver import DriverBase
-import driverset
-from segment import Segment, SegmentSet
-import iface_class
+import profiling
+from service import DriverService, Response, route_label
+
+# 默认监听端口
+DEFAULT_PORT = 10099
 
 class DriverHttpHandler(http.server.BaseHTTPRequestHandler):
+    # 请求处理服务, 由 run_http_server 设置
+    service: DriverService = DriverService()
+
     def do_POST(self):
         self.server_version = ""
         self.sys_version = ""
@@ -21,108 +24,131 @@ class DriverHttpHandler(http.server.BaseHTTPRequestHandler):
         try:
             req_body_len = int(self.headers["Content-Length"])
             req_body = self.rfile.read(req_body_len)
-            request = json.loads(req_body)
-            response = {}
-
-            if self.path == "/v1/parse":
-                response = self.parse_device_data(request)
-            elif self.path == "/v1/exec":
-                response = self.exec_command(request)
-            elif self.path == "/v1/addr":
-                response = self.define_addr_range(request)
-
-            res_body = json.dumps(response, cls=iface_class.JsonEncoderIfJsonEnable)
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json; charset=utf-8')
-            self.send_header('Content-Length', len(res_body))
-            self.end_headers()
-            self.wfile.write(bytes(res_body, "utf-8"))
-            self.log_message("[DRIVER] [POST] [%s] [body: %d]", self.path, len(res_body))
+            res = self.service.handle(
+                self.path, req_body, self.headers.get("Content-Type", ""), self.headers.get("Accept", ""),
+                self.headers.get("If-None-Match", ""), self.headers.get(profiling.PROFILE_HEADER, ""))
+
+            self.write_response(res)
+            self.log_message("[DRIVER] [POST] [%s] [body: %d]", self.path, len(res.body))
         except Exception as e:
             self.log_error("[DRIVER] [POST] [%s] FAIL [%s]: \n%s", self.path, str(e), traceback.format_exc())
             self.send_error(400)
             self.end_headers()
             self.wfile.write(b'')
 
-    def define_addr_range(self, request: dict) -> dict:
-        d = self.get_driver(request)
-        addr_range = d.defineAddrRange()
-        return self.make_response(request, True, "addr_range", addr_range)
-
-    def parse_device_data(self, request: dict) -> dict:
-        d = self.get_driver(request)
-        dd = d.parseDeviceData(self.get_address_space(request))
-        return self.make_response(request, dd is not None, "dd", dd)
-
-    def exec_command(self, request: dict) -> dict:
-        d = self.get_driver(request)
-        r = d.execCommand(self.get_cmd(request))
-        return self.make_response(request, r.succ, "cont", r.cont)
-
-    def get_driver(self, request: dict) -> DriverBase:
-        if "params" not in request:
-            raise AssertionError("Require [params] in request.")
-        params = request["params"]
-        if not ("type" in params and "producer" in params and "model" in params):
-            raise AssertionError("Require [type, producer, model] in [params]")
-        type = DeviceType(int(params["type"]))
-        producer = str(params["producer"])
-        model = str(params["model"])
-        d = driverset.DRIVERS.ref(type, producer, model)
-        if d is None:
-            raise RuntimeError("No driver for [%s(%s):%s:%s]" % (type, type.name, producer, model)) 
-        return d
-
-    def get_address_space(self, request: dict) -> AddressSpace:
-        params = request["params"]
-        space = 1 if "space" not in params else int(params["space"])
-        segset = SegmentSet()
-        if "segment" in params:
-            for seg in params["segment"]:
-                sps = int(seg["space"])
-                segset.add(Segment(
-                    int(seg["addr_begin"]),
-                    int(seg["addr_end"]), 
-                    int(seg["width"]), 
-                    space if sps == 0 else sps, 
-                    urlsafe_b64decode(seg["data"])))
-        
-        return ModbusAddressSpace(segset, space)
-        
-    def get_cmd(self, request: dict) -> DevCmd:
-        cmd = DevCmd()
-        params = request["params"]
-        cmd.cmd = "noop" if "cmd" not in params else str(params["cmd"])
-        for a in params["args"]:
-            cmd.args.append(urlsafe_b64decode(a))
-        return cmd
-
-    def make_response(self, request: dict, succ: bool, key: str, val: any) -> dict:
-        response = {
-            "version": 1,
-            "jsonrpc": "2.0",
-            "id": request["id"],
-        }
-
-        if succ:
-            response["result"] = {
-                key: val
-            }
+    def do_GET(self):
+        self.server_version = ""
+        self.sys_version = ""
+
+        try:
+            self.write_response(self.service.handle_get(self.path))
+        except Exception as e:
+            self.log_error("[DRIVER] [GET] [%s] FAIL [%s]: \n%s", self.path, str(e), traceback.format_exc())
+            self.send_error(500)
+
+    def write_response(self, res: Response):
+        t0 = time.perf_counter()
+        self.send_response(res.status)
+        if res.content_type:
+            self.send_header('Content-type', res.content_type)
+        for name, value in res.headers.items():
+            self.send_header(name, value)
+        if res.chunks is not None:
+            self.write_stream(res)
         else:
-            response["error"] = {
-                "code": 0,
-                "message": "driver service failure",
-                "data": {
-                    key: val
-                }
-            }
-        return response
-
-
-def run_http_server():
-    server = http.server.ThreadingHTTPServer(("", 10099), DriverHttpHandler)
+            self.send_header('Content-Length', len(res.body))
+            self.end_headers()
+            self.wfile.write(res.body)
+            self.wfile.flush()
+        self.service.metrics.observe("qingems_phase_seconds", (route_label(self.path), "write"), time.perf_counter() - t0)
+
+    def write_stream(self, res: Response):
+        """ 流式响应: 以关闭连接结束响应体 (HTTP/1.0), 编码失败时截断响应 """
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        size = 0
+        try:
+            for chunk in res.chunks:
+                self.wfile.write(chunk)
+                size += len(chunk)
+        except Exception as e:
+            self.log_error("[DRIVER] [POST] [%s] STREAM FAIL [%s]: \n%s", self.path, str(e), traceback.format_exc())
+        self.wfile.flush()
+        res.body = b""
+        self.service.metrics.observe("qingems_response_bytes", (route_label(self.path),), size)
+
+
+def make_parse_pool(workers: int):
+    """ workers > 0 时创建多进程解析池 """
+    if workers <= 0:
+        return None
+    import worker_pool
+    return worker_pool.ParsePool(workers)
+
+
+def run_http_server(host: str = "", port: int = DEFAULT_PORT, backlog: int = 5, batch_workers: int = 0, workers: int = 0,
+                    profiler: profiling.Profiler = None, stream: bool = False, history: "history.HistoryStore" = None,
+                    exec_queue: "execqueue.ExecQueue" = None):
+    executor = None if batch_workers <= 0 else concurrent.futures.ThreadPoolExecutor(batch_workers)
+    DriverHttpHandler.service = DriverService(executor, make_parse_pool(workers), profiler, stream, history, exec_queue)
+    server = http.server.ThreadingHTTPServer((host, port), DriverHttpHandler, bind_and_activate=False)
+    server.request_queue_size = backlog
+    try:
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
     server.serve_forever()
 
 
+def main():
+    parser = argparse.ArgumentParser(description="QingEMS device driver server")
+    parser.add_argument("--host", default="", help="bind address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="bind port")
+    parser.add_argument("--backlog", type=int, default=128, help="listen backlog")
+    parser.add_argument("--batch-workers", type=int, default=0, help="threads for batch items, 0 = sequential")
+    parser.add_argument("--workers", type=int, default=0, help="parse worker processes, 0 = parse in-process")
+    parser.add_argument("--aio", action="store_true", help="serve with asyncio (HTTP/1.1 keep-alive)")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="max in-flight requests in asyncio mode")
+    parser.add_argument("--stream", action="store_true", help="stream /v1/parse JSON responses while encoding")
+    parser.add_argument("--reload-interval", type=float, default=0, help="seconds between driver module change checks, 0 = off")
+    parser.add_argument("--profile", action="store_true", help="enable X-Profile header, sampling and /v1/admin/profiles")
+    parser.add_argument("--profile-rate", type=float, default=0.0, help="fraction of requests to profile")
+    parser.add_argument("--profile-threshold", type=float, default=0.1, help="keep sampled profiles slower than this (seconds)")
+    parser.add_argument("--profile-keep", type=int, default=32, help="number of profiles to keep")
+    parser.add_argument("--history", action="store_true", help="keep per-device parse history and serve /v1/history")
+    parser.add_argument("--history-raw", type=int, default=600, help="raw samples kept per device")
+    parser.add_argument("--history-windows", default="60:1440,900:672", help="downsampling windows seconds:count,...")
+    parser.add_argument("--history-fields", action="append", default=[], help="field path pattern to record (fnmatch)")
+    parser.add_argument("--history-max-fields", type=int, default=256, help="max fields per device")
+    parser.add_argument("--history-devices", type=int, default=1000, help="max devices kept")
+    parser.add_argument("--exec-workers", type=int, default=4, help="threads executing queued device commands")
+    parser.add_argument("--exec-timeout", type=float, default=30.0, help="default deadline of device commands (seconds)")
+    args = parser.parse_args()
+    profiler = profiling.Profiler(args.profile, args.profile_rate, args.profile_threshold, args.profile_keep)
+
+    store = None
+    if args.history:
+        import history
+        store = history.HistoryStore(args.history_raw, history.parse_windows(args.history_windows), args.history_max_fields,
+                                     args.history_devices, args.history_fields)
+
+    import execqueue
+    exec_queue = execqueue.ExecQueue(args.exec_workers, args.exec_timeout)
+
+    if args.reload_interval > 0:
+        import driverset
+        driverset.DRIVERS.watch(args.reload_interval)
+
+    if args.aio:
+        import aio_server
+        aio_server.run_aio_server(args.host, args.port, args.backlog, args.max_concurrency, args.batch_workers, args.workers, profiler,
+                                  args.stream, store, exec_queue)
+    else:
+        run_http_server(args.host, args.port, args.backlog, args.batch_workers, args.workers, profiler, args.stream, store, exec_queue)
+
+
 if __name__ == "__main__":
-    run_http_server()
+    main()
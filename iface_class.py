@@ -3,15 +3,37 @@
 import json
 import enum
 import abc
+import typing
 
 class JsonEnabled(abc.ABC):
-    pass
+    __slots__ = ()
+
+# 类 -> __slots__ 字段名 (基类在前)
+_SLOT_NAMES: typing.Dict[type, typing.Tuple[str, ...]] = {}
+
+def slot_names(cls: type) -> typing.Tuple[str, ...]:
+    """ 类及其基类声明的 __slots__ 字段名 """
+    names = _SLOT_NAMES.get(cls)
+    if names is None:
+        names = []
+        for c in reversed(cls.__mro__):
+            slots = c.__dict__.get("__slots__", ())
+            names.extend([slots] if isinstance(slots, str) else slots)
+        names = _SLOT_NAMES[cls] = tuple(n for n in names if n not in ("__dict__", "__weakref__"))
+    return names
+
+def fields(o: JsonEnabled) -> dict:
+    """ 对象的字段字典, 兼容 __slots__ 和 __dict__ """
+    d = getattr(o, "__dict__", None)
+    if d is not None:
+        return d
+    return {k: getattr(o, k) for k in slot_names(o.__class__)}
 
 class JsonEncoderIfJsonEnable(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, JsonEnabled):
-            return o.__dict__
+            return fields(o)
         elif isinstance(o, enum.Enum):
             return o.value
         else:
-            return None
\ No newline at end of file
+            return None
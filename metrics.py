@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+""" 服务运行指标, 以 Prometheus 文本格式导出 (GET /v1/metrics)
+
+    qingems_request_seconds{route}                              请求总耗时
+    qingems_phase_seconds{route, phase}                         请求阶段耗时: decode 请求解码, encode 响应编码, write 发送响应
+    qingems_driver_seconds{route, phase, type, producer, model} 驱动阶段耗时: addrspace 构造地址空间, driver 驱动调用
+    qingems_request_bytes{route} / qingems_response_bytes{route}    请求/响应体大小
+    qingems_errors_total{route, type, producer, model}          失败的请求 (批量请求按项计数), 驱动未注册时驱动标签为 unknown
+
+使用多进程解析池时地址空间在工作进程内构造, driver 阶段包含构造和跨进程传输的耗时.
+"""
+
+import bisect
+import threading
+import typing
+
+# 耗时分桶 (秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 大小分桶 (字节)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 指标名 -> (类型, 说明, 标签名, 分桶)
+DEFINITIONS: typing.Dict[str, typing.Tuple[str, str, typing.Tuple[str, ...], tuple]] = {
+    "qingems_request_seconds": ("histogram", "Request handling time", ("route",), LATENCY_BUCKETS),
+    "qingems_phase_seconds": ("histogram", "Request phase time", ("route", "phase"), LATENCY_BUCKETS),
+    "qingems_driver_seconds": ("histogram", "Driver phase time", ("route", "phase", "type", "producer", "model"), LATENCY_BUCKETS),
+    "qingems_request_bytes": ("histogram", "Request body size", ("route",), SIZE_BUCKETS),
+    "qingems_response_bytes": ("histogram", "Response body size", ("route",), SIZE_BUCKETS),
+    "qingems_errors_total": ("counter", "Failed requests", ("route", "type", "producer", "model"), ()),
+}
+
+class Histogram:
+    """ 固定分桶直方图 """
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: tuple) -> None:
+        self.bounds = bounds
+        # 各桶计数 (非累计), 最后一个为 +Inf
+        self.counts: typing.List[int] = [0] * (len(bounds) + 1)
+        self.sum: float = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self) -> typing.Tuple[typing.List[int], float]:
+        with self.lock:
+            return list(self.counts), self.sum
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self) -> None:
+        self.value: float = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n: float = 1) -> None:
+        with self.lock:
+            self.value += n
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names: typing.Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    items = ['%s="%s"' % (n, escape(str(v))) for n, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return "{%s}" % ",".join(items) if items else ""
+
+def format_value(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Metrics:
+    """ 指标集合, 标签值按 DEFINITIONS 中的标签名顺序传入 """
+
+    def __init__(self) -> None:
+        # (指标名, 标签值) -> Histogram/Counter
+        self.series: typing.Dict[typing.Tuple[str, tuple], typing.Union[Histogram, Counter]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str, labels: tuple) -> typing.Union[Histogram, Counter]:
+        key = (name, labels)
+        s = self.series.get(key)
+        if s is None:
+            with self.lock:
+                s = self.series.get(key)
+                if s is None:
+                    kind, _, names, bounds = DEFINITIONS[name]
+                    if len(labels) != len(names):
+                        raise AssertionError("Metric [%s] requires labels %s" % (name, names))
+                    s = self.series[key] = Histogram(bounds) if kind == "histogram" else Counter()
+        return s
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        self.get(name, labels).observe(value)
+
+    def inc(self, name: str, labels: tuple, n: float = 1) -> None:
+        self.get(name, labels).inc(n)
+
+    def render(self) -> bytes:
+        """ Prometheus 文本格式 """
+        with self.lock:
+            series = sorted(self.series.items(), key=lambda kv: kv[0])
+        lines = []
+        for name, (kind, help, names, bounds) in DEFINITIONS.items():
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for (n, labels), s in series:
+                if n != name:
+                    continue
+                if kind == "counter":
+                    lines.append("%s%s %s" % (name, format_labels(names, labels), format_value(s.value)))
+                    continue
+                counts, total = s.snapshot()
+                acc = 0
+                for bound, count in zip(bounds + ("+Inf",), counts):
+                    acc += count
+                    le = 'le="%s"' % (bound if isinstance(bound, str) else format_value(float(bound)))
+                    lines.append("%s_bucket%s %d" % (name, format_labels(names, labels, le), acc))
+                lines.append("%s_sum%s %s" % (name, format_labels(names, labels), format_value(total)))
+                lines.append("%s_count%s %d" % (name, format_labels(names, labels), acc))
+        return ("\n".join(lines) + "\n").encode("utf-8")
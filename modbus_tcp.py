@@ -0,0 +1,412 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+""" Modbus TCP 采集引擎
+
+按驱动的采集计划 (defineAddrRange 经 plan_addr_range 合并/拆分) 直接读取设备, 构造地址空间后调用 parseDeviceData:
+    - 地址空间号为 Modbus 单元号, 0 表示设备的默认单元号
+    - ts_presleep > 0 的区间等待之前的读取完成并休眠后再读取, 其余区间流水线并发读取
+    - 每个网关 (host, port) 维护连接池, 每个连接同时进行的事务数有上限, 每个事务有超时
+
+同一地址空间内的位地址段和寄存器段共用 SegmentSet, 地址重叠时先采集的段优先 (与 EMS 上送的数据段一致).
+
+命令行:
+    python modbus_tcp.py simulate --port 5020                   本地模拟 Modbus 服务端
+    python modbus_tcp.py poll --port 5020 --type 0 --producer skiffenergy --model emu
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import struct
+import typing
+
+from addr import AddrRange, AddrType
+from devdata import DD
+from devfield import DeviceType
+import driverset
+import serializer
+import service
+
+# MBAP 头: 事务号, 协议号, 长度, 单元号
+MBAP = struct.Struct(">HHHB")
+# 读请求 PDU: 功能码, 起始地址, 数量
+READ_REQUEST = struct.Struct(">BHH")
+
+# 地址类型 -> 读功能码
+READ_FUNCTIONS: typing.Dict[AddrType, int] = {
+    AddrType.MODBUS_BITS: 0x01,
+    AddrType.MODBUS_INPUT_BITS: 0x02,
+    AddrType.MODBUS_REGS: 0x03,
+    AddrType.MODBUS_INPUT_REGS: 0x04,
+}
+
+class ModbusError(RuntimeError):
+    """ 设备返回的 Modbus 异常响应 """
+
+    def __init__(self, function: int, code: int) -> None:
+        super().__init__("Modbus exception: function 0x%02x, code %d" % (function, code))
+        self.function = function
+        self.code = code
+
+class Connection:
+    """ 单个 TCP 连接, 按事务号匹配响应, 支持流水线请求 """
+
+    def __init__(self, host: str, port: int, max_inflight: int, timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        # 事务号 -> 等待响应的 future
+        self.pending: typing.Dict[int, asyncio.Future] = {}
+        self.tids = itertools.cycle(range(1, 0x10000))
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.receiver: asyncio.Task = None
+        self.closed = False
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        self.receiver = asyncio.get_running_loop().create_task(self.receive())
+
+    def inflight(self) -> int:
+        return len(self.pending)
+
+    async def receive(self) -> None:
+        try:
+            while True:
+                head = await self.reader.readexactly(MBAP.size)
+                tid, _, length, _ = MBAP.unpack(head)
+                if length < 2:
+                    raise ConnectionError("bad MBAP length: %d" % length)
+                pdu = await self.reader.readexactly(length - 1)
+                future = self.pending.pop(tid, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            self.fail(ConnectionError("connection lost: %s" % e))
+        except asyncio.CancelledError:
+            self.fail(ConnectionError("connection closed"))
+
+    def fail(self, error: Exception) -> None:
+        """ 关闭连接, 所有等待中的事务以 error 结束 """
+        self.closed = True
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+        if self.writer is not None:
+            self.writer.close()
+
+    async def request(self, unit: int, pdu: bytes) -> bytes:
+        """ 发送请求 PDU, 返回响应 PDU. 超时的事务被放弃, 迟到的响应按事务号丢弃 """
+        async with self.slots:
+            if self.closed:
+                raise ConnectionError("connection closed")
+            tid = next(self.tids)
+            future = asyncio.get_running_loop().create_future()
+            self.pending[tid] = future
+            self.writer.write(MBAP.pack(tid, 0, len(pdu) + 1, unit) + pdu)
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            finally:
+                self.pending.pop(tid, None)
+
+    def close(self) -> None:
+        if self.receiver is not None:
+            self.receiver.cancel()
+        self.fail(ConnectionError("connection closed"))
+
+class GatewayPool:
+    """ 单个网关的连接池: 最多 size 个连接, 请求分配到进行中事务最少的连接, 断开的连接按需重建 """
+
+    def __init__(self, host: str, port: int, size: int = 2, max_inflight: int = 4, timeout: float = 3.0) -> None:
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.connections: typing.List[Connection] = []
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> Connection:
+        async with self.lock:
+            self.connections = [c for c in self.connections if not c.closed]
+            idle = min(self.connections, key=Connection.inflight, default=None)
+            if idle is not None and (idle.inflight() < self.max_inflight or len(self.connections) >= self.size):
+                return idle
+            conn = Connection(self.host, self.port, self.max_inflight, self.timeout)
+            await conn.connect()
+            self.connections.append(conn)
+            return conn
+
+    async def request(self, unit: int, pdu: bytes) -> bytes:
+        conn = await self.acquire()
+        return await conn.request(unit, pdu)
+
+    def close(self) -> None:
+        for c in self.connections:
+            c.close()
+        self.connections = []
+
+class Device:
+    """ 采集目标设备 """
+
+    def __init__(self, host: str, port: int, unit: int, type: DeviceType, producer: str, model: str,
+                 device_id: str = "", order: str = "ABCD") -> None:
+        self.host = host
+        self.port = port
+        # 默认单元号 (地址空间号为 0 的区间)
+        self.unit = unit
+        self.type = type
+        self.producer = producer
+        self.model = model
+        # 设备ID, 传给驱动用于区分设备
+        self.device_id = device_id
+        # 默认字节序名称
+        self.order = order
+
+async def read_range(pool: GatewayPool, unit: int, r: AddrRange) -> tuple:
+    """ 读取一个区间, 返回数据段参数 (addr_begin, addr_end, width, space, data) """
+    function = READ_FUNCTIONS[r.addr_type]
+    count = r.addr_end - r.addr_begin
+    pdu = await pool.request(unit, READ_REQUEST.pack(function, r.addr_begin, count))
+    if pdu[0] == function | 0x80:
+        raise ModbusError(function, pdu[1] if len(pdu) > 1 else 0)
+    if pdu[0] != function or len(pdu) < 2 or len(pdu) - 2 != pdu[1]:
+        raise ConnectionError("bad response for function 0x%02x" % function)
+    width = 1 if function <= 0x02 else 16
+    size = (count * width + 7) // 8
+    if pdu[1] < size:
+        raise ConnectionError("short response: %d < %d bytes" % (pdu[1], size))
+    return (r.addr_begin, r.addr_end, width, unit, pdu[2:2 + size])
+
+class AcquisitionEngine:
+    """ 采集引擎: 按网关复用连接池, 并发采集多个设备 """
+
+    def __init__(self, connections: int = 2, max_inflight: int = 4, timeout: float = 3.0,
+                 executor: concurrent.futures.Executor = None) -> None:
+        # 每个网关的最大连接数
+        self.connections = connections
+        # 每个连接同时进行的最大事务数
+        self.max_inflight = max_inflight
+        # 单个事务的超时秒数
+        self.timeout = timeout
+        # 解析执行器, None 表示在事件循环线程内解析
+        self.executor = executor
+        self.pools: typing.Dict[typing.Tuple[str, int], GatewayPool] = {}
+
+    def pool(self, host: str, port: int) -> GatewayPool:
+        pool = self.pools.get((host, port))
+        if pool is None:
+            pool = self.pools[(host, port)] = GatewayPool(host, port, self.connections, self.max_inflight, self.timeout)
+        return pool
+
+    async def read(self, device: Device) -> typing.List[tuple]:
+        """ 按采集计划读取设备, 返回数据段参数列表 (按计划顺序) """
+        plan: typing.List[AddrRange] = driverset.DRIVERS.ref_addr_plan(
+            device.type, device.producer, device.model).result["addr_plan"]
+        pool = self.pool(device.host, device.port)
+        tasks: typing.List[asyncio.Task] = []
+        try:
+            for r in plan:
+                if r.ts_presleep > 0:
+                    await asyncio.gather(*tasks)
+                    await asyncio.sleep(r.ts_presleep / 1000.0)
+                unit = r.space if r.space != 0 else device.unit
+                tasks.append(asyncio.ensure_future(read_range(pool, unit, r)))
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+
+    async def poll(self, device: Device) -> DD:
+        """ 采集并解析一个设备 """
+        d = driverset.DRIVERS.ref(device.type, device.producer, device.model)
+        if d is None:
+            raise RuntimeError("No driver for [%s(%s):%s:%s]" % (device.type, device.type.name, device.producer, device.model))
+        segments = await self.read(device)
+
+        def parse() -> DD:
+            return d.parseDeviceData(service.make_address_space(device.unit, device.order, segments, device.device_id))
+        if self.executor is None:
+            return parse()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, parse)
+
+    async def poll_many(self, devices: typing.List[Device], concurrency: int = 256) -> typing.List[typing.Union[DD, Exception]]:
+        """ 并发采集多个设备, 失败的设备返回异常对象 """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(device: Device):
+            async with semaphore:
+                return await self.poll(device)
+        return await asyncio.gather(*(one(d) for d in devices), return_exceptions=True)
+
+    def close(self) -> None:
+        for pool in self.pools.values():
+            pool.close()
+        self.pools.clear()
+
+class SimulatedUnit:
+    """ 模拟设备的存储区 """
+
+    def __init__(self) -> None:
+        self.coils = bytearray(0x10000 // 8)
+        self.inputs = bytearray(0x10000 // 8)
+        self.holding = bytearray(0x10000 * 2)
+        self.input_regs = bytearray(0x10000 * 2)
+
+    def area(self, addr_type: AddrType) -> bytearray:
+        return {
+            AddrType.MODBUS_BITS: self.coils,
+            AddrType.MODBUS_INPUT_BITS: self.inputs,
+            AddrType.MODBUS_REGS: self.holding,
+            AddrType.MODBUS_INPUT_REGS: self.input_regs,
+        }[addr_type]
+
+    def set_registers(self, addr_type: AddrType, addr: int, data: bytes) -> None:
+        self.area(addr_type)[addr * 2:addr * 2 + len(data)] = data
+
+    def set_bit(self, addr_type: AddrType, addr: int, value: bool) -> None:
+        area = self.area(addr_type)
+        if value:
+            area[addr >> 3] |= 1 << (addr & 0x07)
+        else:
+            area[addr >> 3] &= ~(1 << (addr & 0x07)) & 0xFF
+
+    def read_bits(self, area: bytearray, addr: int, count: int) -> bytes:
+        out = bytearray((count + 7) // 8)
+        for i in range(count):
+            a = addr + i
+            if area[a >> 3] >> (a & 0x07) & 0x01:
+                out[i >> 3] |= 1 << (i & 0x07)
+        return bytes(out)
+
+class ModbusSimulator:
+    """ 本地模拟 Modbus TCP 服务端, 用于测试. 支持功能码 1/2/3/4/6/16, 未创建的单元号不响应 (模拟超时) """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0) -> None:
+        self.host = host
+        self.port = port
+        # 每个请求的响应延迟秒数
+        self.latency = latency
+        self.units: typing.Dict[int, SimulatedUnit] = {}
+        self.server: asyncio.AbstractServer = None
+        # 已建立的连接, close 时一并关闭
+        self.writers: typing.Set[asyncio.StreamWriter] = set()
+        # 已处理的请求数
+        self.requests = 0
+
+    def unit(self, unit: int) -> SimulatedUnit:
+        u = self.units.get(unit)
+        if u is None:
+            u = self.units[unit] = SimulatedUnit()
+        return u
+
+    async def start(self) -> asyncio.AbstractServer:
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    def close(self) -> None:
+        """ 停止监听并关闭已建立的连接 """
+        if self.server is not None:
+            self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+
+    async def wait_closed(self) -> None:
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.writers.add(writer)
+        try:
+            while True:
+                tid, pid, length, unit = MBAP.unpack(await reader.readexactly(MBAP.size))
+                if length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                if self.latency > 0:
+                    await asyncio.sleep(self.latency)
+                if unit not in self.units:
+                    continue
+                res = self.process(self.units[unit], pdu)
+                writer.write(MBAP.pack(tid, pid, len(res) + 1, unit) + res)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def process(self, u: SimulatedUnit, pdu: bytes) -> bytes:
+        function = pdu[0]
+        if function in (0x01, 0x02, 0x03, 0x04):
+            _, addr, count = READ_REQUEST.unpack_from(pdu)
+            bits = function <= 0x02
+            if count == 0 or count > (2000 if bits else 125) or addr + count > 0x10000:
+                return bytes([function | 0x80, 0x03 if count == 0 or count > (2000 if bits else 125) else 0x02])
+            if bits:
+                area = u.coils if function == 0x01 else u.inputs
+                data = u.read_bits(area, addr, count)
+            else:
+                area = u.holding if function == 0x03 else u.input_regs
+                data = bytes(area[addr * 2:(addr + count) * 2])
+            return bytes([function, len(data)]) + data
+        if function == 0x06:
+            addr = struct.unpack_from(">H", pdu, 1)[0]
+            u.holding[addr * 2:addr * 2 + 2] = pdu[3:5]
+            return pdu[:5]
+        if function == 0x10:
+            addr, count, size = struct.unpack_from(">HHB", pdu, 1)
+            u.holding[addr * 2:addr * 2 + size] = pdu[6:6 + size]
+            return pdu[:5]
+        return bytes([function | 0x80, 0x01])
+
+def main():
+    parser = argparse.ArgumentParser(description="QingEMS Modbus TCP acquisition")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("simulate", help="run a local simulated Modbus TCP server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5020)
+    p.add_argument("--unit", type=int, action="append", help="unit ids to answer, default 1")
+    p = sub.add_parser("poll", help="poll one device and print the parsed DD as JSON")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=502)
+    p.add_argument("--unit", type=int, default=1)
+    p.add_argument("--type", type=int, required=True)
+    p.add_argument("--producer", required=True)
+    p.add_argument("--model", required=True)
+    p.add_argument("--device-id", default="")
+    p.add_argument("--order", default="ABCD")
+    p.add_argument("--timeout", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if args.command == "simulate":
+        async def simulate():
+            sim = ModbusSimulator(args.host, args.port)
+            for unit in args.unit or [1]:
+                sim.unit(unit)
+            server = await sim.start()
+            async with server:
+                await server.serve_forever()
+        asyncio.run(simulate())
+    else:
+        async def poll():
+            engine = AcquisitionEngine(timeout=args.timeout)
+            try:
+                device = Device(args.host, args.port, args.unit, DeviceType(args.type), args.producer, args.model,
+                                args.device_id, args.order)
+                return await engine.poll(device)
+            finally:
+                engine.close()
+        print(json.dumps(json.loads(serializer.dumps(asyncio.run(poll()))), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
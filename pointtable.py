@@ -0,0 +1,285 @@
+# -*- encoding: utf-8 -*-
+
+import csv
+import json
+import operator
+import struct
+import typing
+
+import devdata
+from addr import MODBUS_MAX_BITS, MODBUS_MAX_REGS, AddrRange, AddrType
+from addrspace import AddressSpace, ModbusAddressSpace
+from alarm import AlarmTable
+from devdata import DD
+from devfield import DevCmd, DevRet
+from driver import DriverBase
+from segment import DECODERS, DTYPE_FORMAT, ByteOrder, Segment
+
+# 位地址类型 (线圈/遥信), 其余为寄存器
+BIT_ADDR_TYPES = (AddrType.MODBUS_INPUT_BITS, AddrType.MODBUS_BITS)
+
+class Point:
+    """ 测点: 一个地址到 DD 属性路径的映射 """
+
+    def __init__(self, path: str, addr: int, dtype: str = "u16", order: ByteOrder = None,
+                 scale: float = 1.0, offset: float = 0.0, bit: int = None,
+                 addr_type: AddrType = AddrType.MODBUS_REGS, space: int = 0) -> None:
+        # DD 属性路径, 例如 ac_runtime.voltage.phase_a, 末级可为字典键 (number.xxx)
+        self.path: str = path
+        # 起始地址
+        self.addr: int = addr
+        # 数据类型 u16/i16/u32/i32/u64/i64/f32/f64, 位地址类型忽略
+        self.dtype: str = dtype
+        # 字节序, None 表示使用点表默认字节序
+        self.order: ByteOrder = order
+        # 线性变换 value * scale + offset
+        self.scale: float = scale
+        self.offset: float = offset
+        # 寄存器内位序号, None 表示读取整个数值
+        self.bit: int = bit
+        # 地址类型
+        self.addr_type: AddrType = addr_type
+        # 地址空间号, 0 表示默认空间
+        self.space: int = space
+
+        if addr_type not in BIT_ADDR_TYPES and dtype not in DTYPE_FORMAT:
+            raise RuntimeError("Point Type Error: %s [%s]" % (dtype, path))
+
+    def regs(self) -> int:
+        """ 占用的地址个数 """
+        if self.addr_type in BIT_ADDR_TYPES:
+            return 1
+        return struct.calcsize(DTYPE_FORMAT[self.dtype]) // 2
+
+    @staticmethod
+    def from_row(row: dict) -> "Point":
+        """ 由 JSON/CSV 行构造测点, 空值使用默认值 """
+        def get(key: str, conv, default):
+            val = row.get(key)
+            return default if val is None or val == "" else conv(val)
+
+        def addr_type(val) -> AddrType:
+            return AddrType[val] if isinstance(val, str) and not val.isdigit() else AddrType(int(val))
+
+        return Point(
+            str(row["path"]),
+            int(row["addr"]),
+            get("type", str, "u16"),
+            get("order", lambda v: ByteOrder[v], None),
+            get("scale", float, 1.0),
+            get("offset", float, 0.0),
+            get("bit", int, None),
+            get("addr_type", addr_type, AddrType.MODBUS_REGS),
+            get("space", int, 0))
+
+def make_setter(path: str) -> typing.Callable[[DD, typing.Any], None]:
+    """ 将属性路径编译为赋值函数 """
+    parent, _, name = path.rpartition(".")
+    get_parent = operator.attrgetter(parent) if parent else (lambda dd: dd)
+
+    def setter(dd: DD, value) -> None:
+        obj = get_parent(dd)
+        if isinstance(obj, dict):
+            obj[name] = value
+        else:
+            setattr(obj, name, value)
+    return setter
+
+def make_convert(point: Point) -> typing.Callable:
+    """ 生成原始值 -> 测点值的转换函数 """
+    scale, offset, bit = point.scale, point.offset, point.bit
+    if bit is not None:
+        return lambda v: (v >> bit) & 0x01
+    if scale == 1.0 and offset == 0.0:
+        return None
+    return lambda v: v * scale + offset
+
+class RangePlan:
+    """ 单个地址区间的解析计划
+
+    寄存器区间内, ABCD/DCBA 字节序的测点被合并为若干个 struct.Struct,
+    每个 Struct 一次解出该区间内互不重叠的全部数值. 其余测点 (CDAB/BADC 多字数值) 逐点解码.
+    """
+
+    def __init__(self, addr_range: AddrRange, points: typing.List[Point], order: ByteOrder) -> None:
+        self.addr_range = addr_range
+        self.points = points
+        self.bits = addr_range.addr_type in BIT_ADDR_TYPES
+        self.order = order
+        # [(struct, [(结果下标, 转换函数, 赋值函数)])]
+        self.blocks: typing.List[typing.Tuple[struct.Struct, list]] = []
+        # [(字节偏移, 字节数, 解码函数, 转换函数, 赋值函数)]
+        self.singles: typing.List[tuple] = []
+        # 逐点读取时使用 [(测点, 转换函数, 赋值函数)]
+        self.consumers = [(p, make_convert(p), make_setter(p.path)) for p in points]
+        if not self.bits:
+            self.compile(order)
+
+    def compile(self, order: ByteOrder) -> None:
+        # 字节序前缀 -> {(字节偏移, 格式符): [(转换函数, 赋值函数)]}
+        slots: typing.Dict[str, typing.Dict[typing.Tuple[int, str], list]] = {">": {}, "<": {}}
+        for p in self.points:
+            o = p.order or order
+            offset = (p.addr - self.addr_range.addr_begin) * 2
+            consumer = (make_convert(p), make_setter(p.path))
+            fmt = "H" if p.bit is not None else DTYPE_FORMAT[p.dtype]
+            if p.bit is not None or struct.calcsize(fmt) == 2:
+                # 单寄存器数值: CDAB 等同 ABCD, BADC 等同 DCBA
+                prefix = ">" if o in (ByteOrder.ABCD, ByteOrder.CDAB) else "<"
+            elif o in (ByteOrder.ABCD, ByteOrder.DCBA):
+                prefix = ">" if o == ByteOrder.ABCD else "<"
+            else:
+                self.singles.append((offset,) + DECODERS[(p.dtype, o)] + consumer)
+                continue
+            slots[prefix].setdefault((offset, fmt), []).append(consumer)
+
+        for prefix, group in slots.items():
+            # 分层: 每层内的数值互不重叠, 各生成一个 Struct
+            layers: typing.List[list] = []
+            for offset, fmt in sorted(group):
+                for layer in layers:
+                    if layer[-1][0] + struct.calcsize(layer[-1][1]) <= offset:
+                        layer.append((offset, fmt))
+                        break
+                else:
+                    layers.append([(offset, fmt)])
+            for layer in layers:
+                spec, pos, consumers = prefix, 0, []
+                for i, (offset, fmt) in enumerate(layer):
+                    spec += ("%dx" % (offset - pos) if offset > pos else "") + fmt
+                    pos = offset + struct.calcsize(fmt)
+                    consumers.extend((i, conv, setter) for conv, setter in group[(offset, fmt)])
+                self.blocks.append((struct.Struct(spec), consumers))
+
+    def segment(self, addr_space: AddressSpace) -> Segment:
+        """ 完整包含本区间的数据段, 不存在时返回 None """
+        if not isinstance(addr_space, ModbusAddressSpace):
+            return None
+        r = self.addr_range
+        seg = addr_space.ref(r.addr_begin, r.space)
+        if seg.width != 16 or not seg.contains(r.addr_begin, r.addr_end - r.addr_begin):
+            return None
+        return seg
+
+    def parse(self, addr_space: AddressSpace, dd: DD) -> None:
+        seg = None if self.bits else self.segment(addr_space)
+        if seg is None:
+            self.parse_points(addr_space, dd)
+            return
+        base = (self.addr_range.addr_begin - seg.addr_begin) * 2
+        data = seg.data
+        for st, consumers in self.blocks:
+            if base + st.size > seg.size:
+                # 数据不足, 退回逐点读取 (越界测点为0)
+                self.parse_points(addr_space, dd)
+                return
+        for st, consumers in self.blocks:
+            values = st.unpack_from(data, base)
+            for i, conv, setter in consumers:
+                setter(dd, values[i] if conv is None else conv(values[i]))
+        for offset, size, decode, conv, setter in self.singles:
+            v = decode(data, base + offset) if base + offset + size <= seg.size else 0
+            setter(dd, v if conv is None else conv(v))
+
+    def parse_points(self, addr_space: AddressSpace, dd: DD) -> None:
+        """ 逐点读取, 用于位地址区间或数据段不完整的情况 """
+        for p, conv, setter in self.consumers:
+            if self.bits:
+                v = addr_space.bit(p.addr, p.space)
+            elif p.bit is not None:
+                v = addr_space.u16(p.addr, p.space, p.order or self.order)
+            else:
+                v = getattr(addr_space, p.dtype)(p.addr, p.space, p.order or self.order)
+            setter(dd, v if conv is None else conv(v))
+
+class PointTable:
+    """ 点表: 声明式定义设备的采集地址和解析规则 """
+
+    def __init__(self, dd_class: typing.Type[DD], points: typing.List[Point], order: ByteOrder = ByteOrder.ABCD) -> None:
+        # 解析结果类型
+        self.dd_class = dd_class
+        # 测点列表
+        self.points: typing.List[Point] = list(points)
+        # 默认字节序
+        self.order: ByteOrder = order
+        # 采集地址区间和解析计划, 首次使用时编译
+        self.plans: typing.List[RangePlan] = None
+
+    @staticmethod
+    def from_rows(dd_class: typing.Type[DD], rows: typing.Iterable[dict], order: ByteOrder = ByteOrder.ABCD) -> "PointTable":
+        return PointTable(dd_class, [Point.from_row(row) for row in rows], order)
+
+    @staticmethod
+    def from_json(path: str) -> "PointTable":
+        """ 加载 JSON 点表: {"dd": "DDOfInverter", "order": "ABCD", "points": [{...}, ...]} """
+        with open(path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        return PointTable.from_rows(
+            getattr(devdata, conf.get("dd", "DDOfUserDefined")),
+            conf["points"],
+            ByteOrder[conf.get("order", "ABCD")])
+
+    @staticmethod
+    def from_csv(dd_class: typing.Type[DD], path: str, order: ByteOrder = ByteOrder.ABCD) -> "PointTable":
+        """ 加载 CSV 点表, 表头: path,addr,type,order,scale,offset,bit,addr_type,space """
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return PointTable.from_rows(dd_class, list(csv.DictReader(f)), order)
+
+    def compile(self) -> typing.List[RangePlan]:
+        """ 合并相邻/重叠的测点地址为采集区间, 并为每个区间生成解析计划
+
+        单个区间不超过 modbus 单次请求上限 (MODBUS_MAX_REGS/MODBUS_MAX_BITS), 在测点边界处拆分,
+        使每个区间恰好对应一次读取, 解析时由一个数据段完整包含.
+        """
+        if self.plans is not None:
+            return self.plans
+        groups: typing.Dict[tuple, typing.List[Point]] = {}
+        for p in self.points:
+            groups.setdefault((p.addr_type.value, p.space), []).append(p)
+
+        plans = []
+        for (addr_type, space), points in sorted(groups.items()):
+            limit = MODBUS_MAX_BITS if AddrType(addr_type) in BIT_ADDR_TYPES else MODBUS_MAX_REGS
+            points.sort(key=lambda p: p.addr)
+            begin, end, members = points[0].addr, points[0].addr + points[0].regs(), []
+            for p in points:
+                if p.addr > end or p.addr + p.regs() - begin > limit:
+                    plans.append(RangePlan(AddrRange(AddrType(addr_type), begin, end, space), members, self.order))
+                    begin, end, members = p.addr, p.addr, []
+                end = max(end, p.addr + p.regs())
+                members.append(p)
+            plans.append(RangePlan(AddrRange(AddrType(addr_type), begin, end, space), members, self.order))
+        self.plans = plans
+        return plans
+
+    def addr_ranges(self) -> typing.List[AddrRange]:
+        return [plan.addr_range for plan in self.compile()]
+
+    def parse(self, addr_space: AddressSpace, dd: DD = None) -> DD:
+        """ 按点表解析设备数据, 可传入已有 DD 实例复用 """
+        dd = self.dd_class() if dd is None else dd
+        for plan in self.compile():
+            plan.parse(addr_space, dd)
+        return dd
+
+class PointTableDriver(DriverBase):
+    """ 点表驱动: 由 POINT_TABLE (及 ALARM_TABLE) 同时导出采集区间和解析逻辑 """
+
+    # 点表
+    POINT_TABLE: PointTable = None
+    # 告警表, None 表示无告警
+    ALARM_TABLE: AlarmTable = None
+
+    def defineAddrRange(self) -> typing.List[AddrRange]:
+        if self.ALARM_TABLE is None:
+            return self.POINT_TABLE.addr_ranges()
+        return self.POINT_TABLE.addr_ranges() + self.ALARM_TABLE.addr_ranges()
+
+    def parseDeviceData(self, addr_space: AddressSpace) -> DD:
+        dd = self.POINT_TABLE.parse(addr_space)
+        if self.ALARM_TABLE is not None:
+            self.ALARM_TABLE.evaluate(addr_space, dd)
+        return dd
+
+    def execCommand(self, cmd: DevCmd) -> DevRet:
+        return DevRet(False, b"")
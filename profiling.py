@@ -0,0 +1,156 @@
+#!python3
+# -*- coding: utf-8 -*-
+
+""" 请求性能剖析和慢请求记录
+
+启用后, 请求头 X-Profile: 1 或按 sample_rate 抽样的请求在 cProfile 下运行.
+耗时超过 threshold 秒的抽样请求 (请求头触发的请求总是记录) 保存在有界内存中, 包括原始请求体, 可通过管理接口获取:
+
+    GET /v1/admin/profiles                          记录列表
+    GET /v1/admin/profiles?id=N                     剖析结果文本和请求 (JSON, 请求体为 base64)
+    GET /v1/admin/profiles?id=N&format=pstats       剖析结果 (pstats 格式, 可用 snakeviz 等工具查看)
+    GET /v1/admin/profiles?id=N&format=request      原始请求体
+
+离线重放 (使用本地驱动重新执行并剖析):
+    python profiling.py replay profile.json [-d module:DriverClass]
+"""
+
+import argparse
+import base64
+import collections
+import cProfile
+import io
+import itertools
+import json
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+import typing
+
+# 触发剖析的请求头
+PROFILE_HEADER = "X-Profile"
+# 剖析结果文本的函数行数
+STATS_LIMIT = 40
+
+class ProfileRecord:
+    """ 一次剖析的请求 """
+
+    def __init__(self, id: int, path: str, content_type: str, body: bytes, seconds: float, error: str,
+                 profile: cProfile.Profile) -> None:
+        self.id = id
+        self.time = time.time()
+        self.path = path
+        self.content_type = content_type
+        # 原始请求体, 用于重放
+        self.body = body
+        self.seconds = seconds
+        # 请求失败时的异常信息
+        self.error = error
+        stats = pstats.Stats(profile)
+        # pstats 格式的剖析数据
+        self.pstats: bytes = marshal.dumps(stats.stats)
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats("cumulative").print_stats(STATS_LIMIT)
+        self.text: str = stream.getvalue()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "time": self.time,
+            "path": self.path,
+            "seconds": self.seconds,
+            "size": len(self.body),
+            "error": self.error,
+        }
+
+    def detail(self) -> dict:
+        d = self.summary()
+        d["content_type"] = self.content_type
+        d["body"] = base64.urlsafe_b64encode(self.body).decode("ascii")
+        d["stats"] = self.text
+        return d
+
+class Profiler:
+    """ 请求剖析器. 同一时刻只剖析一个请求, 其他请求在剖析进行中时正常执行 """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, threshold: float = 0.1, capacity: int = 32) -> None:
+        # 是否启用 (包括请求头触发和管理接口)
+        self.enabled = enabled
+        # 抽样比例 0~1
+        self.sample_rate = sample_rate
+        # 抽样请求的记录阈值 (秒)
+        self.threshold = threshold
+        self.records: typing.Deque[ProfileRecord] = collections.deque(maxlen=capacity)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def want(self, header: str) -> bool:
+        """ 请求是否需要剖析 """
+        return self.enabled and (bool(header) and header != "0" or
+                                 self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def run(self, func: typing.Callable, path: str, body: bytes, content_type: str, forced: bool, *args) -> typing.Any:
+        """ 在剖析器下调用 func(path, body, content_type, *args), 返回 (结果, 记录ID), 未记录时记录ID为 None """
+        if not self.lock.acquire(blocking=False):
+            return func(path, body, content_type, *args), None
+        try:
+            profile = cProfile.Profile()
+            error = None
+            t0 = time.perf_counter()
+            try:
+                return_value = profile.runcall(func, path, body, content_type, *args)
+            except Exception as e:
+                error = "%s: %s" % (e.__class__.__name__, e)
+                raise
+            finally:
+                seconds = time.perf_counter() - t0
+                record_id = None
+                if forced or seconds >= self.threshold or error is not None:
+                    record_id = next(self.ids)
+                    self.records.append(ProfileRecord(record_id, path, content_type, body, seconds, error, profile))
+            return return_value, record_id
+        finally:
+            self.lock.release()
+
+    def find(self, id: int) -> typing.Optional[ProfileRecord]:
+        for r in list(self.records):
+            if r.id == id:
+                return r
+        return None
+
+def replay(path: str, drivers: typing.List[str] = ()) -> None:
+    """ 使用本地驱动重放记录的请求, 输出剖析结果. drivers 为额外注册的驱动类 "模块:类" """
+    import importlib
+    import driverset
+    import service
+    for spec in drivers:
+        module, _, cls = spec.partition(":")
+        driverset.LoadLocalDriverFor(getattr(importlib.import_module(module), cls))
+    with open(path, "r", encoding="utf-8") as f:
+        record = json.load(f)
+    body = base64.urlsafe_b64decode(record["body"])
+    svc = service.DriverService()
+    profile = cProfile.Profile()
+    t0 = time.perf_counter()
+    res = profile.runcall(svc.handle, record["path"], body, record.get("content_type", ""))
+    print("status: %d, seconds: %.6f (recorded %.6f), body: %d" % (
+        res.status, time.perf_counter() - t0, record["seconds"], len(res.body)))
+    pstats.Stats(profile, stream=sys.stdout).sort_stats("cumulative").print_stats(STATS_LIMIT)
+
+def main():
+    parser = argparse.ArgumentParser(description="QingEMS driver request profiling")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("replay", help="replay a recorded request against local drivers")
+    p.add_argument("record", help="JSON from GET /v1/admin/profiles?id=N")
+    p.add_argument("-d", "--driver", action="append", default=[], help="register driver class module:Class")
+    args = parser.parse_args()
+    if args.command == "replay":
+        replay(args.record, args.driver)
+
+
+if __name__ == "__main__":
+    main()
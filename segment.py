@@ -1,93 +1,277 @@
 # -*- encoding: utf-8 -*-
 
+import array
+import bisect
+import enum
+import functools
 import struct
 import typing
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ByteOrder(enum.Enum):
+    """ 多寄存器数值的字节序, 字母按数值从高到低字节排列 """
+    ABCD = 0        # 大端 (modbus 标准)
+    CDAB = 1        # 字交换
+    BADC = 2        # 字节交换
+    DCBA = 3        # 小端
+
+# 数据类型 -> struct 格式符
+DTYPE_FORMAT: typing.Dict[str, str] = {
+    "u16": "H",
+    "i16": "h",
+    "u32": "I",
+    "i32": "i",
+    "u64": "Q",
+    "i64": "q",
+    "f32": "f",
+    "f64": "d",
+}
+
+# 数据类型 -> array.array 类型码
+ARRAY_TYPECODE: typing.Dict[str, str] = {
+    "u16": "H",
+    "i16": "h",
+    "u32": "I" if array.array("I").itemsize >= 4 else "L",
+    "i32": "i" if array.array("i").itemsize >= 4 else "l",
+    "u64": "Q",
+    "i64": "q",
+    "f32": "f",
+    "f64": "d",
+}
+
+Decoder = typing.Callable[[memoryview, int], typing.Union[int, float]]
+
+def make_decoder(fmt: str, order: ByteOrder) -> Decoder:
+    """ 生成 (buffer, offset) -> 数值 的解码函数 """
+    if order == ByteOrder.ABCD:
+        unpack_from = struct.Struct(">" + fmt).unpack_from
+        return lambda buf, offset: unpack_from(buf, offset)[0]
+    if order == ByteOrder.DCBA:
+        unpack_from = struct.Struct("<" + fmt).unpack_from
+        return lambda buf, offset: unpack_from(buf, offset)[0]
+
+    # CDAB/BADC: 先按字读取, 重排为大端字节序后再解码
+    value = struct.Struct(">" + fmt)
+    words = value.size // 2
+    word_unpack_from = struct.Struct((">" if order == ByteOrder.CDAB else "<") + "H" * words).unpack_from
+    word_pack = struct.Struct(">" + "H" * words).pack
+    value_unpack = value.unpack
+    if order == ByteOrder.CDAB:
+        return lambda buf, offset: value_unpack(word_pack(*word_unpack_from(buf, offset)[::-1]))[0]
+    return lambda buf, offset: value_unpack(word_pack(*word_unpack_from(buf, offset)))[0]
+
+# (数据类型, 字节序) -> (字节数, 解码函数)
+DECODERS: typing.Dict[typing.Tuple[str, ByteOrder], typing.Tuple[int, Decoder]] = {
+    (dtype, order): (struct.calcsize(fmt), make_decoder(fmt, order))
+    for dtype, fmt in DTYPE_FORMAT.items() for order in ByteOrder
+}
+
+def zeros(dtype: str, count: int):
+    """ 长度为 count 的全0数组 """
+    if numpy is not None:
+        return numpy.zeros(count, dtype=numpy_dtype(dtype, ByteOrder.ABCD).newbyteorder("="))
+    return array.array(ARRAY_TYPECODE[dtype], bytes(count * array.array(ARRAY_TYPECODE[dtype]).itemsize))
+
+def numpy_dtype(dtype: str, order: ByteOrder):
+    """ 数据类型对应的 numpy dtype (ABCD 为大端, 其他字节序按字读取后重排) """
+    code = DTYPE_FORMAT[dtype]
+    return numpy.dtype((">" if order == ByteOrder.ABCD else "<") + code)
+
+def numpy_block(data: memoryview, offset: int, count: int, step: int, dtype: str, order: ByteOrder):
+    """ 以零拷贝视图读取批量数据, 仅在需要重排字节序时复制 """
+    if order in (ByteOrder.ABCD, ByteOrder.DCBA):
+        return numpy.ndarray((count,), numpy_dtype(dtype, order), data, offset, (step,))
+    words = struct.calcsize(DTYPE_FORMAT[dtype]) // 2
+    word_dtype = ">u2" if order == ByteOrder.CDAB else "<u2"
+    w = numpy.ndarray((count, words), word_dtype, data, offset, (step, 2))
+    if order == ByteOrder.CDAB:
+        w = w[:, ::-1]
+    return numpy.ascontiguousarray(w, dtype=">u2").view(numpy_dtype(dtype, ByteOrder.ABCD)).reshape(count)
+
+@functools.lru_cache(maxsize=256)
+def block_struct(dtype: str, order: ByteOrder, count: int, gap: int) -> struct.Struct:
+    """ 批量读取结构: count 个元素, 元素间间隔 gap 字节 (仅 ABCD/DCBA), 最后一个元素后不留间隔 """
+    item = DTYPE_FORMAT[dtype] + ("%dx" % gap if gap > 0 else "")
+    return struct.Struct((">" if order == ByteOrder.ABCD else "<") + item * (count - 1) + DTYPE_FORMAT[dtype])
+
+def scale_block(values: typing.Sequence, scale: float, offset: float):
+    """ 对批量读取结果做线性变换 value * scale + offset """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return values * scale + offset
+    return array.array("d", [v * scale + offset for v in values])
+
 class Segment:
     def __init__(self, addr_begin: int, addr_end: int, width: int, space: int, data: bytes):
         self.addr_begin = addr_begin
         self.addr_end = addr_end
         self.width = width
         self.space = space
-        self.data = data
-        self.size = len(data)
-        
+        self.data = memoryview(data).cast("B")
+        self.size = len(self.data)
+
         if addr_end < addr_begin:
             raise RuntimeError("Segment Address Error: %s < %s" % (addr_end, addr_begin))
-        if (addr_end - addr_begin) * width < self.size:
-            raise RuntimeError("Segment Size Error: %s < %s" % ((addr_end - addr_begin) * width, self.size))
-        
+        if ((addr_end - addr_begin) * width + 7) // 8 < self.size:
+            raise RuntimeError("Segment Size Error: %s < %s" % (((addr_end - addr_begin) * width + 7) // 8, self.size))
+
+    def offset(self, addr: int, size: int) -> int:
+        """ 地址对应的字节偏移, 越界 (含数据不足 size 字节) 时返回 -1 """
+        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
+            return -1
+        offset = (addr - self.addr_begin) * self.width // 8
+        return offset if offset + size <= self.size else -1
+
     def bit(self, addr: int) -> int:
         if addr < self.addr_begin or addr >= self.addr_end:
             return 0
         addr = addr - self.addr_begin
-        b = struct.unpack_from("B", self.data, addr / 8)
-        return (b >> (addr % 8)) & 0x01
-    
-    def u16le(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
+        if self.width >= 8:
+            # 寄存器段: 按寄存器号定位, 不支持位寻址
             return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from("<H", self.data, addr * self.width / 8)
+        index = addr * self.width
+        if (index >> 3) >= self.size:
+            return 0
+        return (self.data[index >> 3] >> (index & 0x07)) & 0x01
 
-    def u16be(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
+    def value(self, addr: int, dtype: str, order: ByteOrder = ByteOrder.ABCD) -> typing.Union[int, float]:
+        """ 按数据类型和字节序读取数值, 越界返回0 """
+        size, decode = DECODERS[(dtype, order)]
+        offset = self.offset(addr, size)
+        if offset < 0:
             return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from(">H", self.data, addr * self.width / 8)
+        return decode(self.data, offset)
+
+    def string(self, addr: int, count: int, order: ByteOrder = ByteOrder.ABCD, encoding: str = "ascii") -> str:
+        """ 读取 count 个寄存器组成的字符串, 去除尾部的 \\0 和空格 """
+        size = count * self.width // 8
+        offset = self.offset(addr, size)
+        if offset < 0 or size <= 0:
+            return ""
+        raw = self.data[offset:offset + size]
+        if order in (ByteOrder.BADC, ByteOrder.DCBA):
+            raw = bytearray(raw)
+            raw[0::2], raw[1::2] = raw[1::2], raw[0::2]
+        return bytes(raw).rstrip(b"\x00 ").decode(encoding, "replace")
+
+    def contains(self, addr: int, count: int) -> bool:
+        """ [addr, addr + count) 是否完整落在本段内 """
+        return self.addr_begin <= addr and addr + count <= self.addr_end
+
+    def array(self, addr: int, count: int, dtype: str, order: ByteOrder = ByteOrder.ABCD, stride: int = 0):
+        """ 批量读取 count 个元素, 相邻元素起始地址间隔 stride 个地址 (0 表示紧密排列)
+
+        安装了 NumPy 时返回 numpy.ndarray, 否则返回 array.array. 越界部分为0.
+        """
+        size, decode = DECODERS[(dtype, order)]
+        step = stride * self.width // 8 if stride > 0 else size
+        if step < size:
+            raise RuntimeError("Array Stride Error: %s < %s" % (step, size))
+        offset = self.offset(addr, size)
+        if count <= 0 or offset < 0:
+            return zeros(dtype, max(count, 0))
+        avail = min(count, (self.size - offset - size) // step + 1)
+
+        if numpy is not None:
+            out = numpy.zeros(count, dtype=numpy_dtype(dtype, ByteOrder.ABCD).newbyteorder("="))
+            out[:avail] = numpy_block(self.data, offset, avail, step, dtype, order)
+            return out
+
+        out = array.array(ARRAY_TYPECODE[dtype])
+        if order in (ByteOrder.ABCD, ByteOrder.DCBA):
+            out.extend(block_struct(dtype, order, avail, step - size).unpack_from(self.data, offset))
+        else:
+            out.extend([decode(self.data, offset + i * step) for i in range(avail)])
+        if avail < count:
+            out.extend(zeros(dtype, count - avail))
+        return out
+
+    def u16le(self, addr: int) -> int:
+        return self.value(addr, "u16", ByteOrder.DCBA)
+
+    def u16be(self, addr: int) -> int:
+        return self.value(addr, "u16", ByteOrder.ABCD)
 
     def i16le(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from("<h", self.data, addr * self.width / 8)
+        return self.value(addr, "i16", ByteOrder.DCBA)
 
     def i16be(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from(">h", self.data, addr * self.width / 8)
+        return self.value(addr, "i16", ByteOrder.ABCD)
 
     def u32le(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from("<I", self.data, addr * self.width / 8)
+        return self.value(addr, "u32", ByteOrder.DCBA)
 
     def u32be(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from(">I", self.data, addr * self.width / 8)
+        return self.value(addr, "u32", ByteOrder.ABCD)
 
     def i32le(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from("<i", self.data, addr * self.width / 8)
+        return self.value(addr, "i32", ByteOrder.DCBA)
 
     def i32be(self, addr: int) -> int:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from(">i", self.data, addr * self.width / 8)
+        return self.value(addr, "i32", ByteOrder.ABCD)
 
     def f32(self, addr: int) -> float:
-        if self.width < 8 or addr < self.addr_begin or addr >= self.addr_end:
-            return 0
-        addr = addr - self.addr_begin
-        return struct.unpack_from("f", self.data, addr * self.width / 8)
+        return self.value(addr, "f32", ByteOrder.ABCD)
 
 class SegmentSet:
+    """ 地址段集合
+
+    按地址空间维护有序区间索引, 查找复杂度 O(log n), 并缓存上一次命中的区间以加速顺序读取.
+    段之间允许存在空洞, 空洞地址返回 null_segment (读值为0).
+    段之间发生重叠时, 先加入的段优先: 后加入的段只填补尚未被覆盖的地址.
+    """
+
     def __init__(self):
         self.segment: typing.List[Segment] = []
-        self.null_segment: Segment = Segment(0, 0, 0, 0)
-        
+        self.null_segment: Segment = Segment(0, 0, 0, 0, b"")
+        # 地址空间号 -> (区间起始地址列表, 区间列表), 区间为 (begin, end, segment)
+        self.index: typing.Dict[int, typing.Tuple[typing.List[int], typing.List[tuple]]] = {}
+        # 上一次命中的区间 (space, begin, end, segment)
+        self.last_hit: tuple = (None, 0, 0, self.null_segment)
+
     def add(self, segment: Segment) -> typing.NoReturn:
         self.segment.append(segment)
+        self.insert_index(segment)
+
+    def insert_index(self, segment: Segment) -> typing.NoReturn:
+        """ 将段中尚未被覆盖的地址区间插入索引 """
+        if segment.addr_end <= segment.addr_begin:
+            return
+        begins, spans = self.index.setdefault(segment.space, ([], []))
+        addr = segment.addr_begin
+        i = bisect.bisect_right(begins, addr) - 1
+        if i >= 0 and spans[i][1] > addr:
+            addr = spans[i][1]
+        i += 1
+        pieces = []
+        while addr < segment.addr_end:
+            if i < len(spans) and spans[i][0] <= addr:
+                addr = spans[i][1]
+                i += 1
+                continue
+            end = segment.addr_end if i >= len(spans) else min(segment.addr_end, spans[i][0])
+            pieces.append((i + len(pieces), (addr, end, segment)))
+            addr = end
+        for pos, span in pieces:
+            begins.insert(pos, span[0])
+            spans.insert(pos, span)
+        self.last_hit = (None, 0, 0, self.null_segment)
 
     def ref(self, addr: int, space: int) -> Segment:
-        for segment in self.segment:
-            if segment.space == space and segment.addr_begin <= addr and segment.addr_end > addr:
-                return segment
-        return self.null_segment
+        last_space, begin, end, segment = self.last_hit
+        if last_space == space and begin <= addr < end:
+            return segment
+        if space not in self.index:
+            return self.null_segment
+        begins, spans = self.index[space]
+        i = bisect.bisect_right(begins, addr) - 1
+        if i < 0:
+            return self.null_segment
+        begin, end, segment = spans[i]
+        if addr >= end:
+            return self.null_segment
+        self.last_hit = (space, begin, end, segment)
+        return segment
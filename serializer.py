@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+""" DD 对象树的 JSON 序列化
+
+每个类型只生成一次编码函数并缓存, 编码函数直接输出 JSON 片段, 不经过中间字典和 json 模块的 default 回调:
+    - __slots__ 类按字段顺序展开, 按默认实例的字段类型生成快速路径:
+      数值/字符串直接格式化, 嵌套的 __slots__ 子对象和枚举内联到同一函数中
+    - __dict__ 类 (DD) 的字段名与默认实例一致时同样展开, 否则按字典编码
+    - 字段类型与默认实例不同时退回通用编码
+输出与 json.dumps(o, cls=JsonEncoderIfJsonEnable) 一致, 但:
+    - bytes 编码为 urlsafe base64 字符串 (与请求一致), 而不是 null
+    - 无法序列化的类型抛出 TypeError, 而不是静默输出 null
+"""
+
+import base64
+import enum
+import json
+import json.encoder
+import typing
+
+import iface_class
+
+# 类型 -> 转换函数, 返回标准库可直接编码的对象 (用于 to_plain)
+CONVERTERS: typing.Dict[type, typing.Callable[[typing.Any], typing.Any]] = {}
+
+def convert(o: typing.Any) -> typing.Any:
+    f = CONVERTERS.get(o.__class__)
+    if f is None:
+        f = resolve(o.__class__)
+    return f(o)
+
+def resolve(cls: type) -> typing.Callable[[typing.Any], typing.Any]:
+    """ 解析类型的转换函数 """
+    if issubclass(cls, enum.Enum):
+        f = compile_enum(cls)
+    elif issubclass(cls, iface_class.JsonEnabled):
+        f = compile_class(cls)
+    elif issubclass(cls, (bytes, bytearray, memoryview)):
+        f = lambda o: base64.urlsafe_b64encode(o).decode("ascii")
+    else:
+        raise TypeError("Object of type %s is not JSON serializable" % cls.__name__)
+    CONVERTERS[cls] = f
+    return f
+
+def compile_enum(cls: typing.Type[enum.Enum]) -> typing.Callable:
+    """ 枚举转换为其值, 预先建立成员到值的映射 """
+    table = {member: member.value for member in cls}
+    return table.__getitem__
+
+def compile_class(cls: type) -> typing.Callable:
+    """ JsonEnabled 对象转换为字段字典, 使用 __slots__ 的类生成专用的字典构造函数 """
+    if cls.__dictoffset__ != 0 or not iface_class.slot_names(cls):
+        return iface_class.fields
+    names = iface_class.slot_names(cls)
+    src = "def to_dict(o):\n    return {%s}" % ", ".join("%r: o.%s" % (n, n) for n in names)
+    env = {}
+    exec(src, env)
+    return env["to_dict"]
+
+ENCODER = json.JSONEncoder(default=convert)
+
+# ---------------------------------------------------------------- 编码函数
+
+INF = float("inf")
+escape = json.encoder.encode_basestring_ascii
+float_repr = float.__repr__
+int_repr = int.__repr__
+
+def nonfinite(v: float) -> str:
+    """ 与 json 模块一致的 NaN/Infinity 表示 """
+    if v != v:
+        return "NaN"
+    return "Infinity" if v > 0 else "-Infinity"
+
+# 类型 -> 编码函数 f(o, out), 向 out 列表追加 JSON 片段
+WRITERS: typing.Dict[type, typing.Callable[[typing.Any, list], None]] = {}
+
+# 内联展开的最大嵌套层数
+INLINE_DEPTH = 4
+
+def write(o: typing.Any, out: list) -> None:
+    f = WRITERS.get(o.__class__)
+    if f is None:
+        f = resolve_writer(o.__class__)
+    f(o, out)
+
+def write_list(o: typing.Sequence, out: list) -> None:
+    if not o:
+        out.append("[]")
+        return
+    w = out.append
+    sep = "["
+    for v in o:
+        w(sep)
+        c = v.__class__
+        if c is float:
+            w(float_repr(v) if -INF < v < INF else nonfinite(v))
+        elif c is int:
+            w(int_repr(v))
+        elif c is str:
+            w(escape(v))
+        else:
+            write(v, out)
+        sep = ", "
+    w("]")
+
+def write_dict(o: dict, out: list) -> None:
+    if not o:
+        out.append("{}")
+        return
+    w = out.append
+    sep = "{"
+    for k, v in o.items():
+        w(sep)
+        w(escape(k if k.__class__ is str else plain_key(k)))
+        w(": ")
+        c = v.__class__
+        if c is float:
+            w(float_repr(v) if -INF < v < INF else nonfinite(v))
+        elif c is int:
+            w(int_repr(v))
+        elif c is str:
+            w(escape(v))
+        else:
+            write(v, out)
+        sep = ", "
+    w("}")
+
+def write_scalar(literal: str) -> typing.Callable[[typing.Any, list], None]:
+    return lambda o, out: out.append(literal)
+
+WRITERS.update({
+    str: lambda o, out: out.append(escape(o)),
+    int: lambda o, out: out.append(int_repr(o)),
+    float: lambda o, out: out.append(float_repr(o) if -INF < o < INF else nonfinite(o)),
+    bool: lambda o, out: out.append("true" if o else "false"),
+    type(None): write_scalar("null"),
+    list: write_list,
+    tuple: write_list,
+    dict: write_dict,
+})
+
+def resolve_writer(cls: type) -> typing.Callable[[typing.Any, list], None]:
+    """ 解析类型的编码函数 """
+    if issubclass(cls, enum.Enum):
+        table = enum_table(cls)
+        f = lambda o, out: out.append(table[o])
+    elif issubclass(cls, iface_class.JsonEnabled):
+        f = compile_writer(cls)
+    elif issubclass(cls, (bytes, bytearray, memoryview)):
+        f = lambda o, out: out.append('"%s"' % base64.urlsafe_b64encode(o).decode("ascii"))
+    elif issubclass(cls, (str, int, float)):
+        # 子类 (如 IntEnum 以外的自定义数值类型) 按基本类型编码
+        f = lambda o, out: out.append(ENCODER.encode(o))
+    else:
+        raise TypeError("Object of type %s is not JSON serializable" % cls.__name__)
+    WRITERS[cls] = f
+    return f
+
+def enum_table(cls: typing.Type[enum.Enum]) -> typing.Dict[enum.Enum, str]:
+    """ 枚举成员 -> 编码后的值 """
+    out: typing.Dict[enum.Enum, str] = {}
+    for member in cls:
+        buf: list = []
+        write(member.value, buf)
+        out[member] = "".join(buf)
+    return out
+
+def sample_of(cls: type) -> typing.Any:
+    """ 默认实例, 构造函数需要参数时为 None """
+    try:
+        return cls()
+    except TypeError:
+        return None
+
+class WriterSource:
+    """ 编码函数的源代码生成 """
+
+    def __init__(self) -> None:
+        self.lines: typing.List[str] = []
+        # 生成代码引用的对象
+        self.env: typing.Dict[str, typing.Any] = {
+            "write": write, "write_list": write_list, "write_dict": write_dict, "escape": escape,
+            "float_repr": float_repr, "int_repr": int_repr, "nonfinite": nonfinite, "INF": INF, "encode": encode,
+        }
+        self.count = 0
+
+    def name(self, prefix: str, value: typing.Any = None) -> str:
+        self.count += 1
+        n = "%s%d" % (prefix, self.count)
+        if value is not None:
+            self.env[n] = value
+        return n
+
+    def emit(self, indent: int, line: str) -> None:
+        self.lines.append("    " * indent + line)
+
+    def scalar(self, indent: int, v: str, first: type) -> None:
+        """ 值的通用编码, 按默认值类型排列判断顺序 """
+        branches = [
+            (float, "%s.__class__ is float" % v, "w(float_repr(%s) if -INF < %s < INF else nonfinite(%s))" % (v, v, v)),
+            (int, "%s.__class__ is int" % v, "w(int_repr(%s))" % v),
+            (str, "%s.__class__ is str" % v, "w(escape(%s))" % v),
+            (type(None), "%s is None" % v, "w('null')"),
+            (bool, "%s.__class__ is bool" % v, "w('true' if %s else 'false')" % v),
+        ]
+        branches.sort(key=lambda b: b[0] is not first)
+        for i, (_, cond, stmt) in enumerate(branches):
+            self.emit(indent, ("if %s:" if i == 0 else "elif %s:") % cond)
+            self.emit(indent + 1, stmt)
+        self.emit(indent, "else:")
+        self.emit(indent + 1, "write(%s, out)" % v)
+
+    def value(self, indent: int, v: str, default: typing.Any, depth: int) -> None:
+        """ 字段值的编码, default 为默认实例中的字段值 """
+        cls = default.__class__
+        if isinstance(default, enum.Enum):
+            table = self.name("T", enum_table(cls))
+            self.emit(indent, "if %s.__class__ is %s:" % (v, self.name("C", cls)))
+            self.emit(indent + 1, "w(%s[%s])" % (table, v))
+            self.emit(indent, "else:")
+            self.emit(indent + 1, "write(%s, out)" % v)
+        elif isinstance(default, iface_class.JsonEnabled) and depth < INLINE_DEPTH and cls.__dictoffset__ == 0:
+            self.emit(indent, "if %s.__class__ is %s:" % (v, self.name("C", cls)))
+            self.fields(indent + 1, v, cls, default, depth + 1)
+            self.emit(indent, "else:")
+            self.emit(indent + 1, "write(%s, out)" % v)
+        elif cls is list or cls is tuple:
+            self.emit(indent, "if %s.__class__ is list:" % v)
+            self.emit(indent + 1, "write_list(%s, out)" % v)
+            self.emit(indent, "else:")
+            self.emit(indent + 1, "write(%s, out)" % v)
+        elif cls is dict:
+            self.emit(indent, "if %s.__class__ is dict:" % v)
+            self.emit(indent + 1, "write_dict(%s, out)" % v)
+            self.emit(indent, "else:")
+            self.emit(indent + 1, "write(%s, out)" % v)
+        else:
+            self.scalar(indent, v, cls)
+
+    def expr(self, v: str, first: type) -> str:
+        """ 数值/字符串/None 字段值的编码表达式, 类型与默认值不同时调用 encode """
+        if first is float:
+            return "(float_repr(%s) if %s.__class__ is float and -INF < %s < INF else encode(%s))" % (v, v, v, v)
+        if first is int:
+            return "(int_repr(%s) if %s.__class__ is int else encode(%s))" % (v, v, v)
+        if first is str:
+            return "(escape(%s) if %s.__class__ is str else encode(%s))" % (v, v, v)
+        if first is type(None):
+            return "('null' if %s is None else encode(%s))" % (v, v)
+        return "encode(%s)" % v
+
+    def fields(self, indent: int, o: str, cls: type, sample: typing.Any, depth: int,
+               names: typing.Sequence[str] = None, d: str = None) -> None:
+        """ 展开对象的字段, d 不为 None 时从字典 d 中取值.
+        连续的数值/字符串字段合并为一次格式化, 其余字段逐个编码.
+        """
+        names = iface_class.slot_names(cls) if names is None else names
+        if not names:
+            self.emit(indent, "w('{}')")
+            return
+        # 待输出的格式串和表达式
+        fmt = ""
+        exprs: typing.List[str] = []
+        for i, n in enumerate(names):
+            fmt += (("{" if i == 0 else ", ") + escape(n) + ": ").replace("%", "%%")
+            v = self.name("v")
+            self.emit(indent, "%s = %s" % (v, "%s[%r]" % (d, n) if d is not None else "%s.%s" % (o, n)))
+            default = None if sample is None else getattr(sample, n)
+            if default.__class__ in _SCALARS:
+                exprs.append(self.expr(v, default.__class__))
+                fmt += "%s"
+                continue
+            self.flush(indent, fmt, exprs)
+            fmt, exprs = "", []
+            self.value(indent, v, default, depth)
+        self.flush(indent, fmt + "}", exprs)
+
+    def flush(self, indent: int, fmt: str, exprs: typing.List[str]) -> None:
+        if exprs:
+            self.emit(indent, "w(%r %% (%s,))" % (fmt, ", ".join(exprs)))
+        elif fmt:
+            self.emit(indent, "w(%r)" % fmt.replace("%%", "%"))
+
+def compile_writer(cls: type) -> typing.Callable[[typing.Any, list], None]:
+    """ 生成 JsonEnabled 类的编码函数 """
+    src = WriterSource()
+    sample = sample_of(cls)
+    src.emit(0, "def write_object(o, out):")
+    if cls.__dictoffset__ != 0:
+        if sample is None or not sample.__dict__:
+            src.emit(1, "write_dict(o.__dict__, out)")
+        else:
+            keys = tuple(sample.__dict__)
+            src.emit(1, "d = o.__dict__")
+            src.emit(1, "if tuple(d) != %s:" % src.name("K", keys))
+            src.emit(2, "write_dict(d, out)")
+            src.emit(2, "return")
+            src.emit(1, "w = out.append")
+            src.fields(1, "o", cls, sample, 0, keys, "d")
+    else:
+        src.emit(1, "w = out.append")
+        src.fields(1, "o", cls, sample, 0)
+    exec("\n".join(src.lines), src.env)
+    return src.env["write_object"]
+
+def encode(o: typing.Any) -> str:
+    """ 编码为 JSON 字符串 """
+    out: list = []
+    write(o, out)
+    return "".join(out)
+
+_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+def plain_key(k: typing.Any) -> str:
+    """ 字典键, 与 json 模块相同的转换规则 """
+    if isinstance(k, str):
+        return k
+    if k is True or k is False or k is None:
+        return json.dumps(k)
+    if isinstance(k, (int, float)):
+        return ENCODER.encode(k)
+    raise TypeError("keys must be str, int, float, bool or None, not %s" % k.__class__.__name__)
+
+def to_plain(o: typing.Any) -> typing.Any:
+    """ 转换为 JSON 基本类型树 (dict/list/str/int/float/bool/None), 与 dumps 的输出对应 """
+    cls = o.__class__
+    if cls in _SCALARS:
+        return o
+    if cls is list or cls is tuple:
+        return [to_plain(item) for item in o]
+    if cls is dict:
+        return {(k if k.__class__ is str else plain_key(k)): to_plain(v) for k, v in o.items()}
+    return to_plain(convert(o))
+
+def dumps(o: typing.Any) -> bytes:
+    """ 编码为 JSON 字节串 """
+    return encode(o).encode("utf-8")
+
+# 流式编码的默认分块大小
+CHUNK_SIZE = 64 * 1024
+# 流式编码逐层展开的容器深度, 更深的子树整体编码.
+# 响应 -> result -> dd -> 字段 (如 sub_dd/cluster 列表) -> 元素
+STREAM_DEPTH = 4
+
+def iterencode(o: typing.Any, chunk_size: int = CHUNK_SIZE, depth: int = STREAM_DEPTH) -> typing.Iterator[bytes]:
+    """ 流式编码为 JSON 字节块, 输出与 dumps 一致
+
+    前 depth 层容器逐项展开, 其下的子树由生成的编码函数整体编码, 每块约 chunk_size 字节.
+    内存峰值为 chunk_size 加上最大的一个子树, 与元素个数无关.
+    """
+    buf = bytearray()
+    for piece in stream(o, depth):
+        buf += piece.encode("utf-8")
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+def stream(o: typing.Any, depth: int) -> typing.Iterator[str]:
+    cls = o.__class__
+    if depth <= 0 or cls in _SCALARS:
+        yield encode(o)
+    elif cls is list or cls is tuple:
+        if not o:
+            yield "[]"
+            return
+        sep = "["
+        for item in o:
+            yield sep
+            yield from stream(item, depth - 1)
+            sep = ", "
+        yield "]"
+    elif cls is dict:
+        if not o:
+            yield "{}"
+            return
+        sep = "{"
+        for k, v in o.items():
+            yield sep
+            yield escape(k if k.__class__ is str else plain_key(k))
+            yield ": "
+            yield from stream(v, depth - 1)
+            sep = ", "
+        yield "}"
+    else:
+        yield from stream(convert(o), depth)
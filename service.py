@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+from base64 import urlsafe_b64decode
+import concurrent.futures
+import contextvars
+import functools
+import json
+import logging
+import time
+import traceback
+import typing
+import urllib.parse
+from addr import plan_addr_range
+from addrspace import AddressSpace, ModbusAddressSpace
+from devfield import DevCmd, DevRet, DeviceType
+
+from devdata import DD
+from driver import DriverBase
+import driverset
+from segment import ByteOrder, Segment, SegmentSet
+import binwire
+import delta
+import execqueue
+import history
+import metrics
+import profiling
+import serializer
+
+# JSON-RPC 错误码
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_SERVER_ERROR = -32000
+
+# 请求路径 -> 处理方法
+ROUTES = {
+    "/v1/parse": "parse_device_data",
+    "/v1/exec": "exec_command",
+    "/v1/addr": "define_addr_range",
+}
+
+# JSON-RPC method -> 请求路径
+METHODS = {
+    "parseDeviceData": "/v1/parse",
+    "execCommand": "/v1/exec",
+    "defineAddrRange": "/v1/addr",
+}
+
+# GET 请求路径 -> 处理方法
+GET_ROUTES = {
+    "/v1/metrics": "get_metrics",
+    "/v1/admin/profiles": "get_profiles",
+    "/v1/history": "get_history",
+    "/v1/job": "get_job",
+}
+
+JSON_CONTENT_TYPE = "application/json; charset=utf-8"
+
+class Response:
+    """ 服务响应 """
+
+    def __init__(self, body: bytes, content_type: str = JSON_CONTENT_TYPE, status: int = 200,
+                 headers: typing.Dict[str, str] = None, chunks: typing.Iterator[bytes] = None) -> None:
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        # 附加响应头
+        self.headers: typing.Dict[str, str] = {} if headers is None else headers
+        # 流式响应体, 不为 None 时忽略 body, 由服务端边编码边发送
+        self.chunks: typing.Iterator[bytes] = chunks
+
+logger = logging.getLogger("driver")
+
+# 当前请求中驱动借出的 DD [(驱动, DD)], 响应编码完成后归还 (见 DriverBase.reuseDD)
+LEASES: "contextvars.ContextVar[typing.Optional[list]]" = contextvars.ContextVar("leases", default=None)
+
+def release_leases(leases: list) -> None:
+    for d, dd in leases:
+        d.releaseDD(dd)
+    leases.clear()
+
+def release_after(chunks: typing.Iterator[bytes], leases: list) -> typing.Iterator[bytes]:
+    """ 流式响应: 编码结束 (或中止) 后归还 DD """
+    try:
+        yield from chunks
+    finally:
+        release_leases(leases)
+
+# handle 的 request 参数缺省值: 请求体尚未解码
+NOT_DECODED = object()
+
+def item_route(path: str, item: typing.Any) -> typing.Optional[str]:
+    """ 批量请求项的路由: 按 method, 缺省为请求路径 """
+    if not isinstance(item, dict) or "method" not in item:
+        return path
+    method = item["method"]
+    return METHODS.get(method) if isinstance(method, str) else None
+
+def is_exec_request(path: str, request: typing.Any) -> bool:
+    """ 已解码的请求是否执行设备指令 (/v1/exec, 或批量请求中路由为 /v1/exec 的项) """
+    if isinstance(request, list):
+        return any(item_route(path, item) == "/v1/exec" for item in request)
+    return path == "/v1/exec"
+
+def route_label(path: str) -> str:
+    """ 指标的路由标签, 未知路径合并为 other """
+    return path if path in ROUTES or path in GET_ROUTES else "other"
+
+def driver_labels(d: DriverBase) -> typing.Tuple[str, str, str]:
+    return d.DEVICE_TYPE.name, d.PRODUCER, d.MODEL
+
+# 请求参数无法识别或没有对应驱动时的驱动标签
+UNKNOWN_LABELS = ("unknown", "unknown", "unknown")
+
+def request_labels(request: typing.Any) -> typing.Tuple[str, str, str]:
+    """ 请求参数中的驱动标签, 只使用已注册驱动的标签, 避免客户端任意填写的 producer/model 产生无限多的时间序列 """
+    try:
+        params = request["params"]
+        type, producer, model = DeviceType(int(params["type"])), str(params["producer"]), str(params["model"])
+    except Exception:
+        return UNKNOWN_LABELS
+    if not driverset.DRIVERS.contains(type, producer, model):
+        return UNKNOWN_LABELS
+    return type.name, producer, model
+
+def decode_bytes(v: typing.Union[str, bytes]) -> bytes:
+    """ JSON 请求中的二进制字段为 urlsafe base64 字符串, 二进制请求中为原始字节 """
+    return v if isinstance(v, bytes) else urlsafe_b64decode(v)
+
+def make_address_space(space: int, order: str, segments: typing.List[tuple], device_id: str = "") -> AddressSpace:
+    """ 由数据段参数 (addr_begin, addr_end, width, space, data) 构造地址空间 """
+    segset = SegmentSet()
+    for addr_begin, addr_end, width, sps, data in segments:
+        segset.add(Segment(addr_begin, addr_end, width, space if sps == 0 else sps, data))
+    addr_space = ModbusAddressSpace(segset, space, ByteOrder[order])
+    addr_space.device_id = device_id
+    return addr_space
+
+class DriverService:
+    """ 驱动服务: 与传输层无关的请求处理, 由 HTTP 服务端调用 """
+
+    def __init__(self, batch_executor: concurrent.futures.Executor = None, parse_pool: "worker_pool.ParsePool" = None,
+                 profiler: profiling.Profiler = None, stream: bool = False, history: history.HistoryStore = None,
+                 exec_queue: execqueue.ExecQueue = None) -> None:
+        # 批量请求的并发执行器, None 表示顺序执行
+        self.batch_executor = batch_executor
+        # 多进程解析池, None 表示在当前进程内解析
+        self.parse_pool = parse_pool
+        # 增量模式的设备状态
+        self.delta = delta.DeltaTracker()
+        # 运行指标
+        self.metrics = metrics.Metrics()
+        # 请求剖析, 默认不启用
+        self.profiler = profiling.Profiler() if profiler is None else profiler
+        # /v1/parse 的 JSON 响应流式编码发送
+        self.stream = stream
+        # 解析结果的历史数据, None 表示不记录
+        self.history = history
+        # 设备指令队列, 工作线程在首次提交时启动
+        self.exec_queue = execqueue.ExecQueue() if exec_queue is None else exec_queue
+
+    def handle(self, path: str, body: bytes, content_type: str = "", accept: str = "", if_none_match: str = "",
+               profile: str = "", request: typing.Any = NOT_DECODED) -> Response:
+        """ 处理一个 POST 请求体. 请求无法解析时抛出异常
+
+        请求体按 Content-Type 解码; 响应在 Accept 包含二进制类型,
+        或未指定 Accept 且请求为二进制时使用二进制格式, 否则使用 JSON.
+        profile 为 X-Profile 请求头, 见 profiling 模块.
+        request 为已由 decode 解码的请求体, 缺省时解码 body.
+        """
+        if not self.profiler.want(profile):
+            return self.handle_request(path, body, content_type, accept, if_none_match, request)
+        forced = bool(profile) and profile != "0"
+        res, record_id = self.profiler.run(self.handle_request, path, body, content_type, forced, accept, if_none_match,
+                                           request)
+        if record_id is not None:
+            res.headers["X-Profile-Id"] = str(record_id)
+        return res
+
+    def decode(self, path: str, body: bytes, content_type: str) -> typing.Any:
+        """ 按 Content-Type 解码请求体, 格式错误时抛出异常 """
+        t0 = time.perf_counter()
+        request = binwire.loads(body) if content_type.startswith(binwire.CONTENT_TYPE) else json.loads(body)
+        self.metrics.observe("qingems_phase_seconds", (route_label(path), "decode"), time.perf_counter() - t0)
+        return request
+
+    def handle_request(self, path: str, body: bytes, content_type: str, accept: str, if_none_match: str,
+                       decoded: typing.Any = NOT_DECODED) -> Response:
+        route = route_label(path)
+        request = None
+        t0 = time.perf_counter()
+        leases = []
+        token = LEASES.set(leases)
+        try:
+            request = self.decode(path, body, content_type) if decoded is NOT_DECODED else decoded
+            binary = content_type.startswith(binwire.CONTENT_TYPE)
+            binary = binwire.CONTENT_TYPE in accept or (binary and accept in ("", "*/*"))
+            if path == "/v1/addr" and isinstance(request, dict) and "gap" not in request.get("params", {}):
+                res = self.handle_addr(request, binary, if_none_match)
+            else:
+                if isinstance(request, list):
+                    response = self.dispatch_batch(path, request)
+                else:
+                    response = self.dispatch(path, request)
+                t2 = time.perf_counter()
+                if binary:
+                    res = Response(binwire.dumps(response), binwire.CONTENT_TYPE)
+                elif self.stream and route == "/v1/parse" and not isinstance(request, list):
+                    # 编码在发送时进行, 耗时计入 write 阶段, 编码结束后归还 DD
+                    chunks, leases = release_after(serializer.iterencode(response), leases), []
+                    return Response(b"", chunks=chunks)
+                else:
+                    res = Response(serializer.dumps(response))
+                self.metrics.observe("qingems_phase_seconds", (route, "encode"), time.perf_counter() - t2)
+        except Exception:
+            self.metrics.inc("qingems_errors_total", (route,) + request_labels(request))
+            raise
+        finally:
+            LEASES.reset(token)
+            release_leases(leases)
+            self.metrics.observe("qingems_request_seconds", (route,), time.perf_counter() - t0)
+            self.metrics.observe("qingems_request_bytes", (route,), len(body))
+        self.metrics.observe("qingems_response_bytes", (route,), len(res.body))
+        return res
+
+    def handle_get(self, path: str) -> Response:
+        """ 处理 GET 请求, 未知路径返回 404 """
+        route = GET_ROUTES.get(path.partition("?")[0])
+        if route is None:
+            return Response(b"", None, 404)
+        return getattr(self, route)(path)
+
+    def get_metrics(self, path: str) -> Response:
+        return Response(self.metrics.render(), metrics.CONTENT_TYPE)
+
+    def get_profiles(self, path: str) -> Response:
+        """ 剖析记录管理接口, 见 profiling 模块 """
+        if not self.profiler.enabled:
+            return Response(b"", None, 404)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        if "id" not in query:
+            return Response(serializer.dumps([r.summary() for r in self.profiler.records]))
+        record = self.profiler.find(int(query["id"][0]))
+        if record is None:
+            return Response(b"", None, 404)
+        format = query.get("format", ["json"])[0]
+        if format == "request":
+            return Response(record.body, record.content_type or "application/json")
+        if format == "pstats":
+            return Response(record.pstats, "application/octet-stream")
+        return Response(serializer.dumps(record.detail()))
+
+    def get_history(self, path: str) -> Response:
+        """ 历史数据查询接口, 见 history 模块 """
+        if self.history is None:
+            return Response(b"", None, 404)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        if "device" in query:
+            key = query["device"][0]
+        elif "device_id" in query:
+            key = self.get_device_key({"params": {k: query[k][0] for k in ("type", "producer", "model", "device_id")}})
+        else:
+            return Response(serializer.dumps(self.history.summary()))
+        result = self.history.query(key, query.get("field", []), float(query.get("start", ["-inf"])[0]),
+                                    float(query.get("end", ["inf"])[0]), int(query.get("window", ["0"])[0]))
+        if result is None:
+            return Response(b"", None, 404)
+        return Response(serializer.dumps(result))
+
+    def get_job(self, path: str) -> Response:
+        """ 指令任务查询接口, wait 参数为长轮询秒数, 见 execqueue 模块 """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        if "id" not in query:
+            return Response(b"", None, 404)
+        job = self.exec_queue.wait(query["id"][0], float(query.get("wait", ["0"])[0]))
+        if job is None:
+            return Response(b"", None, 404)
+        return Response(serializer.dumps(job.summary()))
+
+    def record_history(self, request: dict, key: str, dd: DD) -> None:
+        """ 记录解析结果, 采样时间为参数 time (Unix 秒), 缺省为当前时间 """
+        if self.history is None or not key or dd is None:
+            return
+        t = request["params"].get("time")
+        self.history.record(key, dd, None if t is None else float(t))
+
+    def observe_driver(self, route: str, phase: str, d: DriverBase, seconds: float) -> None:
+        self.metrics.observe("qingems_driver_seconds", (route, phase) + driver_labels(d), seconds)
+
+    def handle_addr(self, request: dict, binary: bool, if_none_match: str) -> Response:
+        """ /v1/addr: 使用注册时缓存的采集计划, 支持 If-None-Match 条件请求 """
+        cache = self.get_addr_plan(request)
+        headers = {"ETag": cache.etag}
+        if if_none_match and (if_none_match.strip() == "*" or cache.etag in [t.strip() for t in if_none_match.split(",")]):
+            return Response(b"", None, 304, headers)
+        if binary:
+            response = self.make_response(request, True, "addr_range", None)
+            response["result"] = cache.result
+            return Response(binwire.dumps(response), binwire.CONTENT_TYPE, headers=headers)
+        # 响应中只有 id 随请求变化, 其余部分直接拼接缓存的编码结果
+        head = b'{"version": 1, "jsonrpc": "2.0", "id": ' + serializer.dumps(request.get("id")) + b', "result": '
+        return Response(head + cache.body + b"}", headers=headers)
+
+    def dispatch(self, path: str, request: dict) -> dict:
+        """ 按路径分发单个请求, 未知路径返回空响应 """
+        route = ROUTES.get(path)
+        if route is None:
+            return {}
+        return getattr(self, route)(request)
+
+    def dispatch_batch(self, path: str, requests: list) -> list:
+        """ JSON-RPC 2.0 批量请求: 每项按 method (缺省按请求路径) 分发, 单项失败不影响其他项 """
+        if len(requests) == 0:
+            return self.make_error(None, RPC_INVALID_REQUEST, "empty batch")
+        if self.batch_executor is None:
+            responses = [self.dispatch_item(path, item) for item in requests]
+        else:
+            # 各项在当前上下文的副本中执行, 借出的 DD 记录到同一列表
+            contexts = [contextvars.copy_context() for _ in requests]
+            responses = list(self.batch_executor.map(
+                lambda ctx, item: ctx.run(self.dispatch_item, path, item), contexts, requests))
+        # 无 id 的通知请求不返回响应
+        return [r for r in responses if r is not None]
+
+    def dispatch_item(self, path: str, request: dict) -> dict:
+        if not isinstance(request, dict):
+            return self.make_error(None, RPC_INVALID_REQUEST, "request must be an object")
+        notify = "id" not in request
+        try:
+            path = item_route(path, request)
+            if path not in ROUTES:
+                response = self.make_error(request.get("id"), RPC_METHOD_NOT_FOUND, "method not found: %s" % request.get("method"))
+            else:
+                response = self.dispatch(path, request)
+        except Exception as e:
+            logger.error("[DRIVER] [BATCH] [%s] FAIL [%s]: \n%s", path, str(e), traceback.format_exc())
+            self.metrics.inc("qingems_errors_total", (route_label(path),) + request_labels(request))
+            response = self.make_error(request.get("id"), RPC_SERVER_ERROR, str(e))
+        return None if notify else response
+
+    def define_addr_range(self, request: dict) -> dict:
+        params = request.get("params", {})
+        if "gap" not in params:
+            response = self.make_response(request, True, "addr_range", None)
+            response["result"] = self.get_addr_plan(request).result
+            return response
+        d = self.get_driver(request)
+        t0 = time.perf_counter()
+        addr_range = d.defineAddrRange()
+        self.observe_driver("/v1/addr", "driver", d, time.perf_counter() - t0)
+        addr_plan, addr_map = plan_addr_range(addr_range, int(params["gap"]))
+        response = self.make_response(request, True, "addr_range", addr_range)
+        # 合并后的采集计划, 及每个原区间对应的计划区间下标
+        response["result"]["addr_plan"] = addr_plan
+        response["result"]["addr_map"] = addr_map
+        return response
+
+    def parse_device_data(self, request: dict) -> dict:
+        d = self.get_driver(request)
+        args = self.get_segment_args(request)
+        if request["params"].get("delta"):
+            return self.parse_delta(request, d, args)
+        key = self.get_device_key(request)
+        dd = self.parse_segments(d, key, args)
+        self.record_history(request, key, dd)
+        return self.make_response(request, dd is not None, "dd", dd)
+
+    def parse_segments(self, d: DriverBase, device_key: str, args: tuple) -> DD:
+        t0 = time.perf_counter()
+        if self.parse_pool is None:
+            addr_space = make_address_space(*args)
+            t1 = time.perf_counter()
+            self.observe_driver("/v1/parse", "addrspace", d, t1 - t0)
+            dd = d.parseDeviceData(addr_space)
+            leases = LEASES.get()
+            if leases is not None and dd is not None:
+                leases.append((d, dd))
+        else:
+            t1 = t0
+            dd = self.parse_pool.parse(device_key, d.DEVICE_TYPE.value, d.PRODUCER, d.MODEL, *args)
+        self.observe_driver("/v1/parse", "driver", d, time.perf_counter() - t1)
+        return dd
+
+    def parse_delta(self, request: dict, d: DriverBase, args: tuple) -> dict:
+        """ 增量模式解析, 协议见 delta 模块 """
+        params = request["params"]
+        key = self.get_device_key(request)
+        if not key:
+            raise AssertionError("Require [device_id] in [params] for delta mode")
+        digest = delta.digest(*args[:3])
+        state = self.delta.get(key)
+        full = state is None or bool(params.get("resync")) or params.get("seq") != state.seq
+
+        if not full and digest == state.digest:
+            response = self.make_response(request, True, "unchanged", True)
+            response["result"]["seq"] = state.seq
+            return response
+
+        dd = self.parse_segments(d, key, args)
+        self.record_history(request, key, dd)
+        if dd is None:
+            self.delta.discard(key)
+            return self.make_response(request, False, "dd", dd)
+        plain = serializer.to_plain(dd)
+        seq = 1 if state is None else state.seq + 1
+        self.delta.put(key, delta.DeviceState(seq, digest, plain))
+
+        if full:
+            response = self.make_response(request, True, "dd", plain)
+            response["result"]["full"] = True
+        else:
+            changes, removed = [], []
+            delta.diff(state.plain, plain, [], changes, removed)
+            response = self.make_response(request, True, "delta", {"set": changes, "del": removed})
+            response["result"]["base_seq"] = state.seq
+        response["result"]["seq"] = seq
+        return response
+
+    def exec_command(self, request: dict) -> dict:
+        """ 执行指令: 异步请求和带 device_id 的请求经过按设备串行的指令队列, 见 execqueue 模块 """
+        d = self.get_driver(request)
+        cmd = self.get_cmd(request)
+        params = request["params"]
+        key = self.get_device_key(request)
+        if not params.get("async") and not key:
+            r = self.run_command(d, cmd)
+            return self.make_response(request, r.succ, "cont", r.cont)
+
+        coalesce = params.get("coalesce")
+        if coalesce is True or coalesce is None and cmd.cmd in d.COALESCE_COMMANDS:
+            coalesce = cmd.cmd
+        elif coalesce is not None and coalesce is not False:
+            coalesce = str(coalesce)
+        else:
+            coalesce = None
+        timeout = None if "timeout" not in params else float(params["timeout"])
+        job = self.exec_queue.submit(key, cmd.cmd, functools.partial(self.run_command, d, cmd), timeout, coalesce)
+        if params.get("async"):
+            return self.make_response(request, True, "job", job.summary())
+
+        job.event.wait(max(0.0, job.deadline - time.time()))
+        if job.state == "done":
+            return self.make_response(request, job.result.succ, "cont", job.result.cont)
+        if job.state == "failed":
+            raise RuntimeError(job.error)
+        # 未在截止时间内完成 (仍在执行或已过期/被取代)
+        return self.make_response(request, False, "job", job.summary())
+
+    def run_command(self, d: DriverBase, cmd: DevCmd) -> DevRet:
+        t0 = time.perf_counter()
+        r = d.execCommand(cmd)
+        self.observe_driver("/v1/exec", "driver", d, time.perf_counter() - t0)
+        return r
+
+    def get_driver_index(self, request: dict) -> typing.Tuple[DeviceType, str, str]:
+        if "params" not in request:
+            raise AssertionError("Require [params] in request.")
+        params = request["params"]
+        if not ("type" in params and "producer" in params and "model" in params):
+            raise AssertionError("Require [type, producer, model] in [params]")
+        return DeviceType(int(params["type"])), str(params["producer"]), str(params["model"])
+
+    def get_driver(self, request: dict) -> DriverBase:
+        type, producer, model = self.get_driver_index(request)
+        d = driverset.DRIVERS.ref(type, producer, model)
+        if d is None:
+            raise RuntimeError("No driver for [%s(%s):%s:%s]" % (type, type.name, producer, model)) 
+        return d
+
+    def get_addr_plan(self, request: dict) -> driverset.AddrPlanCache:
+        return driverset.DRIVERS.ref_addr_plan(*self.get_driver_index(request))
+
+    def get_device_key(self, request: dict) -> str:
+        """ 设备键: 驱动键 + 客户端提供的 device_id, 无 device_id 时为空 """
+        params = request["params"]
+        if "device_id" not in params:
+            return ""
+        return "%s|%s|%s|%s" % (params["type"], params["producer"], params["model"], params["device_id"])
+
+    def get_segment_args(self, request: dict) -> typing.Tuple[int, str, typing.List[tuple], str]:
+        """ 解码地址空间参数: (默认地址空间号, 字节序名称, 数据段参数列表, 设备ID) """
+        params = request["params"]
+        space = 1 if "space" not in params else int(params["space"])
+        order = ByteOrder.ABCD.name if "order" not in params else ByteOrder[str(params["order"])].name
+        segments = []
+        if "segment" in params:
+            for seg in params["segment"]:
+                segments.append((
+                    int(seg["addr_begin"]),
+                    int(seg["addr_end"]),
+                    int(seg["width"]),
+                    int(seg["space"]),
+                    decode_bytes(seg["data"])))
+        device_id = "" if "device_id" not in params else str(params["device_id"])
+        return space, order, segments, device_id
+
+    def get_address_space(self, request: dict) -> AddressSpace:
+        return make_address_space(*self.get_segment_args(request))
+        
+    def get_cmd(self, request: dict) -> DevCmd:
+        cmd = DevCmd()
+        params = request["params"]
+        cmd.cmd = "noop" if "cmd" not in params else str(params["cmd"])
+        for a in params["args"]:
+            cmd.args.append(decode_bytes(a))
+        return cmd
+
+    def make_response(self, request: dict, succ: bool, key: str, val: any) -> dict:
+        response = {
+            "version": 1,
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+        }
+
+        if succ:
+            response["result"] = {
+                key: val
+            }
+        else:
+            response["error"] = {
+                "code": 0,
+                "message": "driver service failure",
+                "data": {
+                    key: val
+                }
+            }
+        return response
+
+    def make_error(self, id: any, code: int, message: str) -> dict:
+        """ JSON-RPC 错误响应 """
+        return {
+            "version": 1,
+            "jsonrpc": "2.0",
+            "id": id,
+            "error": {
+                "code": code,
+                "message": message,
+            }
+        }
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+""" 分时计费: 计费时段索引和分时电量累计
+
+TariffIndex 由 EMChargingTR 列表编译一天内的时段表 (UTC 距0点秒数 -> 计费等级):
+    - 各时段按自身 tz 换算为 UTC, end <= begin 的时段跨越0点
+    - 未覆盖的时刻为 FREE, 重叠部分以列表中靠后的时段为准
+    - end - begin == 86400 表示全天
+查询时刻的计费等级为一次二分查找; 任意时间区间内各等级的秒数由累计函数相减得到, 与区间跨越的天数无关.
+
+电量按时间均匀分布到采样区间内 (功率为相邻两次采样的平均值), 再按各等级的秒数比例计入 EnergyMeasure
+的 sharp/peak/flat/valley, 全部电量计入 total, FREE 时段的电量只计入 total.
+单位与 devfield 一致: 功率为瓦特, 时间为秒, 电能为焦耳.
+
+批量结算 (多个电表的历史采样) 使用 rebin, 安装 NumPy 时使用向量化计算.
+"""
+
+import bisect
+import functools
+import math
+import typing
+
+from devdata import DDOfEM2
+from devfield import ACEnergy, EMChargingLevel, EMChargingTR, EnergyMeasure
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAY = 86400
+
+# 计费等级 -> EnergyMeasure 字段, FREE 不单独计量
+LEVEL_FIELDS: typing.Dict[EMChargingLevel, str] = {
+    EMChargingLevel.SHARP: "sharp",
+    EMChargingLevel.PEAK: "peak",
+    EMChargingLevel.FLAT: "flat",
+    EMChargingLevel.VALLEY: "valley",
+}
+
+# 按等级值排列的等级, 各等级统计列表的下标为等级值
+LEVELS: typing.List[EMChargingLevel] = sorted(EMChargingLevel, key=lambda x: x.value)
+
+class TariffIndex:
+    """ 计费时段索引, 见模块说明 """
+
+    def __init__(self, periods: typing.Iterable[EMChargingTR]) -> None:
+        painted: typing.List[typing.Tuple[int, int, EMChargingLevel]] = []
+        for p in periods:
+            length = p.end - p.begin
+            if not 0 < length <= DAY:
+                length %= DAY
+            if length == 0:
+                continue
+            begin = (p.begin - p.tz * 3600) % DAY
+            end = begin + length
+            if end > DAY:
+                painted.append((begin, DAY, p.level))
+                painted.append((0, end - DAY, p.level))
+            else:
+                painted.append((begin, end, p.level))
+
+        cuts = sorted(set([0, DAY] + [b for b, _, _ in painted] + [e for _, e, _ in painted]))
+        # 各区间的起始时刻 (UTC 距0点秒数) 和计费等级, starts[0] == 0
+        self.starts: typing.List[int] = []
+        self.levels: typing.List[EMChargingLevel] = []
+        for lo, hi in zip(cuts, cuts[1:]):
+            level = EMChargingLevel.FREE
+            for b, e, lv in painted:
+                if b <= lo and hi <= e:
+                    level = lv
+            if not self.levels or self.levels[-1] != level:
+                self.starts.append(lo)
+                self.levels.append(level)
+
+        bounds = self.starts + [DAY]
+        # cum[L][j]: 0点至 starts[j] 之间等级值为 L 的秒数 (j == len(starts) 时为全天)
+        self.cum: typing.List[typing.List[float]] = [[0.0] for _ in LEVELS]
+        for j, level in enumerate(self.levels):
+            for L in range(len(LEVELS)):
+                self.cum[L].append(self.cum[L][-1] + (bounds[j + 1] - bounds[j] if level.value == L else 0.0))
+        # 每天各等级的秒数
+        self.daily: typing.List[float] = [c[-1] for c in self.cum]
+
+    def level_at(self, t: float) -> EMChargingLevel:
+        """ Unix 时间戳的计费等级 """
+        return self.levels[bisect.bisect_right(self.starts, t % DAY) - 1]
+
+    def cumulative(self, t: float) -> typing.List[float]:
+        """ 1970-01-01 00:00 UTC 至 t 之间各等级的秒数 """
+        days, sod = divmod(t, DAY)
+        j = bisect.bisect_right(self.starts, sod) - 1
+        result = [days * self.daily[L] + self.cum[L][j] for L in range(len(LEVELS))]
+        result[self.levels[j].value] += sod - self.starts[j]
+        return result
+
+    def seconds(self, t0: float, t1: float) -> typing.List[float]:
+        """ [t0, t1) 内各等级的秒数 """
+        return [b - a for a, b in zip(self.cumulative(t0), self.cumulative(t1))]
+
+    def fractions(self, t0: float, t1: float) -> typing.List[float]:
+        """ [t0, t1) 内各等级的时间比例, 空区间为 t0 时刻的等级 """
+        if t1 <= t0:
+            result = [0.0] * len(LEVELS)
+            result[self.level_at(t0).value] = 1.0
+            return result
+        dt = t1 - t0
+        return [s / dt for s in self.seconds(t0, t1)]
+
+    def cumulative_array(self, t: "numpy.ndarray") -> "numpy.ndarray":
+        """ cumulative 的 NumPy 版本, 结果在最后增加一维 (等级值) """
+        bounds = numpy.asarray(self.starts + [DAY], dtype=numpy.float64)
+        days = numpy.floor(t / DAY)
+        sod = t - days * DAY
+        return numpy.stack([days * self.daily[L] + numpy.interp(sod, bounds, self.cum[L]) for L in range(len(LEVELS))], axis=-1)
+
+@functools.lru_cache(maxsize=256)
+def compile_periods(periods: typing.Tuple[typing.Tuple[int, int, int, EMChargingLevel], ...]) -> TariffIndex:
+    trs = []
+    for tz, begin, end, level in periods:
+        tr = EMChargingTR()
+        tr.tz, tr.begin, tr.end, tr.level = tz, begin, end, level
+        trs.append(tr)
+    return TariffIndex(trs)
+
+def index_of(periods: typing.Iterable[EMChargingTR]) -> TariffIndex:
+    """ 时段列表的索引, 相同内容的时段列表共用一个索引 (每次解析生成的 dd.tr 无需重复编译) """
+    return compile_periods(tuple((p.tz, p.begin, p.end, p.level) for p in periods))
+
+def add_levels(measure: EnergyMeasure, energy: typing.Sequence[float], field: str = "total") -> None:
+    """ 将各等级电量 (下标为等级值) 累加到 EnergyMeasure 的 field 字段 """
+    total: ACEnergy = measure.total
+    setattr(total, field, getattr(total, field) + sum(energy))
+    for level, name in LEVEL_FIELDS.items():
+        e = energy[level.value]
+        if e:
+            part: ACEnergy = getattr(measure, name)
+            setattr(part, field, getattr(part, field) + e)
+
+class EnergyAccumulator:
+    """ 增量分时电量累计 """
+
+    def __init__(self, index: TariffIndex, measure: EnergyMeasure = None, field: str = "total",
+                 max_gap: float = math.inf) -> None:
+        self.index = index
+        # 累计结果
+        self.measure: EnergyMeasure = EnergyMeasure() if measure is None else measure
+        # 累计到 ACEnergy 的字段 (total 或某一相)
+        self.field = field
+        # 功率采样间隔超过 max_gap 秒时不积分该区间
+        self.max_gap = max_gap
+        # 上次采样的时间和值 (功率或电量计数)
+        self.last_time: float = None
+        self.last_value: float = None
+
+    def add_energy(self, t0: float, t1: float, energy: float) -> None:
+        """ 将 [t0, t1) 内的电量按时间比例分配到各等级 """
+        add_levels(self.measure, [energy * f for f in self.index.fractions(t0, t1)], self.field)
+
+    def add_power(self, t: float, power: float) -> None:
+        """ 功率采样, 与上次采样之间按梯形积分 """
+        if power != power:
+            return
+        if self.last_time is not None and self.last_time < t <= self.last_time + self.max_gap:
+            self.add_energy(self.last_time, t, (self.last_value + power) * 0.5 * (t - self.last_time))
+        if self.last_time is None or t > self.last_time:
+            self.last_time, self.last_value = t, power
+
+    def add_counter(self, t: float, reading: float) -> None:
+        """ 电量计数采样, 与上次采样的差值分配到两次采样之间; 计数减小 (清零/更换) 时重新开始 """
+        if reading != reading:
+            return
+        if self.last_time is not None and t >= self.last_time and reading >= self.last_value:
+            if reading > self.last_value:
+                self.add_energy(self.last_time, t, reading - self.last_value)
+        elif self.last_time is not None and t < self.last_time:
+            return
+        self.last_time, self.last_value = t, reading
+
+    def reset(self) -> None:
+        """ 清除上次采样, 下次采样重新开始 """
+        self.last_time = None
+        self.last_value = None
+
+class EM2Accumulator:
+    """ 双向电表: 由正反向总电量计数按 dd.tr 分时累计, 结果写入 dd 的尖峰平谷电量 (不修改 total) """
+
+    def __init__(self) -> None:
+        self.forward = EnergyAccumulator(None)
+        self.reverse = EnergyAccumulator(None)
+
+    def update(self, dd: DDOfEM2, t: float) -> None:
+        index = index_of(dd.tr)
+        for acc, measure in ((self.forward, dd.forward_energy), (self.reverse, dd.reverse_energy)):
+            acc.index = index
+            acc.add_counter(t, measure.total.total)
+            for name in LEVEL_FIELDS.values():
+                getattr(measure, name).total = getattr(acc.measure, name).total
+
+def rebin(index: TariffIndex, times: typing.Sequence, values: typing.Sequence, counter: bool = True) -> typing.List[typing.List[float]]:
+    """ 批量分时结算, 返回每个电表各等级的电量 (下标为等级值)
+
+    values 为 [电表][采样] 的电量计数 (counter=True) 或功率, times 为共用的 [采样] 或 [电表][采样] 时间戳.
+    计数减小的区间和 NaN 采样相关的区间不计电量.
+    """
+    if numpy is not None:
+        return rebin_numpy(index, times, values, counter)
+    def fractions(ts: typing.Sequence[float]) -> typing.List[typing.List[float]]:
+        return [index.fractions(ts[k], ts[k + 1]) for k in range(len(ts) - 1)]
+
+    shared = len(times) == 0 or not hasattr(times[0], "__len__")
+    # 共用时间戳时各区间的等级比例只计算一次
+    common = fractions(times) if shared else None
+    result = []
+    for m, row in enumerate(values):
+        ts = times if shared else times[m]
+        fracs = common if shared else fractions(ts)
+        energy = [0.0] * len(LEVELS)
+        for k in range(len(row) - 1):
+            a, b = row[k], row[k + 1]
+            if counter:
+                e = b - a if b >= a else 0.0
+            else:
+                e = (a + b) * 0.5 * (ts[k + 1] - ts[k])
+            if e != e or e == 0:
+                continue
+            for L, f in enumerate(fracs[k]):
+                if f:
+                    energy[L] += e * f
+        result.append(energy)
+    return result
+
+def rebin_numpy(index: TariffIndex, times: typing.Sequence, values: typing.Sequence, counter: bool) -> typing.List[typing.List[float]]:
+    v = numpy.atleast_2d(numpy.asarray(values, dtype=numpy.float64))
+    t = numpy.broadcast_to(numpy.asarray(times, dtype=numpy.float64), v.shape)
+    dt = numpy.diff(t, axis=1)
+    if counter:
+        e = numpy.diff(v, axis=1)
+        e = numpy.where(e > 0, e, 0.0)
+    else:
+        e = (v[:, 1:] + v[:, :-1]) * 0.5 * dt
+    e = numpy.where(numpy.isnan(e), 0.0, e)
+    seconds = numpy.diff(index.cumulative_array(t), axis=1)
+    positive = dt > 0
+    frac = seconds / numpy.where(positive, dt, 1.0)[..., None]
+    if not positive.all():
+        # 空区间计入起始时刻的等级
+        level = numpy.asarray([lv.value for lv in index.levels])[
+            numpy.searchsorted(numpy.asarray(index.starts), t[:, :-1] % DAY, side="right") - 1]
+        onehot = (level[..., None] == numpy.arange(len(LEVELS))).astype(numpy.float64)
+        frac = numpy.where(positive[..., None], frac, onehot)
+    return numpy.einsum("mk,mkl->ml", e, frac).tolist()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+import pytest
+
+from addr import MODBUS_MAX_REGS, AddrRange, AddrType, plan_addr_range
+import binwire
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from service import DriverService
+
+def regs(begin: int, end: int, space: int = 0, ts_presleep: int = 0) -> AddrRange:
+    return AddrRange(AddrType.MODBUS_REGS, begin, end, space, ts_presleep)
+
+def spans(plan):
+    return [(r.addr_begin, r.addr_end) for r in plan]
+
+def test_split_range_with_covered_and_overlapping_ranges():
+    plan, addr_map = plan_addr_range([regs(0, 300), regs(10, 20), regs(100, 260)])
+    assert spans(plan) == [(0, 125), (125, 250), (250, 300)]
+    assert addr_map == [[0, 1, 2], [0], [0, 1, 2]]
+
+def test_every_range_is_covered_by_its_mapped_chunks():
+    ranges = [regs(0, 300), regs(5, 130), regs(240, 260, ts_presleep=7), regs(299, 420), regs(500, 510)]
+    plan, addr_map = plan_addr_range(ranges, gap=4)
+    for r, chunks in zip(ranges, addr_map):
+        covered = [a for j in chunks for a in range(plan[j].addr_begin, plan[j].addr_end)]
+        assert set(range(r.addr_begin, r.addr_end)) <= set(covered)
+        for j in chunks:
+            assert plan[j].addr_begin < r.addr_end and plan[j].addr_end > r.addr_begin
+    assert all(r.addr_end - r.addr_begin <= MODBUS_MAX_REGS for r in plan)
+    assert [plan[j].ts_presleep for j in addr_map[2]] == [7, 7]
+
+def test_merge_within_gap_and_limit():
+    plan, addr_map = plan_addr_range([regs(0, 10), regs(12, 20), regs(200, 210)], gap=2)
+    assert spans(plan) == [(0, 20), (200, 210)]
+    assert addr_map == [[0], [0], [1]]
+
+def test_groups_by_type_and_space():
+    ranges = [regs(0, 10, space=2), regs(0, 10, space=1), AddrRange(AddrType.MODBUS_INPUT_BITS, 0, 3000)]
+    plan, addr_map = plan_addr_range(ranges)
+    assert [(r.addr_type, r.space, r.addr_begin, r.addr_end) for r in plan] == [
+        (AddrType.MODBUS_INPUT_BITS, 0, 0, 2000), (AddrType.MODBUS_INPUT_BITS, 0, 2000, 3000),
+        (AddrType.MODBUS_REGS, 1, 0, 10), (AddrType.MODBUS_REGS, 2, 0, 10)]
+    assert addr_map == [[3], [2], [0, 1]]
+
+class PlanDriver(DriverBase):
+    def __init__(self, ranges: list) -> None:
+        self.ranges = ranges
+
+    def defineAddrRange(self):
+        return self.ranges
+
+    def parseDeviceData(self, addr_space):
+        return None
+
+    def execCommand(self, cmd):
+        return DevRet(True, b"")
+
+@pytest.fixture
+def plan_driver():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "plan", PlanDriver([regs(0, 10), regs(12, 20)]))
+    yield
+    driverset.DRIVERS.unregister(DeviceType.UDD, "test", "plan")
+
+def addr_request(id: int, **params) -> bytes:
+    params.update({"type": 0, "producer": "test", "model": "plan"})
+    return json.dumps({"jsonrpc": "2.0", "id": id, "method": "defineAddrRange", "params": params}).encode()
+
+def test_addr_plan_etag_and_not_modified(plan_driver):
+    service = DriverService()
+    first = service.handle("/v1/addr", addr_request(1))
+    etag = first.headers["ETag"]
+    result = json.loads(first.body)
+    assert first.status == 200 and result["id"] == 1
+    assert [(r["addr_begin"], r["addr_end"]) for r in result["result"]["addr_plan"]] == [(0, 10), (12, 20)]
+    # 只有 id 随请求变化
+    second = service.handle("/v1/addr", addr_request(2))
+    assert second.headers["ETag"] == etag and json.loads(second.body) == dict(result, id=2)
+    for header in (etag, "*", '"other", ' + etag):
+        res = service.handle("/v1/addr", addr_request(3), if_none_match=header)
+        assert (res.status, res.body, res.headers["ETag"]) == (304, b"", etag)
+    assert service.handle("/v1/addr", addr_request(4), if_none_match='"stale"').status == 200
+
+def test_addr_plan_binary_and_explicit_gap(plan_driver):
+    service = DriverService()
+    etag = service.handle("/v1/addr", addr_request(1)).headers["ETag"]
+    res = service.handle("/v1/addr", addr_request(1), accept=binwire.CONTENT_TYPE)
+    assert res.headers["ETag"] == etag
+    assert binwire.loads(res.body)["result"]["addr_map"] == [[0], [1]]
+    # 指定 gap 时按请求重新规划, 不使用缓存
+    res = service.handle("/v1/addr", addr_request(1, gap=2), if_none_match=etag)
+    assert res.status == 200 and "ETag" not in res.headers
+    assert json.loads(res.body)["result"]["addr_map"] == [[0], [0]]
+
+def test_addr_plan_etag_changes_with_driver(plan_driver):
+    service = DriverService()
+    etag = service.handle("/v1/addr", addr_request(1)).headers["ETag"]
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "plan", PlanDriver([regs(0, 30)]))
+    res = service.handle("/v1/addr", addr_request(1), if_none_match=etag)
+    assert res.status == 200 and res.headers["ETag"] != etag
+
+def test_register_logs_failing_addr_plan(caplog):
+    broken = PlanDriver(None)
+    broken.defineAddrRange = lambda: 1 // 0
+    with caplog.at_level(logging.ERROR, "driver"):
+        driverset.DRIVERS.register(DeviceType.UDD, "test", "plan", broken)
+    try:
+        assert "ZeroDivisionError" in caplog.text
+        assert driverset.DRIVERS.ref(DeviceType.UDD, "test", "plan") is broken
+        with pytest.raises(ZeroDivisionError):
+            DriverService().handle("/v1/addr", addr_request(1))
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "plan")
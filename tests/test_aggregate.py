@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import array
+import random
+
+import pytest
+
+import aggregate
+from aggregate import aggregate_cells, aggregate_stack_cells, column_stats
+from devdata import DDOfCluster, DDOfStack
+from devfield import BatterySystemRuntime
+
+NAN = float("nan")
+
+@pytest.fixture(autouse=True, params=["numpy", "python"])
+def stats_impl(request, monkeypatch):
+    """ 安装 NumPy 时使用向量化统计, 否则为纯 Python, 两种都要测试 """
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(aggregate, "numpy", None)
+    return request.param
+
+def indicator(runtime: BatterySystemRuntime, metric: str) -> tuple:
+    ind = getattr(runtime, metric)
+    return (pytest.approx(ind.mass), pytest.approx(ind.avg), ind.min, ind.max, ind.min_id, ind.max_id)
+
+# 簇1: 第3个电芯电压无效; 簇2: 单个电芯
+CLUSTER_1 = {
+    "voltage": [3.3, 3.4, NAN],
+    "current": [10.0, 10.0, 10.0],
+    "temperature": [25.0, 30.0, 20.0],
+    "r": array.array("d", [0.001, 0.002, 0.001]),
+    "positive_ir": [500.0, 400.0, 600.0],
+}
+CLUSTER_2 = {
+    "voltage": [3.2],
+    "current": [10.0],
+    "temperature": [40.0],
+    "r": [0.002],
+    "positive_ir": [300.0],
+}
+
+def test_cluster_rules_skip_nan():
+    runtime = BatterySystemRuntime()
+    stats = aggregate_cells(runtime, CLUSTER_1)
+    assert stats["voltage"].count == 2
+    assert indicator(runtime, "voltage") == (6.7, 3.35, 3.3, 3.4, 1, 2)
+    assert indicator(runtime, "current") == (10.0, 10.0, 10.0, 10.0, 1, 1)
+    assert indicator(runtime, "temperature") == (25.0, 25.0, 20.0, 30.0, 3, 2)
+    # 相同的最值取第一个
+    assert indicator(runtime, "r") == (0.004, 0.004 / 3, 0.001, 0.002, 1, 2)
+    assert indicator(runtime, "positive_ir") == (400.0, 500.0, 400.0, 600.0, 2, 3)
+    # 未提供的指标不修改
+    assert indicator(runtime, "soc") == (0.0, 0.0, 0.0, 0.0, 0, 0)
+
+def test_cluster_ids_and_invalid_column():
+    runtime = BatterySystemRuntime()
+    runtime.soc.mass = 50.0
+    aggregate_cells(runtime, {"temperature": [25.0, 30.0, 20.0], "soc": [NAN, NAN, NAN]}, ids=[101, 102, 103])
+    assert (runtime.temperature.min_id, runtime.temperature.max_id) == (103, 102)
+    assert indicator(runtime, "soc") == (0.0, 0.0, 0.0, 0.0, 0, 0)
+
+def make_stack(*columns) -> DDOfStack:
+    stack = DDOfStack()
+    for _ in columns:
+        stack.cluster.append(DDOfCluster())
+    aggregate_stack_cells(stack, list(columns))
+    return stack
+
+def test_stack_rollup_rules():
+    stack = make_stack(CLUSTER_1, CLUSTER_2)
+    runtime = stack.runtime
+    # 簇1 有3个有效电芯, 簇2 有1个
+    assert indicator(runtime, "voltage") == ((6.7 + 3.2) / 2, (3.35 * 3 + 3.2) / 4, 3.2, 3.4, 2, 1)
+    assert indicator(runtime, "current")[:2] == (20.0, 10.0)
+    assert indicator(runtime, "temperature") == ((25.0 * 3 + 40.0) / 4, (25.0 * 3 + 40.0) / 4, 20.0, 40.0, 1, 2)
+    assert runtime.r.mass == pytest.approx(1.0 / (1.0 / 0.004 + 1.0 / 0.002))
+    assert indicator(runtime, "positive_ir")[0] == 300.0 and runtime.positive_ir.min_id == 2
+
+def test_stack_skips_empty_clusters():
+    stack = make_stack({}, CLUSTER_2)
+    assert indicator(stack.runtime, "voltage") == (3.2, 3.2, 3.2, 3.2, 2, 2)
+    assert indicator(make_stack({}).runtime, "voltage") == (0.0, 0.0, 0.0, 0.0, 0, 0)
+
+def test_numpy_stats_match_pure_python(stats_impl):
+    if stats_impl != "numpy":
+        pytest.skip("compares the NumPy path against column_stats")
+    numpy = aggregate.numpy
+    rng = random.Random(7)
+    # 取值范围小, 产生相同的最值
+    columns = [[rng.choice([NAN, 1.0, 2.0, 3.0, 4.0]) for _ in range(50)] for _ in range(20)]
+    columns += [[NAN] * 50, [2.0] * 50]
+    for column, got in zip(columns, aggregate.numpy_stats([numpy.array(c) for c in columns])):
+        expected = column_stats(column)
+        assert [getattr(got, f) for f in expected.__slots__] == [getattr(expected, f) for f in expected.__slots__]
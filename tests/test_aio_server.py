@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import json
+import random
+import time
+
+import pytest
+
+from aio_server import MAX_LINE, AioDriverServer
+import bench
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from service import DriverService
+
+def exchange(*requests: bytes) -> list:
+    """ 在一个连接上依次发送原始请求, 返回各响应的 (状态行, 响应体) """
+    async def main():
+        server = AioDriverServer(DriverService(), "127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            responses = []
+            for request in requests:
+                writer.write(request)
+                line = await asyncio.wait_for(reader.readline(), 5.0)
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                responses.append((line, await reader.readexactly(length)))
+            writer.close()
+            return responses
+        finally:
+            server.server.close()
+    return asyncio.run(main())
+
+def status_line(request: bytes) -> bytes:
+    return exchange(request)[0][0]
+
+def post(path: str, body) -> bytes:
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    return b"POST %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (path.encode(), len(data)) + data
+
+@pytest.mark.parametrize("request_bytes, status", [
+    (b"GET /v1/metrics HTTP/1.1\r\nX-Long: " + b"a" * MAX_LINE + b"\r\n\r\n", b"431"),
+    (b"GET /" + b"a" * MAX_LINE + b" HTTP/1.1\r\n\r\n", b"414"),
+    (b"GET /v1/metrics HTTP/1.1\r\nno-colon-here\r\n\r\n", b"400"),
+    (b"GET /v1/metrics HTTP/1.1\r\n: empty-name\r\n\r\n", b"400"),
+    (b"GET /v1/metrics HTTP/1.1\r\nHost: x\r\n\r\n", b"200"),
+], ids=["long-header", "long-request-line", "no-colon", "empty-name", "valid"])
+def test_malformed_header_lines_get_a_response(request_bytes, status):
+    assert status_line(request_bytes).split()[1] == status
+
+class SlowExecDriver(DriverBase):
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space):
+        return None
+
+    def execCommand(self, cmd):
+        time.sleep(0.05)
+        return DevRet(True, b"done:" + cmd.cmd.encode())
+
+@pytest.fixture
+def exec_driver():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "exec", SlowExecDriver())
+    yield
+    driverset.DRIVERS.unregister(DeviceType.UDD, "test", "exec")
+
+def exec_item(id: int, method: str = "execCommand") -> dict:
+    params = {"type": 0, "producer": "test", "model": "exec", "device_id": "dev", "cmd": "start", "args": []}
+    return {"jsonrpc": "2.0", "id": id, "method": method, "params": params}
+
+def test_sync_exec_keeps_sync_semantics(exec_driver):
+    # 批量请求中 method 为 JSON 转义形式, 解码后才能识别为指令
+    escaped = post("/v1/parse", json.dumps([exec_item(2)]).encode().replace(b'"execCommand"', b'"\\u0065xecCommand"'))
+    single, batch = exchange(post("/v1/exec", exec_item(1)), escaped)
+    for line, body in (single, batch):
+        assert line.split()[1] == b"200"
+    for result in (json.loads(single[1])["result"], json.loads(batch[1])[0]["result"]):
+        assert "job" not in result
+        assert base64.urlsafe_b64decode(result["cont"]) == b"done:start"
+
+class SlowParseDriver(SlowExecDriver):
+    def parseDeviceData(self, addr_space):
+        time.sleep(0.5)
+        return None
+
+def test_slow_parse_does_not_stall_other_connections():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "slow", SlowParseDriver())
+    params = {"type": 0, "producer": "test", "model": "slow", "segment": []}
+
+    async def main():
+        server = AioDriverServer(DriverService(), "127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            slow_reader, slow_writer = await asyncio.open_connection("127.0.0.1", port)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            # 事件循环被阻塞时 sleep 也会推迟, 从发送慢请求起计时
+            t0 = time.perf_counter()
+            slow_writer.write(post("/v1/parse", {"jsonrpc": "2.0", "id": 1, "method": "parseDeviceData", "params": params}))
+            await asyncio.sleep(0.05)
+            writer.write(b"GET /v1/metrics HTTP/1.1\r\n\r\n")
+            line = await asyncio.wait_for(reader.readline(), 5.0)
+            elapsed = time.perf_counter() - t0
+            assert (await asyncio.wait_for(slow_reader.readline(), 5.0)).split()[1] == b"200"
+            slow_writer.close()
+            writer.close()
+            return line, elapsed
+        finally:
+            server.server.close()
+    try:
+        line, elapsed = asyncio.run(main())
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "slow")
+    assert line.split()[1] == b"200"
+    assert elapsed < 0.4
+
+class StackDriver(SlowExecDriver):
+    def parseDeviceData(self, addr_space):
+        return bench.make_stack(random.Random(1))
+
+async def read_head(reader: asyncio.StreamReader) -> tuple:
+    line = await asyncio.wait_for(reader.readline(), 5.0)
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b""):
+            return line, headers
+        name, _, value = header.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+async def read_chunked(reader: asyncio.StreamReader) -> list:
+    chunks = []
+    while True:
+        size = int(await reader.readline(), 16)
+        chunk = await reader.readexactly(size + 2)
+        if size == 0:
+            return chunks
+        chunks.append(chunk[:-2])
+
+def test_stream_response_framing():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "stack", StackDriver())
+    request = {"jsonrpc": "2.0", "id": 1, "method": "parseDeviceData",
+               "params": {"type": 0, "producer": "test", "model": "stack", "segment": []}}
+    body = json.dumps(request).encode()
+
+    async def main():
+        server = AioDriverServer(DriverService(stream=True), "127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            # HTTP/1.1: 分块传输, 连接保持
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(post("/v1/parse", body))
+            line, headers = await read_head(reader)
+            chunks = await read_chunked(reader)
+            writer.write(b"GET /v1/metrics HTTP/1.1\r\n\r\n")
+            after, _ = await read_head(reader)
+            writer.close()
+            # HTTP/1.0: 以关闭连接结束响应体
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(post("/v1/parse", body).replace(b"HTTP/1.1", b"HTTP/1.0", 1))
+            line10, headers10 = await read_head(reader)
+            body10 = await asyncio.wait_for(reader.read(), 5.0)
+            writer.close()
+            return line, headers, chunks, after, line10, headers10, body10
+        finally:
+            server.server.close()
+    try:
+        line, headers, chunks, after, line10, headers10, body10 = asyncio.run(main())
+        expected = DriverService().handle("/v1/parse", body).body
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "stack")
+    assert line.split()[1] == b"200" and headers["transfer-encoding"] == "chunked"
+    assert len(chunks) > 1 and b"".join(chunks) == expected
+    assert after.split()[1] == b"200"
+    assert "transfer-encoding" not in headers10 and headers10["connection"] == "close"
+    assert body10 == expected
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+
+import pytest
+
+from addrspace import ModbusAddressSpace
+from alarm import AlarmPoint, AlarmTable
+from devdata import DDOfUserDefined
+from iface_class import JsonEncoderIfJsonEnable
+import serializer
+import segment
+from segment import Segment, SegmentSet
+
+@pytest.fixture(autouse=True, params=["numpy", "array"])
+def block_type(request, monkeypatch):
+    """ 告警字由 addr_space.array 读取: 安装 NumPy 时为 ndarray, 否则为 array.array, 两种都要测试 """
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(segment, "numpy", None)
+    return request.param
+
+def space(word: int, device_id: str = "") -> ModbusAddressSpace:
+    segset = SegmentSet()
+    segset.add(Segment(100, 101, 16, 1, struct.pack(">H", word)))
+    addr_space = ModbusAddressSpace(segset, 1)
+    addr_space.device_id = device_id
+    return addr_space
+
+def make_table() -> AlarmTable:
+    return AlarmTable([AlarmPoint(100, 0, 1, "AI-A", "a"), AlarmPoint(100, 3, 2, "AI-B", "b")])
+
+def test_untracked_dd_json_is_unchanged():
+    table = make_table()
+    dd = DDOfUserDefined()
+    table.evaluate(space(0x0009), dd)
+    assert [a.alarm_id for a in dd.alarm] == [1, 2]
+    assert not hasattr(dd, "alarm_raised")
+    plain = json.loads(serializer.dumps(dd))
+    assert "alarm_raised" not in plain and "alarm_cleared" not in plain
+    assert serializer.dumps(dd) == json.dumps(dd, cls=JsonEncoderIfJsonEnable).encode("utf-8")
+
+def test_tracked_device_reports_changes():
+    table = make_table()
+    dd = DDOfUserDefined()
+    table.evaluate(space(0x0001, "dev"), dd)
+    assert [a.alarm_id for a in dd.alarm_raised] == [1] and dd.alarm_cleared == []
+
+    dd = DDOfUserDefined()
+    table.evaluate(space(0x0008, "dev"), dd)
+    assert [a.alarm_id for a in dd.alarm_raised] == [2]
+    assert [a.alarm_id for a in dd.alarm_cleared] == [1]
+    assert json.loads(serializer.dumps(dd))["alarm_cleared"][0]["alarm_id"] == 1
+
+    dd.reset()
+    table.evaluate(space(0x0008, "dev"), dd)
+    assert dd.alarm_raised == [] and dd.alarm_cleared == []
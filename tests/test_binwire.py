@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+import pytest
+
+import binwire
+from devdata import DDOfUserDefined
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from service import DriverService
+
+VALUES = [
+    None, True, False, 0, -1, 0x7FFFFFFF, -0x80000000, 0x80000000, -2 ** 63, 1.5, float("inf"),
+    "", "电池簇", b"", b"\x00\xff", [], [1, [2, "x"], {"k": None}], {}, {"a": {"b": [b"y", -3.25]}, "": 0},
+]
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_round_trip(value):
+    assert binwire.loads(binwire.dumps(value)) == value
+
+def test_segment_enum_and_object_encoding():
+    dd = DDOfUserDefined()
+    dd.number["v"] = 1.0
+    frame = binwire.dumps({"seg": binwire.Segment(10, 12, 16, 3, b"\x01\x02\x03\x04"), "type": DeviceType.PCS, "dd": dd})
+    value = binwire.loads(frame)
+    assert value["seg"] == {"addr_begin": 10, "addr_end": 12, "width": 16, "space": 3, "data": b"\x01\x02\x03\x04"}
+    assert value["type"] == DeviceType.PCS.value
+    assert value["dd"]["number"] == {"v": 1.0}
+
+@pytest.mark.parametrize("value", [
+    "abc", b"abc", [1, 2], {"key": "v"}, binwire.Segment(0, 2, 16, 1, b"abcd"), 2 ** 40, 1.0,
+], ids=["s", "y", "l", "m", "S", "q", "d"])
+def test_truncated_frames_rejected(value):
+    frame = binwire.dumps(value)
+    for n in range(len(frame)):
+        with pytest.raises(ValueError):
+            binwire.loads(frame[:n])
+
+@pytest.mark.parametrize("tag", [b"s", b"y", b"l", b"m"])
+def test_length_beyond_frame_rejected(tag):
+    # 声明的长度远大于实际数据
+    frame = binwire.MAGIC + bytes([binwire.VERSION]) + tag + struct.pack(">I", 0xFFFFFFFF) + b"ab"
+    with pytest.raises(ValueError, match="truncated"):
+        binwire.loads(frame)
+
+def test_bad_frames_rejected():
+    frame = binwire.dumps(1)
+    for bad in (b"XEB" + frame[3:], frame[:3] + b"\x09" + frame[4:], frame + b"N", frame[:4] + b"?"):
+        with pytest.raises(ValueError):
+            binwire.loads(bad)
+    with pytest.raises(TypeError):
+        binwire.dumps(object())
+
+class EchoDriver(DriverBase):
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space):
+        dd = DDOfUserDefined()
+        dd.number["v"] = float(addr_space.u16(0))
+        return dd
+
+    def execCommand(self, cmd):
+        return DevRet(True, b"".join(cmd.args))
+
+def test_service_binary_request_and_response():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "binwire", EchoDriver())
+    params = {"type": 0, "producer": "test", "model": "binwire"}
+    parse = {"jsonrpc": "2.0", "id": 1, "method": "parseDeviceData",
+             "params": dict(params, segment=[binwire.Segment(0, 1, 16, 1, b"\x01\x02")])}
+    command = {"jsonrpc": "2.0", "id": 2, "method": "execCommand", "params": dict(params, cmd="echo", args=[b"\x00\x01", b"\xff"])}
+    try:
+        res = DriverService().handle("/v1/parse", binwire.dumps([parse, command]), binwire.CONTENT_TYPE)
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "binwire")
+    assert res.content_type == binwire.CONTENT_TYPE
+    first, second = binwire.loads(res.body)
+    assert first["result"]["dd"]["number"] == {"v": 258.0}
+    assert second["result"]["cont"] == b"\x00\x01\xff"
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import json
+
+import pytest
+
+from devdata import DDOfUserDefined
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from service import DriverService
+
+class Space:
+    def __init__(self, device_id: str) -> None:
+        self.device_id = device_id
+
+class ReuseDriver(DriverBase):
+    DD_CACHE_SIZE = 2
+
+    def __init__(self) -> None:
+        # 每次解析返回的实例
+        self.parsed = []
+
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space):
+        dd = self.reuseDD(addr_space, DDOfUserDefined)
+        dd.number["n"] = float(len(self.parsed))
+        self.parsed.append(dd)
+        return dd
+
+    def execCommand(self, cmd):
+        return DevRet(True, b"")
+
+def test_only_released_dd_is_reused_and_reset():
+    d = ReuseDriver()
+    a = d.parseDeviceData(Space("a"))
+    a.status["extra"] = True
+    b = d.parseDeviceData(Space("a"))
+    assert b is not a and a.number == {"n": 0.0} and a.status == {"extra": True}
+    d.releaseDD(a)
+    c = d.parseDeviceData(Space("a"))
+    assert c is a and c.status == {} and c.number == {"n": 2.0}
+
+def test_release_ignores_foreign_and_untracked_instances():
+    d = ReuseDriver()
+    d.releaseDD(DDOfUserDefined())
+    d.releaseDD(None)
+    dd = d.parseDeviceData(Space(""))
+    d.releaseDD(dd)
+    assert d.parseDeviceData(Space("")) is not dd
+
+def test_cache_keeps_most_recently_released_devices():
+    d = ReuseDriver()
+    for device_id in ("a", "b", "c"):
+        d.releaseDD(d.parseDeviceData(Space(device_id)))
+    assert [k[0] for k in d.dd_cache.items] == ["b", "c"]
+
+def test_reset_keeps_objects_without_default_constructor():
+    r = DevRet(True, b"x")
+    r.reset()
+    assert (r.succ, r.cont) == (True, b"x")
+
+@pytest.fixture
+def driver():
+    d = ReuseDriver()
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "reuse", d)
+    yield d
+    driverset.DRIVERS.unregister(DeviceType.UDD, "test", "reuse")
+
+def parse_request(id: int, device_id: str) -> dict:
+    params = {"type": 0, "producer": "test", "model": "reuse", "segment": [], "device_id": device_id}
+    return {"jsonrpc": "2.0", "id": id, "method": "parseDeviceData", "params": params}
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_service_releases_dd_after_encoding(driver, stream):
+    service = DriverService(stream=stream)
+    for i in range(3):
+        res = service.handle("/v1/parse", json.dumps(parse_request(i, "dev")).encode())
+        body = b"".join(res.chunks) if stream else res.body
+        assert json.loads(body)["result"]["dd"]["number"] == {"n": float(i)}
+    assert driver.parsed[0] is driver.parsed[1] is driver.parsed[2]
+
+def test_stream_not_consumed_keeps_dd_leased(driver):
+    service = DriverService(stream=True)
+    first = service.handle("/v1/parse", json.dumps(parse_request(0, "dev")).encode())
+    service.handle("/v1/parse", json.dumps(parse_request(1, "dev")).encode())
+    assert driver.parsed[0] is not driver.parsed[1]
+    assert json.loads(b"".join(first.chunks))["result"]["dd"]["number"] == {"n": 0.0}
+
+def test_batch_items_in_executor_are_released(driver):
+    service = DriverService(concurrent.futures.ThreadPoolExecutor(4))
+    body = json.dumps([parse_request(i, "dev-%d" % i) for i in range(2)]).encode()
+    for _ in range(2):
+        service.handle("/v1/parse", body)
+    assert len(driver.parsed) == 4
+    assert {id(dd) for dd in driver.parsed} == {id(dd) for dd in driver.parsed[:2]}
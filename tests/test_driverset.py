@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+from devfield import DeviceType
+from driverset import DriverSet
+
+SOURCE = '''
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+
+class Helper:
+    DEVICE_TYPE = DeviceType.PCS
+
+class %(cls)s(DriverBase):
+    DEVICE_TYPE: DeviceType = DeviceType.%(type)s
+    PRODUCER: str = "test"
+    MODEL = "%(model)s"
+    VERSION = %(version)d
+
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space):
+        return None
+
+    def execCommand(self, cmd):
+        return DevRet(True, b"")
+'''
+
+@pytest.fixture
+def drivers(tmp_path):
+    """ 临时驱动目录及其 DriverSet, 结束时移除导入的驱动模块 """
+    yield tmp_path, DriverSet()
+    for path in tmp_path.glob("driver_*.py"):
+        sys.modules.pop(path.stem, None)
+
+def write_driver(directory, name: str, model: str, version: int = 1, type: str = "PCS", cls: str = "Driver") -> str:
+    path = directory / ("driver_%s.py" % name)
+    path.write_text(SOURCE % {"cls": cls, "type": type, "model": model, "version": version}, encoding="utf-8")
+    # 保证修改时间变化
+    mtime = path.stat().st_mtime + version
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def test_discover_reads_metadata_without_import(drivers):
+    directory, ds = drivers
+    write_driver(directory, "t_lazy", "lazy")
+    write_driver(directory, "t_unknown_type", "bad", type="NO_SUCH_TYPE")
+    (directory / "driver_t_plain.py").write_text("X = 1\n", encoding="utf-8")
+    (directory / "helper_t.py").write_text(SOURCE % {"cls": "Driver", "type": "PCS", "model": "skip", "version": 1}, encoding="utf-8")
+    ds.discover(str(directory))
+    assert sorted(e.model for e in ds.lazy.values()) == ["lazy"]
+    assert "driver_t_lazy" not in sys.modules
+    assert ds.contains(DeviceType.PCS, "test", "lazy")
+    assert not ds.contains(DeviceType.PCS, "test", "bad")
+
+    d = ds.ref(DeviceType.PCS, "test", "lazy")
+    assert type(d).__name__ == "Driver" and d.VERSION == 1
+    assert "driver_t_lazy" in sys.modules and not ds.lazy
+    assert ds.ref(DeviceType.PCS, "test", "lazy") is d
+    assert ds.ref_addr_plan(DeviceType.PCS, "test", "lazy").result["addr_plan"] == []
+
+def test_registered_driver_not_replaced_by_discovery(drivers):
+    directory, ds = drivers
+    write_driver(directory, "t_registered", "registered")
+    registered = object()
+    ds.driver[DriverSet.gen_driver_index_key(DeviceType.PCS, "test", "registered")] = registered
+    ds.discover(str(directory))
+    assert not ds.lazy
+    assert ds.ref(DeviceType.PCS, "test", "registered") is registered
+
+def test_reload_changed_modified_added_and_deleted(drivers):
+    directory, ds = drivers
+    changed = write_driver(directory, "t_changed", "changed")
+    deleted = write_driver(directory, "t_deleted", "deleted")
+    ds.discover(str(directory))
+    old = ds.ref(DeviceType.PCS, "test", "changed")
+    ds.ref(DeviceType.PCS, "test", "deleted")
+    assert ds.reload_changed() == []
+
+    write_driver(directory, "t_changed", "changed", version=2, cls="Renamed")
+    os.remove(deleted)
+    added = write_driver(directory, "t_added", "added")
+    assert sorted(ds.reload_changed()) == sorted([changed, deleted, added])
+    # 修改的模块在下次使用时重新导入
+    assert "driver_t_changed" not in sys.modules
+    new = ds.ref(DeviceType.PCS, "test", "changed")
+    assert new is not old and type(new).__name__ == "Renamed" and new.VERSION == 2
+    assert not ds.contains(DeviceType.PCS, "test", "deleted")
+    assert ds.ref(DeviceType.PCS, "test", "deleted") is None
+    assert ds.ref(DeviceType.PCS, "test", "added").VERSION == 1
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from addr import AddrType
+from aio_server import AioDriverServer
+from devdata import DDOfUserDefined
+from devfield import DeviceType
+import driverset
+import emulator
+from pointtable import Point, PointTable, PointTableDriver
+from service import DriverService
+
+class EmuTableDriver(PointTableDriver):
+    POINT_TABLE = PointTable(DDOfUserDefined, [Point("number.r%d" % a, a) for a in range(16)])
+
+def run_delta(churn: float) -> dict:
+    async def main():
+        server = AioDriverServer(DriverService(), "127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            return await emulator.run_http("http://127.0.0.1:%d" % port, DeviceType.UDD, "test", "emulator",
+                                           devices, 200.0, 0.1, 1, churn, True, 5.0)
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "emulator", EmuTableDriver())
+    try:
+        rules = [emulator.Rule(AddrType.MODBUS_REGS, 0, 16, "walk")]
+        devices = emulator.make_devices(DeviceType.UDD, "test", "emulator", 2, rules)
+        return asyncio.run(main())
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "emulator")
+
+def test_delta_mode_sends_seq_after_first_full_response():
+    stats = run_delta(0.5)
+    assert stats["sent"] == stats["ok"] == 20 and stats["errors"] == 0
+    assert stats["full"] == 2
+    assert stats["delta"] + stats["unchanged"] == 18 and stats["delta"] > 0
+
+def test_unchanged_registers_are_not_parsed_again():
+    stats = run_delta(0.0)
+    assert stats["full"] == 2 and stats["unchanged"] == 18
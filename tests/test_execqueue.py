@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from devfield import DevRet
+from execqueue import ExecQueue
+
+def blocker():
+    """ 返回 (阻塞直到 event 置位的指令, event) """
+    event = threading.Event()
+
+    def func():
+        event.wait(5.0)
+        return DevRet(True, b"")
+    return func, event
+
+def test_close_expires_queued_jobs_and_wakes_waiters():
+    queue = ExecQueue(workers=1)
+    func, event = blocker()
+    running = queue.submit("dev", "first", func)
+    queued = [queue.submit("dev", "cmd-%d" % i, lambda: DevRet(True, b"")) for i in range(3)]
+    woken = []
+    waiters = [threading.Thread(target=lambda j=j: woken.append(queue.wait(j.id, 5.0).state)) for j in queued]
+    for t in waiters:
+        t.start()
+    closer = threading.Thread(target=queue.close)
+    closer.start()
+    for t in waiters:
+        t.join(1.0)
+    assert woken == ["expired"] * 3
+    event.set()
+    closer.join(5.0)
+    assert running.state == "done"
+    assert not queue.pending and not queue.ready
+
+def test_jobs_of_one_device_run_in_order_and_coalesce():
+    queue = ExecQueue(workers=4)
+    order = []
+    func, event = blocker()
+    queue.submit("dev", "hold", func)
+    jobs = [queue.submit("dev", "set", lambda i=i: order.append(i) or DevRet(True, b""), coalesce="set") for i in range(3)]
+    jobs.append(queue.submit("dev", "start", lambda: order.append("start") or DevRet(True, b"")))
+    event.set()
+    assert queue.wait(jobs[-1].id, 5.0).state == "done"
+    queue.close()
+    assert order == [2, "start"]
+    assert [j.state for j in jobs[:2]] == ["superseded"] * 2
+    assert jobs[0].superseded_by == jobs[1].id
+
+def test_evict_keeps_unfinished_and_drops_earliest_finished():
+    queue = ExecQueue(workers=2, max_jobs=3)
+    func, event = blocker()
+    first = queue.submit("a", "hold", func)
+    done = [queue.submit("b", "cmd", lambda: DevRet(True, b"")) for _ in range(4)]
+    for job in done:
+        assert job.event.wait(5.0)
+    # 结束顺序: done[0..3]; 未结束的 first 不被删除
+    last = queue.submit("b", "cmd", lambda: DevRet(True, b""))
+    assert list(queue.jobs) == [first.id, done[3].id, last.id]
+    event.set()
+    queue.close()
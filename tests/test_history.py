@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import struct
+
+import pytest
+
+from devdata import DDOfCluster, DDOfUserDefined
+from devfield import AlarmInfo, BatteryRuntime, DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from history import HistoryStore, Matcher, leaves
+from service import DriverService
+
+def dd(**number) -> DDOfUserDefined:
+    d = DDOfUserDefined()
+    d.number.update(number)
+    return d
+
+def test_leaves_paths():
+    cluster = DDOfCluster()
+    cluster.battery.append(BatteryRuntime())
+    cluster.battery[0].voltage = 3.3
+    cluster.alarm.append(AlarmInfo())
+    cluster.number["list"] = [1, 2.5]
+    cluster.status["on"] = True
+    out = {}
+    leaves(cluster, "", out)
+    assert out["battery.0.voltage"] == 3.3
+    assert out["runtime.voltage.mass"] == 0.0
+    assert (out["number.list.0"], out["number.list.1"], out["status.on"]) == (1.0, 2.5, 1.0)
+    assert not any(k.startswith("alarm") for k in out)
+
+def test_raw_ring_wraps_and_filters():
+    store = HistoryStore(raw=3, windows=(), patterns=["number.*"])
+    for t in range(5):
+        assert store.record("dev", dd(v=float(t), x=float("nan") if t == 3 else 1.0), t)
+    # 早于最近一次采样的样本被丢弃
+    assert not store.record("dev", dd(v=99.0), 3)
+    result = store.query("dev")
+    assert result["time"] == [2.0, 3.0, 4.0]
+    assert result["fields"] == {"number.v": [2.0, 3.0, 4.0], "number.x": [1.0, None, 1.0]}
+    assert store.query("dev", ["*.v"], start=3, end=4)["fields"] == {"number.v": [3.0]}
+    assert store.query("other") is None
+
+def test_query_window_includes_open_bucket():
+    store = HistoryStore(raw=0, windows=[(60, 10)])
+    for t, v in ((0, 1.0), (30, 3.0), (60, 10.0), (90, 20.0), (100, 30.0)):
+        store.record("dev", dd(v=v), t)
+    # [60, 120) 尚未写入降采样环
+    result = store.query("dev", ["number.v"], window=60)
+    assert (result["source"], result["time"]) == (60, [0.0, 60.0])
+    assert result["fields"]["number.v"] == {"min": [1.0, 10.0], "max": [3.0, 30.0], "avg": [2.0, 20.0]}
+    # 重新聚合: 已写入的时间窗和正在累计的时间窗合并
+    result = store.query("dev", ["number.v"], window=120)
+    assert (result["source"], result["time"]) == (60, [0.0])
+    assert result["fields"]["number.v"] == {"min": [1.0], "max": [30.0], "avg": [pytest.approx(12.8)]}
+    assert store.query("dev", ["number.v"], start=0, end=60, window=60)["time"] == [0.0]
+    with pytest.raises(AssertionError):
+        store.query("dev", window=90)
+    with pytest.raises(AssertionError):
+        store.query("dev")
+
+def test_query_window_uses_largest_divisor_or_raw():
+    store = HistoryStore(raw=100, windows=[(60, 100), (300, 100)])
+    for t in range(0, 1200, 20):
+        store.record("dev", dd(v=float(t)), t)
+    assert store.query("dev", window=600)["source"] == 300
+    assert store.query("dev", window=120)["source"] == 60
+    result = store.query("dev", ["number.v"], window=90)
+    assert result["source"] == 0 and result["time"][:3] == [0.0, 90.0, 180.0]
+    assert result["fields"]["number.v"]["avg"][:2] == [pytest.approx(40.0), pytest.approx(130.0)]
+    # 各来源得到的结果一致
+    by_600 = store.query("dev", ["number.v"], window=600)["fields"]["number.v"]
+    raw = HistoryStore(raw=100, windows=())
+    for t in range(0, 1200, 20):
+        raw.record("dev", dd(v=float(t)), t)
+    assert raw.get("dev").query_window(Matcher(["number.v"]), 0, 1200, 600)["fields"]["number.v"] == by_600
+
+def test_field_and_device_limits():
+    store = HistoryStore(raw=2, windows=(), max_fields=6, max_devices=2)
+    store.record("a", dd(v=1.0), 0)
+    # devstatus 的4个字段和 number.v 之后只能再增加1个字段
+    store.record("a", dd(v=2.0, w=1.0, x=1.0), 1)
+    assert len(store.get("a").fields) == 6
+    store.record("b", dd(), 0)
+    store.record("c", dd(), 0)
+    assert list(store.devices) == ["b", "c"]
+
+class HistoryDriver(DriverBase):
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space):
+        return dd(v=float(addr_space.u16(0)))
+
+    def execCommand(self, cmd):
+        return DevRet(True, b"")
+
+def test_service_records_and_queries():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "history", HistoryDriver())
+    service = DriverService(history=HistoryStore(raw=10, windows=[(60, 10)]))
+    params = {"type": 0, "producer": "test", "model": "history", "device_id": "d1"}
+    try:
+        for t, v in ((0, 1), (30, 3)):
+            segment = {"addr_begin": 0, "addr_end": 1, "width": 16, "space": 1,
+                       "data": base64.urlsafe_b64encode(struct.pack(">H", v)).decode()}
+            request = {"jsonrpc": "2.0", "id": 1, "method": "parseDeviceData", "params": dict(params, segment=[segment], time=t)}
+            service.handle("/v1/parse", json.dumps(request).encode())
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.UDD, "test", "history")
+    res = service.handle_get("/v1/history?type=0&producer=test&model=history&device_id=d1&field=number.v&window=60")
+    assert json.loads(res.body)["fields"]["number.v"] == {"min": [1.0], "max": [3.0], "avg": [2.0]}
+    summary = json.loads(service.handle_get("/v1/history").body)
+    assert [d["device"] for d in summary["devices"]] == ["0|test|history|d1"]
+    assert service.handle_get("/v1/history?device=none").status == 404
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import struct
+
+import pytest
+
+from addr import AddrType
+from devdata import DDOfUserDefined
+from devfield import DeviceType
+import driverset
+from modbus_tcp import AcquisitionEngine, Device, ModbusSimulator
+from pointtable import Point, PointTable, PointTableDriver
+
+class SimTableDriver(PointTableDriver):
+    POINT_TABLE = PointTable(DDOfUserDefined, [
+        Point("number.voltage", 0, "u16", scale=0.1),
+        Point("number.current", 1, "i16", scale=0.01),
+        Point("number.power", 2, "f32"),
+        Point("number.energy", 200, "u32"),
+        Point("status.run", 3, addr_type=AddrType.MODBUS_BITS),
+    ])
+
+@pytest.fixture
+def driver():
+    driverset.DRIVERS.register(DeviceType.UDD, "test", "modbus", SimTableDriver())
+    yield
+    driverset.DRIVERS.unregister(DeviceType.UDD, "test", "modbus")
+
+def run(unit: int, timeout: float = 1.0):
+    async def main():
+        sim = ModbusSimulator()
+        u = sim.unit(1)
+        u.set_registers(AddrType.MODBUS_REGS, 0, struct.pack(">HhfI", 2305, -150, 1.5, 0))
+        u.set_registers(AddrType.MODBUS_REGS, 200, struct.pack(">I", 123456789))
+        u.set_bit(AddrType.MODBUS_BITS, 3, True)
+        await sim.start()
+        engine = AcquisitionEngine(timeout=timeout)
+        try:
+            return await engine.poll(Device(sim.host, sim.port, unit, DeviceType.UDD, "test", "modbus"))
+        finally:
+            engine.close()
+            sim.close()
+            await asyncio.wait_for(sim.wait_closed(), 1.0)
+            assert not sim.writers
+    return asyncio.run(main())
+
+def test_poll_decodes_simulated_registers(driver):
+    dd = run(1)
+    assert dd.number == pytest.approx({"voltage": 230.5, "current": -1.5, "power": 1.5, "energy": 123456789})
+    assert dd.status == {"run": 1}
+
+def test_missing_unit_times_out(driver):
+    with pytest.raises(asyncio.TimeoutError):
+        run(2, timeout=0.2)
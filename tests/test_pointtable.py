@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import random
+import struct
+
+import pytest
+
+from addr import MODBUS_MAX_REGS, plan_addr_range
+from addrspace import ModbusAddressSpace
+from devdata import DDOfUserDefined
+from pointtable import Point, PointTable, RangePlan
+from segment import ByteOrder, Segment, SegmentSet
+
+def make_table() -> PointTable:
+    """ 200 个连续 u16 测点, 124 处的 u32 跨越 125 寄存器边界, 另有 CDAB 和位测点 """
+    points = [Point("number.r%d" % a, a, "u16", scale=0.1) for a in range(200) if a not in (124, 125)]
+    points.append(Point("number.x124", 124, "u32"))
+    points.append(Point("number.c150", 150, "f32", ByteOrder.CDAB))
+    points.append(Point("status.b3", 3, bit=3))
+    return PointTable(DDOfUserDefined, points)
+
+def read(table: PointTable, data: bytes) -> ModbusAddressSpace:
+    """ 按 plan_addr_range 的请求读取, 每个请求一个数据段 """
+    plan, _ = plan_addr_range(table.addr_ranges())
+    segset = SegmentSet()
+    for r in plan:
+        segset.add(Segment(r.addr_begin, r.addr_end, 16, 1, data[r.addr_begin * 2:r.addr_end * 2]))
+    return ModbusAddressSpace(segset, 1)
+
+def test_ranges_split_at_point_boundary_within_read_limit():
+    table = make_table()
+    ranges = table.addr_ranges()
+    assert [(r.addr_begin, r.addr_end) for r in ranges] == [(0, 124), (124, 200)]
+    assert all(r.addr_end - r.addr_begin <= MODBUS_MAX_REGS for r in ranges)
+    plan, addr_map = plan_addr_range(ranges)
+    assert [(r.addr_begin, r.addr_end) for r in plan] == [(0, 124), (124, 200)]
+    assert addr_map == [[0], [1]]
+
+def test_fast_path_matches_parse_points(monkeypatch):
+    table = make_table()
+    rnd = random.Random(7)
+    data = struct.pack(">200H", *[rnd.randrange(0x10000) for _ in range(200)])
+    addr_space = read(table, data)
+
+    expected = DDOfUserDefined()
+    for plan in table.compile():
+        plan.parse_points(addr_space, expected)
+
+    def fail(self, addr_space, dd):
+        raise AssertionError("fallback to parse_points: %s" % self.addr_range.addr_begin)
+    monkeypatch.setattr(RangePlan, "parse_points", fail)
+    dd = table.parse(addr_space)
+    assert dd.number == pytest.approx(expected.number)
+    assert dd.status == expected.status
+    assert dd.number["x124"] == struct.unpack_from(">I", data, 248)[0]
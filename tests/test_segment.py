@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+import pytest
+
+from addrspace import ModbusAddressSpace
+import segment
+from segment import DTYPE_FORMAT, ByteOrder, Segment, SegmentSet
+
+def regs(begin: int, *values: int, space: int = 1) -> Segment:
+    return Segment(begin, begin + len(values), 16, space, struct.pack(">%dH" % len(values), *values))
+
+def read(segset: SegmentSet, addr: int, space: int = 1) -> int:
+    return segset.ref(addr, space).u16be(addr)
+
+def test_overlapping_segments_first_wins():
+    segset = SegmentSet()
+    segset.add(regs(10, 1, 1, 1, 1))
+    # 后加入的段只填补 [6, 10) 和 [14, 16)
+    segset.add(regs(6, *[2] * 10))
+    segset.add(regs(12, 3))
+    assert [read(segset, a) for a in range(5, 17)] == [0, 2, 2, 2, 2, 1, 1, 1, 1, 2, 2, 0]
+
+def test_segment_inside_gap_between_existing_segments():
+    segset = SegmentSet()
+    segset.add(regs(0, 1, 1))
+    segset.add(regs(10, 3, 3))
+    segset.add(regs(1, *[2] * 10))
+    assert [read(segset, a) for a in range(0, 13)] == [1, 1] + [2] * 8 + [3, 3, 0]
+    begins, spans = segset.index[1]
+    assert begins == sorted(begins) and [b for b, _, _ in spans] == begins
+
+def test_lookup_by_space_and_holes():
+    segset = SegmentSet()
+    segset.add(regs(0, 7, space=1))
+    segset.add(regs(0, 8, space=2))
+    segset.add(regs(100, 9, space=1))
+    assert (read(segset, 0, 1), read(segset, 0, 2), read(segset, 100, 1)) == (7, 8, 9)
+    assert segset.ref(50, 1) is segset.null_segment
+    assert segset.ref(0, 3) is segset.null_segment
+    assert read(segset, 100, 2) == 0
+
+def test_sequential_reads_after_add():
+    segset = SegmentSet()
+    segset.add(regs(0, 1, 1, 1, 1))
+    assert read(segset, 2) == 1
+    segset.add(regs(4, 2))
+    assert read(segset, 4) == 2 and read(segset, 3) == 1
+
+VALUES = {"u16": 0xA1B2, "i16": -2, "u32": 0xA1B2C3D4, "i32": -123456789, "u64": 0xA1B2C3D4E5F60718,
+          "i64": -1234567890123, "f32": -1.5, "f64": 1234.5678}
+
+def arrange(big: bytes, order: ByteOrder) -> bytes:
+    """ 大端字节按字节序重排 """
+    words = [big[i:i + 2] for i in range(0, len(big), 2)]
+    if order == ByteOrder.CDAB:
+        words = words[::-1]
+    elif order == ByteOrder.BADC:
+        words = [w[::-1] for w in words]
+    elif order == ByteOrder.DCBA:
+        words = [w[::-1] for w in words[::-1]]
+    return b"".join(words)
+
+@pytest.mark.parametrize("order", list(ByteOrder), ids=lambda o: o.name)
+@pytest.mark.parametrize("dtype", list(DTYPE_FORMAT))
+def test_decoder_matrix(dtype, order):
+    big = struct.pack(">" + DTYPE_FORMAT[dtype], VALUES[dtype])
+    data = b"\x55\x55" + arrange(big, order)
+    seg = Segment(100, 100 + len(data) // 2, 16, 1, data)
+    assert seg.value(101, dtype, order) == VALUES[dtype]
+    # 数据不足或越界时读值为0
+    assert seg.value(102, dtype, order) == 0
+    assert seg.value(99, dtype, order) == 0
+
+def test_string_byte_order():
+    seg = Segment(0, 3, 16, 1, b"ABCD\x00 ")
+    assert seg.string(0, 3) == "ABCD"
+    assert seg.string(0, 3, ByteOrder.BADC) == "BADC"
+    assert seg.string(1, 3) == ""
+
+@pytest.fixture(params=["numpy", "array"])
+def block_type(request, monkeypatch):
+    """ 安装 NumPy 时批量读取返回 ndarray, 否则为 array.array, 两种都要测试 """
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(segment, "numpy", None)
+    return request.param
+
+def space(*segments: Segment) -> ModbusAddressSpace:
+    segset = SegmentSet()
+    for seg in segments:
+        segset.add(seg)
+    return ModbusAddressSpace(segset, 1)
+
+def test_array_contiguous_and_out_of_range(block_type):
+    addr_space = space(regs(10, 1, 2, 3, 4))
+    assert list(addr_space.array(10, 4)) == [1, 2, 3, 4]
+    # 超出段的部分为0
+    assert list(addr_space.array(12, 4)) == [3, 4, 0, 0]
+    assert list(addr_space.array(50, 2)) == [0, 0]
+
+def test_array_stride_and_byte_order(block_type):
+    # 每个电芯3个寄存器: f32 电压 (CDAB) + i16 温度
+    cells = [(3.25, -5), (3.5, 20), (-1.0, 31)]
+    data = b"".join(arrange(struct.pack(">f", v), ByteOrder.CDAB) + struct.pack(">h", t) for v, t in cells)
+    addr_space = space(Segment(0, 9, 16, 1, data))
+    assert list(addr_space.array(0, 3, "f32", ByteOrder.CDAB, stride=3)) == [v for v, _ in cells]
+    assert list(addr_space.array(2, 3, "i16", stride=3)) == [t for _, t in cells]
+    with pytest.raises(RuntimeError):
+        addr_space.array(0, 3, "f32", stride=1)
+
+def test_array_across_segments_and_scale(block_type):
+    addr_space = space(regs(0, 10, 20), regs(2, 30, 40))
+    assert list(addr_space.array(0, 4)) == [10, 20, 30, 40]
+    assert list(addr_space.array(1, 3, scale=0.1, offset=1.0)) == pytest.approx([3.0, 4.0, 5.0])
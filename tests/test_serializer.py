@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+
+import pytest
+
+import bench
+import serializer
+from devdata import DDOfInverter
+from devfield import AlarmInfo, BatteryRuntime, DevRet
+from iface_class import JsonEncoderIfJsonEnable
+
+def legacy(o) -> bytes:
+    return json.dumps(o, cls=JsonEncoderIfJsonEnable).encode("utf-8")
+
+@pytest.mark.parametrize("make", [bench.make_ems, bench.make_stack])
+def test_parity_with_legacy_encoder(make):
+    dd = make(random.Random(1))
+    assert serializer.dumps(dd) == legacy(dd)
+    response = {"version": 1, "id": 7, "result": {"dd": dd}}
+    assert serializer.dumps(response) == legacy(response)
+    assert b"".join(serializer.iterencode(response, chunk_size=4096)) == serializer.dumps(response)
+
+def test_special_values_and_fallbacks():
+    dd = DDOfInverter()
+    dd.number.update({"nan": float("nan"), "inf": float("inf"), "ninf": float("-inf"), 3: 1.5, 2.5: 1, True: None})
+    dd.raw["text"] = "é\n\"x "
+    dd.temperature = 41.5
+    # 字段类型与默认实例不同
+    dd.devstatus = 5
+    dd.work_mode = "manual"
+    dd.alarm.append(AlarmInfo())
+    cell = BatteryRuntime()
+    cell.voltage = 3
+    cell.soc = None
+    cell.r = [1.0, 2]
+    dd.extra = cell
+    assert serializer.dumps(dd) == legacy(dd)
+    assert serializer.dumps([cell, (1, "a"), {}, []]) == legacy([cell, (1, "a"), {}, []])
+
+def test_bytes_and_unknown_types():
+    assert serializer.dumps(DevRet(True, b"\xff\x00")) == b'{"succ": true, "cont": "_wA="}'
+    with pytest.raises(TypeError):
+        serializer.dumps({"x": object()})
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 4096, serializer.CHUNK_SIZE])
+def test_iterencode_chunks(chunk_size):
+    stack = bench.make_stack(random.Random(2))
+    response = {"version": 1, "id": 7, "result": {"dd": stack}}
+    chunks = list(serializer.iterencode(response, chunk_size=chunk_size))
+    assert b"".join(chunks) == serializer.dumps(response)
+    assert len(chunks) > 1 and all(len(c) >= chunk_size for c in chunks[:-1])
+    # 簇在第 STREAM_DEPTH 层整体编码, 每块不超过 chunk_size 加上一个簇
+    assert max(len(c) for c in chunks) < chunk_size + max(len(serializer.dumps(c)) for c in stack.cluster) + 16
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import json
+
+import pytest
+
+from devdata import DD, DDOfUserDefined
+from devfield import DeviceType, DevRet
+from driver import DriverBase
+import driverset
+from service import RPC_INVALID_REQUEST, RPC_METHOD_NOT_FOUND, RPC_SERVER_ERROR, DriverService, is_exec_request
+
+class FailingDriver(DriverBase):
+    def defineAddrRange(self):
+        return []
+
+    def parseDeviceData(self, addr_space) -> DD:
+        raise RuntimeError("parse failed")
+
+    def execCommand(self, cmd) -> DevRet:
+        return DevRet(True, b"")
+
+class OkDriver(FailingDriver):
+    def parseDeviceData(self, addr_space) -> DD:
+        return DDOfUserDefined()
+
+def parse_request(id: int, producer: str, model: str) -> dict:
+    params = {"type": DeviceType.PCS.value, "producer": producer, "model": model, "segment": []}
+    return {"jsonrpc": "2.0", "id": id, "method": "parseDeviceData", "params": params}
+
+def test_error_labels_only_for_registered_drivers():
+    service = DriverService()
+    driverset.DRIVERS.register(DeviceType.PCS, "test", "failing", FailingDriver())
+    try:
+        body = json.dumps([parse_request(i, "client-%d" % i, "model-%d" % i) for i in range(3)]
+                          + [parse_request(3, "test", "failing")]).encode()
+        service.handle("/v1/parse", body)
+    finally:
+        driverset.DRIVERS.unregister(DeviceType.PCS, "test", "failing")
+    errors = {labels: s.value for (name, labels), s in service.metrics.series.items() if name == "qingems_errors_total"}
+    assert errors == {
+        ("/v1/parse", "unknown", "unknown", "unknown"): 3,
+        ("/v1/parse", "PCS", "test", "failing"): 1,
+    }
+
+def test_exec_items_detected_after_decoding():
+    escaped = b'[{"jsonrpc": "2.0", "id": 1, "method": "\\u0065xecCommand", "params": {}}]'
+    assert is_exec_request("/v1/parse", json.loads(escaped))
+    assert is_exec_request("/v1/exec", [{"id": 1, "params": {}}])
+    assert is_exec_request("/v1/exec", {"id": 1})
+    # 数据中出现的 execCommand 不影响调度
+    payload = {"id": 1, "method": "parseDeviceData", "params": {"segment": [{"data": "execCommand"}]}}
+    assert not is_exec_request("/v1/parse", [payload])
+    assert not is_exec_request("/v1/parse", payload)
+    assert not is_exec_request("/v1/parse", [{"method": ["execCommand"]}, 1])
+
+@pytest.fixture
+def drivers():
+    driverset.DRIVERS.register(DeviceType.PCS, "test", "failing", FailingDriver())
+    driverset.DRIVERS.register(DeviceType.PCS, "test", "ok", OkDriver())
+    yield
+    driverset.DRIVERS.unregister(DeviceType.PCS, "test", "failing")
+    driverset.DRIVERS.unregister(DeviceType.PCS, "test", "ok")
+
+@pytest.mark.parametrize("executor", [False, True], ids=["inline", "executor"])
+def test_batch_error_items_do_not_affect_others(drivers, executor):
+    service = DriverService(concurrent.futures.ThreadPoolExecutor(4) if executor else None)
+    notify = parse_request(0, "test", "ok")
+    del notify["id"]
+    batch = [
+        parse_request(1, "test", "ok"),
+        parse_request(2, "test", "failing"),
+        "not an object",
+        dict(parse_request(3, "test", "ok"), method="noSuchMethod"),
+        notify,
+        parse_request(4, "test", "ok"),
+    ]
+    responses = json.loads(service.handle("/v1/parse", json.dumps(batch).encode()).body)
+    assert [r["id"] for r in responses] == [1, 2, None, 3, 4]
+    assert "dd" in responses[0]["result"] and "dd" in responses[4]["result"]
+    assert [r["error"]["code"] for r in responses[1:4]] == [RPC_SERVER_ERROR, RPC_INVALID_REQUEST, RPC_METHOD_NOT_FOUND]
+    assert responses[1]["error"]["message"] == "parse failed"
+
+def test_empty_batch_is_invalid():
+    response = json.loads(DriverService().handle("/v1/parse", b"[]").body)
+    assert response["id"] is None and response["error"]["code"] == RPC_INVALID_REQUEST
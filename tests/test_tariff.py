@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from devfield import EMChargingLevel, EMChargingTR
+import tariff
+from tariff import DAY, EnergyAccumulator, index_of, rebin
+
+HOUR = 3600
+# 某日 0点 (UTC)
+T0 = DAY * 20000
+
+def period(tz: int, begin: float, end: float, level: EMChargingLevel) -> EMChargingTR:
+    tr = EMChargingTR()
+    tr.tz, tr.begin, tr.end, tr.level = tz, int(begin * HOUR), int(end * HOUR), level
+    return tr
+
+def levels(secs) -> dict:
+    return {lv: s for lv, s in zip(tariff.LEVELS, secs) if s}
+
+# 谷 22:00~次日06:00 (跨0点), 峰 08:00~12:00, 其余不计费
+WRAPPED = index_of([period(0, 22, 6, EMChargingLevel.VALLEY), period(0, 8, 12, EMChargingLevel.PEAK)])
+
+def test_level_at_across_midnight():
+    assert WRAPPED.level_at(T0 + 23 * HOUR) == EMChargingLevel.VALLEY
+    assert WRAPPED.level_at(T0 + DAY + 3 * HOUR) == EMChargingLevel.VALLEY
+    assert WRAPPED.level_at(T0 + 6 * HOUR) == EMChargingLevel.FREE
+    assert WRAPPED.level_at(T0 + 9 * HOUR) == EMChargingLevel.PEAK
+    assert WRAPPED.level_at(T0 + 12 * HOUR) == EMChargingLevel.FREE
+
+def test_seconds_of_interval_spanning_midnight_and_days():
+    assert levels(WRAPPED.seconds(T0 + 20 * HOUR, T0 + DAY + 10 * HOUR)) == {
+        EMChargingLevel.FREE: 4 * HOUR, EMChargingLevel.VALLEY: 8 * HOUR, EMChargingLevel.PEAK: 2 * HOUR}
+    assert levels(WRAPPED.seconds(T0, T0 + 3 * DAY)) == {
+        EMChargingLevel.FREE: 36 * HOUR, EMChargingLevel.VALLEY: 24 * HOUR, EMChargingLevel.PEAK: 12 * HOUR}
+
+def test_timezone_shift_wraps_past_utc_midnight():
+    # 东8区 06:00~10:00 为 UTC 22:00~次日02:00
+    index = index_of([period(8, 6, 10, EMChargingLevel.SHARP)])
+    assert index.level_at(T0 + 22 * HOUR) == EMChargingLevel.SHARP
+    assert index.level_at(T0 + DAY + 2 * HOUR - 1) == EMChargingLevel.SHARP
+    assert index.level_at(T0 + DAY + 2 * HOUR) == EMChargingLevel.FREE
+    assert levels(index.seconds(T0, T0 + DAY)) == {EMChargingLevel.FREE: 20 * HOUR, EMChargingLevel.SHARP: 4 * HOUR}
+
+def test_counter_energy_split_at_midnight_period():
+    acc = EnergyAccumulator(WRAPPED)
+    acc.add_counter(T0 + 21 * HOUR, 1000.0)
+    acc.add_counter(T0 + DAY + 1 * HOUR, 1400.0)
+    assert acc.measure.total.total == pytest.approx(400.0)
+    assert acc.measure.valley.total == pytest.approx(300.0)
+    assert acc.measure.peak.total == 0
+
+def test_rebin_matches_accumulator():
+    times = [T0 + 21 * HOUR, T0 + DAY + 1 * HOUR, T0 + DAY + 9 * HOUR, T0 + DAY + 10 * HOUR]
+    values = [[1000.0, 1400.0, 1800.0, 1700.0], [0.0, 80.0, 80.0, 100.0]]
+    result = rebin(WRAPPED, times, values)
+    for row, energy in zip(values, result):
+        acc = EnergyAccumulator(WRAPPED)
+        for t, v in zip(times, row):
+            acc.add_counter(t, v)
+        assert energy[EMChargingLevel.VALLEY.value] == pytest.approx(acc.measure.valley.total)
+        assert energy[EMChargingLevel.PEAK.value] == pytest.approx(acc.measure.peak.total)
+        assert sum(energy) == pytest.approx(acc.measure.total.total)
+
+@pytest.mark.parametrize("counter", [True, False])
+def test_rebin_numpy_matches_pure_python(monkeypatch, counter):
+    pytest.importorskip("numpy")
+    times = [T0 + k * 5400 for k in range(40)]
+    # 含计数减小和 NaN 采样
+    values = [[k * k * 0.5 for k in range(40)], [1.0 + k % 7 for k in range(40)], [float("nan")] + [float(k) for k in range(39)]]
+    expected = rebin(WRAPPED, times, values, counter)
+    monkeypatch.setattr(tariff, "numpy", None)
+    actual = rebin(WRAPPED, times, values, counter)
+    assert len(actual) == len(expected)
+    for a, b in zip(actual, expected):
+        assert a == pytest.approx(b)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import typing
+import zlib
+
+from devdata import DD
+from devfield import DeviceType
+
+# 数据段参数 (addr_begin, addr_end, width, space, data)
+SegmentArgs = typing.Tuple[int, int, int, int, bytes]
+
+def preload() -> None:
+    """ 工作进程初始化: 预先加载驱动集合 """
+    import driverset
+    driverset.DRIVERS
+
+def parse_job(type: int, producer: str, model: str, space: int, order: str, segments: typing.List[SegmentArgs],
+              device_id: str = "") -> DD:
+    """ 在工作进程内解析设备数据, 只有原始数据段和解析结果跨进程传递 """
+    import driverset
+    import service
+    d = driverset.DRIVERS.ref(DeviceType(type), producer, model)
+    if d is None:
+        raise RuntimeError("No driver for [%s:%s:%s]" % (type, producer, model))
+    return d.parseDeviceData(service.make_address_space(space, order, segments, device_id))
+
+class ParsePool:
+    """ 多进程解析池
+
+    每个工作进程独立加载驱动, 请求按设备键哈希分片到固定进程, 有状态驱动的同一设备始终由同一进程处理.
+    未提供设备键的请求轮询分配.
+    """
+
+    def __init__(self, workers: int = None) -> None:
+        self.workers = workers or multiprocessing.cpu_count()
+        ctx = multiprocessing.get_context("spawn")
+        self.pool: typing.List[concurrent.futures.ProcessPoolExecutor] = [
+            concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx, initializer=preload)
+            for _ in range(self.workers)
+        ]
+        self.round_robin = itertools.cycle(range(self.workers))
+        # 启动全部工作进程, 避免首个请求承担进程启动开销
+        for f in [p.submit(preload) for p in self.pool]:
+            f.result()
+
+    def shard(self, device_key: str) -> int:
+        if not device_key:
+            return next(self.round_robin)
+        return zlib.crc32(device_key.encode("utf-8")) % self.workers
+
+    def submit(self, device_key: str, type: int, producer: str, model: str, space: int, order: str,
+               segments: typing.List[SegmentArgs], device_id: str = "") -> concurrent.futures.Future:
+        return self.pool[self.shard(device_key)].submit(parse_job, type, producer, model, space, order, segments, device_id)
+
+    def parse(self, device_key: str, type: int, producer: str, model: str, space: int, order: str,
+              segments: typing.List[SegmentArgs], device_id: str = "") -> DD:
+        return self.submit(device_key, type, producer, model, space, order, segments, device_id).result()
+
+    def shutdown(self) -> None:
+        for p in self.pool:
+            p.shutdown()